@@ -0,0 +1,447 @@
+"""
+Drives CBManager against a simulated full node to find how many clawback operations per block
+it sustains. Each block, senders create coins for recipients, claw back a share of the coins
+created earlier and the recipients claim the rest once they mature, while the simulator farms
+the block and moves the chain's clock forward. The report is JSON, so runs can be compared
+across releases. Spends are signed for the network in CHIA_ROOT's config, so point it at the
+simulator's root as the tests do:
+
+    export CHIA_ROOT=~/.chia/simulator/main
+    python -m benchmarks.load_test --senders 4 --recipients 4 --blocks 20 --creates-per-block 8
+    python -m benchmarks.load_test --scenario scenario.json --output results.json
+"""
+
+import asyncio
+import dataclasses
+import json
+import random
+import tempfile
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import click
+from chia.rpc.full_node_rpc_api import FullNodeRpcApi
+from chia.rpc.full_node_rpc_client import FullNodeRpcClient
+from chia.rpc.rpc_server import start_rpc_server
+from chia.rpc.wallet_rpc_api import WalletRpcApi
+from chia.rpc.wallet_rpc_client import WalletRpcClient
+from chia.simulator.full_node_simulator import FullNodeSimulator
+from chia.simulator.setup_nodes import setup_simulators_and_wallets
+from chia.simulator.simulator_protocol import FarmNewBlockProtocol
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.peer_info import PeerInfo
+from chia.types.spend_bundle import SpendBundle
+from chia.util.ints import uint16, uint64
+from chia.wallet.wallet_node import WalletNode
+
+from src.drivers.cb_costs import CLAIM, CLAW, CREATE
+from src.drivers.cb_manager import CBManager
+from src.drivers.cb_puzzles import HEIGHT, SECONDS
+from src.drivers.cb_store import CBStore, create_db_wrapper
+from src.drivers.cb_tracker import percentile
+
+# Failure classes, matched against the error the node returns when a spend is pushed
+DOUBLE_SPEND = "double_spend"
+COST_LIMIT = "cost_limit"
+EARLY_CLAIM = "early_claim"
+FEE_TOO_LOW = "fee_too_low"
+NOT_CONFIRMED = "not_confirmed"
+BUILD_FAILED = "build_failed"
+OTHER = "other"
+ERROR_CLASSES = {
+    "DOUBLE_SPEND": DOUBLE_SPEND,
+    "MEMPOOL_CONFLICT": DOUBLE_SPEND,
+    "BLOCK_COST_EXCEEDS_MAX": COST_LIMIT,
+    "INVALID_BLOCK_COST": COST_LIMIT,
+    "ASSERT_SECONDS_RELATIVE_FAILED": EARLY_CLAIM,
+    "ASSERT_HEIGHT_RELATIVE_FAILED": EARLY_CLAIM,
+    "INVALID_FEE": FEE_TOO_LOW,
+}
+
+# Spends still unconfirmed this many blocks after they were pushed count as failed
+MAX_CONFIRM_BLOCKS = 5
+
+# Stages timed for each operation, build and push in milliseconds and confirm in blocks
+BUILD = "build"
+PUSH = "push"
+CONFIRM = "confirm"
+PERCENTILES = {"p50": 0.5, "p90": 0.9, "p99": 0.99}
+
+
+@dataclass
+class Scenario:
+    senders: int = 2
+    recipients: int = 2
+    blocks: int = 10
+    creates_per_block: int = 4
+    amount: int = 1000000
+    fee: int = 0
+    timelock: int = 600
+    timelock_unit: str = SECONDS
+    # Seconds the chain's clock moves forward with each block
+    time_per_block: int = 300
+    # Share of created coins the sender claws back, the rest are claimed by the recipient
+    claw_share: float = 0.25
+    # Share of coins to be claimed that the recipient also tries to claim before they mature
+    early_claim_share: float = 0.1
+    # Blocks farmed to each sender before the run, each pays out two reward coins
+    funding_blocks: int = 10
+    seed: int = 0
+
+    @classmethod
+    def from_json_dict(cls, json_dict: Dict[str, Any]) -> "Scenario":
+        unknown = set(json_dict) - {field.name for field in dataclasses.fields(cls)}
+        if unknown:
+            raise ValueError(f"Unknown scenario fields: {', '.join(sorted(unknown))}")
+        return cls(**json_dict)
+
+
+@dataclass
+class Participant:
+    wallet_node: WalletNode
+    wallet_client: WalletRpcClient
+    manager: CBManager
+    puzzle_hash: bytes32
+
+
+@dataclass
+class TrackedCoin:
+    coin: Coin
+    sender: Participant
+    recipient: Participant
+    claw: bool
+    early_claim: bool
+    confirmed_height: int = 0
+    confirmed_timestamp: int = 0
+    # Set once a claw or claim of the coin is pending or done
+    settling: bool = False
+
+
+@dataclass
+class PendingOperation:
+    operation: str
+    spend: SpendBundle
+    # The clawback coin the operation creates or spends
+    cb_coin: Coin
+    # The coin whose creation confirms the operation, the clawback coin itself or the coin paid out of it
+    confirming_coin: Coin
+    pushed_height: int
+    manager: CBManager
+
+
+class LoadTest:
+    """Runs a scenario and records each operation's stage latencies, outcome and failure class."""
+
+    def __init__(
+        self,
+        scenario: Scenario,
+        full_node_api: FullNodeSimulator,
+        node_client: FullNodeRpcClient,
+        senders: List[Participant],
+        recipients: List[Participant],
+    ) -> None:
+        self.scenario = scenario
+        self.full_node_api = full_node_api
+        self.node_client = node_client
+        self.senders = senders
+        self.recipients = recipients
+        self.random = random.Random(scenario.seed)
+        self.coins: List[TrackedCoin] = []
+        self.pending: List[PendingOperation] = []
+        self.latencies: Dict[str, Dict[str, List[float]]] = {
+            operation: {BUILD: [], PUSH: [], CONFIRM: []} for operation in [CREATE, CLAW, CLAIM]
+        }
+        self.counts: Dict[str, Dict[str, int]] = {
+            operation: {"submitted": 0, "confirmed": 0} for operation in [CREATE, CLAW, CLAIM]
+        }
+        self.failures: Dict[str, Dict[str, int]] = {operation: {} for operation in [CREATE, CLAW, CLAIM]}
+        self.height = 0
+        self.timestamp = 0
+
+    def fail(self, operation: str, failure_class: str) -> None:
+        self.failures[operation][failure_class] = self.failures[operation].get(failure_class, 0) + 1
+
+    async def submit(self, operation: str, manager: CBManager, build) -> Optional[SpendBundle]:
+        """Builds and pushes one spend, timing both stages and classifying a rejection."""
+        start = time.perf_counter()
+        try:
+            spend = await build()
+        except Exception:
+            self.fail(operation, BUILD_FAILED)
+            return None
+        pushed = time.perf_counter()
+        self.latencies[operation][BUILD].append((pushed - start) * 1000)
+        try:
+            await self.node_client.push_tx(spend)
+        except ValueError as e:
+            await manager.reservations.release(spend.name())
+            error = str(e)
+            self.fail(operation, next((cls for code, cls in ERROR_CLASSES.items() if code in error), OTHER))
+            return None
+        finally:
+            self.latencies[operation][PUSH].append((time.perf_counter() - pushed) * 1000)
+        await manager.track(spend, operation, uint64(self.scenario.fee))
+        self.counts[operation]["submitted"] += 1
+        return spend
+
+    def add_pending(self, operation: str, spend: SpendBundle, cb_coin: Coin, manager: CBManager) -> None:
+        if operation == CREATE:
+            confirming_coin = cb_coin
+        else:
+            confirming_coin = [coin for coin in spend.additions() if coin.parent_coin_info == cb_coin.name()][0]
+        self.pending.append(PendingOperation(operation, spend, cb_coin, confirming_coin, self.height, manager))
+
+    async def create(self, sender: Participant, recipient: Participant) -> None:
+        scenario = self.scenario
+        spend = await self.submit(
+            CREATE,
+            sender.manager,
+            lambda: sender.manager.create_cb_coin(
+                uint64(scenario.amount),
+                recipient.puzzle_hash,
+                sender.puzzle_hash,
+                uint64(scenario.timelock),
+                fee=uint64(scenario.fee),
+                timelock_unit=scenario.timelock_unit,
+            ),
+        )
+        if spend is None:
+            return
+        cb_coin = [coin for coin in spend.additions() if coin.amount == scenario.amount][0]
+        await sender.manager.add_new_coin(
+            cb_coin, recipient.puzzle_hash, sender.puzzle_hash, uint64(scenario.timelock), scenario.timelock_unit
+        )
+        self.add_pending(CREATE, spend, cb_coin, sender.manager)
+        claw = self.random.random() < scenario.claw_share
+        early_claim = not claw and self.random.random() < scenario.early_claim_share
+        self.coins.append(TrackedCoin(cb_coin, sender, recipient, claw, early_claim))
+
+    async def claw(self, tracked: TrackedCoin) -> None:
+        tracked.settling = True
+        manager = tracked.sender.manager
+        cb_info = await manager.cb_store.get_coin_record(tracked.coin.name())
+
+        async def build() -> SpendBundle:
+            return await manager.create_clawback_spend(cb_info, tracked.sender.puzzle_hash, uint64(self.scenario.fee))
+
+        spend = await self.submit(CLAW, manager, build)
+        if spend is None:
+            tracked.settling = False
+        else:
+            self.add_pending(CLAW, spend, tracked.coin, manager)
+
+    async def claim(self, tracked: TrackedCoin, early: bool = False) -> None:
+        manager = tracked.recipient.manager
+        if not early:
+            tracked.settling = True
+
+        async def build() -> SpendBundle:
+            return await manager.create_claim_spend(
+                tracked.coin, tracked.recipient.puzzle_hash, uint64(self.scenario.fee)
+            )
+
+        spend = await self.submit(CLAIM, manager, build)
+        if spend is not None:
+            self.add_pending(CLAIM, spend, tracked.coin, manager)
+        elif not early:
+            tracked.settling = False
+
+    def matured(self, tracked: TrackedCoin) -> bool:
+        if self.scenario.timelock_unit == HEIGHT:
+            return self.height > tracked.confirmed_height + self.scenario.timelock
+        # The relative timelock is checked against the last transaction block before the spend
+        return self.timestamp >= tracked.confirmed_timestamp + self.scenario.timelock + self.scenario.time_per_block
+
+    async def run_block(self, index: int) -> None:
+        await asyncio.gather(*(sender.manager.reconcile_reservations() for sender in self.senders))
+        operations = []
+        for i in range(self.scenario.creates_per_block):
+            sender = self.senders[(index * self.scenario.creates_per_block + i) % len(self.senders)]
+            operations.append(self.create(sender, self.random.choice(self.recipients)))
+        for tracked in self.coins:
+            if tracked.confirmed_height == 0 or tracked.settling:
+                continue
+            if tracked.claw:
+                operations.append(self.claw(tracked))
+            elif self.matured(tracked):
+                operations.append(self.claim(tracked))
+            elif tracked.early_claim:
+                tracked.early_claim = False
+                operations.append(self.claim(tracked, early=True))
+        await asyncio.gather(*operations)
+
+    async def farm_block(self) -> None:
+        block = await self.full_node_api.farm_new_transaction_block(FarmNewBlockProtocol(bytes32(b"\0" * 32)))
+        assert block.foliage_transaction_block is not None
+        self.height = block.height
+        self.timestamp = block.foliage_transaction_block.timestamp
+        await self.full_node_api.wait_for_wallets_synced(
+            [participant.wallet_node for participant in self.senders + self.recipients], timeout=60
+        )
+        await self.check_confirmations()
+
+    async def check_confirmations(self) -> None:
+        if len(self.pending) == 0:
+            return
+        records = await self.node_client.get_coin_records_by_names(
+            list({pending.confirming_coin.name() for pending in self.pending}), include_spent_coins=True
+        )
+        confirmed_names = {record.name: record for record in records}
+        tracked_coins = {tracked.coin.name(): tracked for tracked in self.coins}
+        # The clawback coins spent by a confirmed claw or claim, any other spend of them can't confirm
+        settled = {
+            pending.cb_coin.name()
+            for pending in self.pending
+            if pending.operation != CREATE and pending.confirming_coin.name() in confirmed_names
+        }
+        still_pending: List[PendingOperation] = []
+        for pending in self.pending:
+            tracked = tracked_coins[pending.cb_coin.name()]
+            record = confirmed_names.get(pending.confirming_coin.name())
+            if record is not None:
+                self.counts[pending.operation]["confirmed"] += 1
+                self.latencies[pending.operation][CONFIRM].append(self.height - pending.pushed_height)
+                if pending.operation == CREATE:
+                    tracked.confirmed_height = record.confirmed_block_index
+                    tracked.confirmed_timestamp = record.timestamp
+                continue
+            if pending.operation != CREATE and pending.cb_coin.name() in settled:
+                self.fail(pending.operation, DOUBLE_SPEND)
+            elif self.height - pending.pushed_height >= MAX_CONFIRM_BLOCKS:
+                self.fail(pending.operation, NOT_CONFIRMED)
+                await pending.manager.reservations.release(pending.spend.name())
+                if pending.operation != CREATE:
+                    tracked.settling = False
+            else:
+                still_pending.append(pending)
+        self.pending = still_pending
+
+    async def run(self) -> Dict[str, Any]:
+        start = time.perf_counter()
+        for index in range(self.scenario.blocks):
+            await self.run_block(index)
+            await self.farm_block()
+        elapsed = time.perf_counter() - start
+        confirmed = sum(counts["confirmed"] for counts in self.counts.values())
+        return {
+            "scenario": dataclasses.asdict(self.scenario),
+            "elapsed_seconds": elapsed,
+            "operations": {
+                operation: {**self.counts[operation], "failed": self.failures[operation]} for operation in self.counts
+            },
+            "throughput": {
+                "confirmed_per_block": confirmed / self.scenario.blocks,
+                "confirmed_per_second": confirmed / elapsed,
+            },
+            "latency": {
+                operation: {
+                    f"{stage}_{'blocks' if stage == CONFIRM else 'ms'}": {
+                        name: percentile(values, fraction) for name, fraction in PERCENTILES.items()
+                    }
+                    for stage, values in stages.items()
+                    if len(values) > 0
+                }
+                for operation, stages in self.latencies.items()
+            },
+        }
+
+
+@asynccontextmanager
+async def simulation(
+    scenario: Scenario, db_dir: Path
+) -> AsyncIterator[Tuple[FullNodeSimulator, FullNodeRpcClient, List[Participant], List[Participant]]]:
+    """Starts a simulated full node and a wallet for each sender and recipient, with RPC servers for all of them."""
+    async for full_nodes, wallets, bt in setup_simulators_and_wallets(1, scenario.senders + scenario.recipients, {}):
+        full_node_api: FullNodeSimulator = full_nodes[0]
+        config = bt.config
+        async with AsyncExitStack() as stack:
+
+            async def serve(api) -> uint16:
+                server = await start_rpc_server(
+                    api,
+                    config["self_hostname"],
+                    config["daemon_port"],
+                    uint16(0),
+                    lambda *args: None,
+                    bt.root_path,
+                    config,
+                    connect_to_daemon=False,
+                )
+                stack.push_async_callback(server.await_closed)
+                stack.callback(server.close)
+                return server.listen_port
+
+            async def client(client_type, port: uint16):
+                rpc_client = await client_type.create(config["self_hostname"], port, bt.root_path, config)
+                stack.push_async_callback(rpc_client.await_closed)
+                stack.callback(rpc_client.close)
+                return rpc_client
+
+            node_client = await client(FullNodeRpcClient, await serve(FullNodeRpcApi(full_node_api.full_node)))
+            participants: List[Participant] = []
+            for index, (wallet_node, server) in enumerate(wallets):
+                wallet_node.config["trusted_peers"] = {
+                    full_node_api.full_node.server.node_id.hex(): full_node_api.full_node.server.node_id.hex()
+                }
+                await server.start_client(PeerInfo("127.0.0.1", uint16(full_node_api.server._port)), None)
+                wallet = wallet_node.wallet_state_manager.main_wallet
+                wallet_client = await client(WalletRpcClient, await serve(WalletRpcApi(wallet_node)))
+                wrapper = await create_db_wrapper(db_dir / f"clawback_{index}.db")
+                cb_store = await CBStore.create(wrapper)
+                stack.push_async_callback(cb_store.close)
+                manager = await CBManager.create(node_client, wallet_client, cb_store)
+                participants.append(Participant(wallet_node, wallet_client, manager, await wallet.get_new_puzzlehash()))
+            senders = participants[: scenario.senders]
+            for sender in senders:
+                await full_node_api.farm_blocks_to_wallet(
+                    scenario.funding_blocks, sender.wallet_node.wallet_state_manager.main_wallet, timeout=None
+                )
+            full_node_api.use_current_time = False
+            full_node_api.time_per_block = scenario.time_per_block
+            await full_node_api.wait_for_wallets_synced([participant.wallet_node for participant in participants])
+            yield full_node_api, node_client, senders, participants[scenario.senders :]
+
+
+async def run(scenario: Scenario) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp:
+        async with simulation(scenario, Path(tmp)) as (full_node_api, node_client, senders, recipients):
+            load_test = LoadTest(scenario, full_node_api, node_client, senders, recipients)
+            load_test.height = full_node_api.full_node.blockchain.get_peak_height() or 0
+            return await load_test.run()
+
+
+@click.command()
+@click.option("--scenario", "scenario_file", help="A JSON file of Scenario fields", type=str, default=None)
+@click.option("--senders", help="Simulated senders, overrides the scenario", type=int, default=None)
+@click.option("--recipients", help="Simulated recipients, overrides the scenario", type=int, default=None)
+@click.option("--blocks", help="Blocks to run for, overrides the scenario", type=int, default=None)
+@click.option("--creates-per-block", help="Coins created each block, overrides the scenario", type=int, default=None)
+@click.option("--output", help="The file to write the JSON report to, or - for stdout", type=str, default="-")
+def main(
+    scenario_file: Optional[str],
+    senders: Optional[int],
+    recipients: Optional[int],
+    blocks: Optional[int],
+    creates_per_block: Optional[int],
+    output: str,
+) -> None:
+    fields: Dict[str, Any] = {}
+    if scenario_file is not None:
+        with open(scenario_file) as file:
+            fields = json.load(file)
+    overrides = {"senders": senders, "recipients": recipients, "blocks": blocks, "creates_per_block": creates_per_block}
+    fields.update((name, value) for name, value in overrides.items() if value is not None)
+    report = json.dumps(asyncio.run(run(Scenario.from_json_dict(fields))), indent=2)
+    if output == "-":
+        print(report)
+    else:
+        with open(output, "w") as file:
+            file.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
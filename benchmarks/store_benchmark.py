@@ -0,0 +1,106 @@
+"""
+Measures how many reads a clawback database serves while a bulk write runs, for a rollback
+journal with a single reader, the DBWrapper2 defaults CBStore used to get and the tuned settings.
+
+    python -m benchmarks.store_benchmark --records 100000 --readers 8
+"""
+
+import asyncio
+import random
+import tempfile
+import time
+from pathlib import Path
+from secrets import token_bytes
+from typing import List, Tuple
+
+import click
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.util.ints import uint32, uint64
+
+from src.drivers.cb_info import CBInfo
+from src.drivers.cb_store import CBStore, DBSettings, create_db_wrapper
+
+SETTINGS = {
+    "rollback journal, 1 reader": DBSettings(journal_mode="DELETE", reader_count=1, synchronous="FULL"),
+    # What DBWrapper2.create sets up, with SQLite's default cache and no memory mapping
+    "DBWrapper2 defaults": DBSettings(cache_size_kib=2000, mmap_size=0, synchronous="FULL"),
+    "tuned": DBSettings(),
+}
+WRITE_BATCH_SIZE = 1000
+RECIPIENTS = [bytes32(token_bytes(32)) for _ in range(100)]
+
+
+def make_records(count: int) -> List[CBInfo]:
+    return [
+        CBInfo(
+            Coin(bytes32(token_bytes(32)), bytes32(token_bytes(32)), uint64(random.randint(1, 10 ** 12))),
+            random.choice(RECIPIENTS),
+            bytes32(b"\1" * 32),
+            uint64(3600),
+            uint32(random.randint(1, 1000)),
+            uint32(0),
+            False,
+            uint64(int(time.time())),
+        )
+        for _ in range(count)
+    ]
+
+
+async def write_records(cb_store: CBStore, records: List[CBInfo]) -> float:
+    start = time.perf_counter()
+    for i in range(0, len(records), WRITE_BATCH_SIZE):
+        await cb_store.add_coin_records([(0, record, None) for record in records[i : i + WRITE_BATCH_SIZE]])
+    return time.perf_counter() - start
+
+
+async def read_until(cb_store: CBStore, names: List[bytes32], done: asyncio.Event) -> List[float]:
+    latencies: List[float] = []
+    while not done.is_set():
+        start = time.perf_counter()
+        await cb_store.get_coin_record(random.choice(names))
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def measure(
+    cb_store: CBStore, names: List[bytes32], readers: int, writes: List[CBInfo]
+) -> Tuple[int, float, float]:
+    """Returns the reads done while the records were written, the p99 read latency and the write time."""
+    done = asyncio.Event()
+    tasks = [asyncio.create_task(read_until(cb_store, names, done)) for _ in range(readers)]
+    await asyncio.sleep(0)
+    write_time = await write_records(cb_store, writes)
+    done.set()
+    latencies = sorted(latency for results in await asyncio.gather(*tasks) for latency in results)
+    return len(latencies), latencies[int(len(latencies) * 0.99)], write_time
+
+
+async def run(records: int, writes: int, readers: int) -> None:
+    seed = make_records(records)
+    bulk = make_records(writes)
+    names = [record.name() for record in seed]
+    for label, settings in SETTINGS.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            cb_store = await CBStore.create(await create_db_wrapper(Path(tmp) / "clawback.db", settings))
+            try:
+                await write_records(cb_store, seed)
+                reads, p99, write_time = await measure(cb_store, names, readers, bulk)
+                print(
+                    f"{label}: wrote {writes} records in {write_time:.2f}s, {reads / write_time:.0f} reads/s "
+                    f"alongside, p99 read latency {p99 * 1000:.1f}ms"
+                )
+            finally:
+                await cb_store.close()
+
+
+@click.command()
+@click.option("--records", help="Records in the database before the bulk write", type=int, default=20000)
+@click.option("--writes", help="Records written by the bulk write", type=int, default=20000)
+@click.option("--readers", help="Concurrent readers", type=int, default=8)
+def main(records: int, writes: int, readers: int) -> None:
+    asyncio.run(run(records, writes, readers))
+
+
+if __name__ == "__main__":
+    main()
@@ -65,6 +65,7 @@ setup(
     ],
     extras_require=dict(
         dev=dev_dependencies,
+        uvloop=["uvloop"],
     ),
     project_urls={
         "Bug Reports": "https://github.com/Chia-Network/chia-clawback-primitive",
@@ -1,25 +1,55 @@
 import asyncio
+import json
+import sys
 import time
+from contextlib import ExitStack
 from decimal import Decimal
 from pathlib import Path
 from secrets import token_bytes
-from typing import Optional
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, TextIO, Tuple
 
 import click
+from blspy import G1Element
+from chia.rpc.wallet_rpc_client import WalletRpcClient
+from chia.types.blockchain_format.coin import Coin
 from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_record import CoinRecord
+from chia.types.spend_bundle import SpendBundle
 from chia.util.bech32m import decode_puzzle_hash
-from chia.util.db_wrapper import DBWrapper2
+from chia.util.byte_types import hexstr_to_bytes
 from chia.util.ints import uint32, uint64
+from chia.util.keychain import Keychain
 from chia.wallet.transaction_record import TransactionRecord
 from chia.wallet.util.transaction_type import TransactionType
 
 from src import __version__
-from src.clients import get_node_and_wallet_clients
-from src.drivers.cb_manager import TWO_WEEKS, CBManager
-from src.drivers.cb_store import CBStore
+from src.clients import get_node_and_wallet_clients, get_wallet_client
+from src.drivers.cb_compression import compress_spend_bundle
+from src.drivers.cb_consolidation import ConsolidationPolicy, WalletConsolidator
+from src.drivers.cb_costs import (
+    CLAIM,
+    CLAIM_WITH_FEE,
+    CLAW,
+    CLAW_WITH_FEE,
+    CREATE,
+    DEFAULT_TARGET_BLOCKS,
+    max_merged_spends,
+)
+from src.drivers.cb_export import EXPORT_FORMATS, NDJSON, export_records, import_records
+from src.drivers.cb_info import SECONDS_PER_BLOCK, CBInfo
+from src.drivers.cb_manager import ONE_DAY, TWO_WEEKS, CBManager, CBPayment
+from src.drivers.cb_payout_queue import DEFAULT_MAX_LATENCY, DEFAULT_MAX_PAYOUTS, PayoutQueue
+from src.drivers.cb_puzzles import HEIGHT, SECONDS, TIMELOCK_CONDITIONS
+from src.drivers.cb_signing import SigningRequest, SigningResponse, sign_request
+from src.drivers.cb_store import UNSPENT, CBStore, create_db_wrapper
+from src.drivers.cb_watcher import WATCH_INTERVAL, CBWatcher
+from src.profiling import CommandProfiler, format_summary
 
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
 MOJO_CONST = 1000000000000
+SHARED_DB_NAME = "clawback.db"
+# Operations a batch runs at once
+BATCH_CONCURRENCY = 4
 
 
 def monkey_patch_click() -> None:
@@ -28,6 +58,428 @@ def monkey_patch_click() -> None:
     click.core._verify_python3_env = lambda *args, **kwargs: 0  # type: ignore
 
 
+def parse_fee(fee_str: str) -> Optional[uint64]:
+    # None tells the manager to pick the fee from the node's fee estimate
+    if fee_str == "auto":
+        return None
+    return uint64(int(Decimal(fee_str) * MOJO_CONST))
+
+
+async def open_cb_store(db_path: str, fingerprint: Optional[int], shared_db: bool = False) -> CBStore:
+    if shared_db:
+        wrapper = await create_db_wrapper(Path(db_path) / SHARED_DB_NAME)
+        return (await CBStore.create(wrapper)).scoped(fingerprint)
+    wrapper = await create_db_wrapper(Path(db_path) / f"clawback_{fingerprint}.db")
+    return await CBStore.create(wrapper)
+
+
+async def single_batch(records: List[CBInfo]) -> AsyncIterator[List[CBInfo]]:
+    yield records
+
+
+def timelock_unit_name(record: CBInfo) -> str:
+    return "blocks" if record.timelock_unit == HEIGHT else "seconds"
+
+
+def describe_time_left(record: CBInfo, now: int, peak_height: int) -> str:
+    remaining = record.remaining(now, peak_height)
+    if remaining is None:
+        return "pending"
+    return f"{remaining} {timelock_unit_name(record)}"
+
+
+async def print_json_records(batches: AsyncIterator[List[CBInfo]], ndjson: bool = False, peak_height: int = 0) -> None:
+    """Prints records as JSON as each batch arrives, so long listings start printing right away."""
+    now = int(time.time())
+    if not ndjson:
+        print("[", end="")
+    first = True
+    async for batch in batches:
+        for record in batch:
+            line = json.dumps(record.to_json_dict(now, peak_height))
+            if ndjson:
+                print(line, flush=True)
+            else:
+                print(("\n  " if first else ",\n  ") + line, end="", flush=True)
+            first = False
+    if not ndjson:
+        print("\n]" if not first else "]")
+
+
+async def push_wallet_spend(
+    wallet_client: WalletRpcClient,
+    spend: SpendBundle,
+    to_puzzle_hash: bytes32,
+    amount: uint64,
+    fee: uint64,
+    wallet_id: int,
+) -> Dict[str, Any]:
+    tx = TransactionRecord(
+        confirmed_at_height=uint32(0),
+        created_at_time=uint64(time.time()),
+        to_puzzle_hash=to_puzzle_hash,
+        amount=uint64(amount),
+        fee_amount=uint64(fee),
+        confirmed=False,
+        sent=uint32(10),
+        spend_bundle=spend,
+        additions=spend.additions(),
+        removals=spend.removals(),
+        wallet_id=wallet_id,
+        sent_to=[],
+        trade_id=None,
+        type=uint32(TransactionType.INCOMING_TX.value),
+        name=bytes32(token_bytes(32)),
+        memos=[],
+    )
+    return await wallet_client.push_transactions([tx])
+
+
+async def get_unspent_coin_records(manager: CBManager, coin_ids: List[bytes32]) -> List[CoinRecord]:
+    # Skips the manager's cache, a coin spent moments ago must not look unspent
+    coin_records = {
+        coin_record.name: coin_record
+        for coin_record in await manager.node_client.client.get_coin_records_by_names(
+            coin_ids, include_spent_coins=True
+        )
+    }
+    for coin_id in coin_ids:
+        if coin_id not in coin_records:
+            raise ValueError(f"Coin not found: {coin_id.hex()}")
+        if coin_records[coin_id].spent:
+            raise ValueError(f"This coin has already been spent: {coin_id.hex()}")
+    return [coin_records[coin_id] for coin_id in coin_ids]
+
+
+async def check_spend(manager: CBManager, spend: SpendBundle) -> None:
+    """Validates the spend before it's pushed, releasing its coins and raising ValueError if it would be rejected."""
+    try:
+        await manager.validator.check(spend)
+    except ValueError:
+        await manager.reservations.release(spend.name())
+        raise
+
+
+async def create_coin(
+    manager: CBManager,
+    wallet_client: WalletRpcClient,
+    recipient_ph: bytes32,
+    amount: int,
+    timelock: int,
+    timelock_unit: str,
+    wallet_id: int,
+    fee: Optional[uint64],
+    target_blocks: int,
+    hint_sender: bool = False,
+) -> Coin:
+    """Funds, submits and stores a new clawback coin, raising ValueError if the wallet rejects the spend."""
+    sender_ph = decode_puzzle_hash(await wallet_client.get_next_address(wallet_id, True))
+    spend, fee = await manager.build_with_fee(
+        lambda fee_amount: manager.create_cb_coin(
+            uint64(amount),
+            recipient_ph,
+            sender_ph,
+            uint64(timelock),
+            fee=fee_amount,
+            timelock_unit=timelock_unit,
+            hint_sender=hint_sender,
+        ),
+        fee,
+        CREATE,
+        target_blocks,
+    )
+    cb_coin = [coin for coin in spend.additions() if coin.amount == amount][0]
+    await check_spend(manager, spend)
+    res = await push_wallet_spend(wallet_client, spend, cb_coin.puzzle_hash, uint64(amount), fee, wallet_id)
+    if not res["success"]:
+        await manager.reservations.release(spend.name())
+        raise ValueError(f"Failed to create clawback coin: {res}")
+    await manager.add_new_coin(cb_coin, recipient_ph, sender_ph, uint64(timelock), timelock_unit)
+    await manager.track(spend, CREATE, fee)
+    return cb_coin
+
+
+def split_fee(fee: Optional[uint64], sizes: List[int]) -> List[Optional[uint64]]:
+    """
+    Splits a fee over spends by how many coins each merges, the remainder going to the first.
+    Without a fee each spend is priced from the node's estimate.
+    """
+    if fee is None:
+        return [None] * len(sizes)
+    shares = [uint64(fee * size // sum(sizes)) for size in sizes]
+    shares[0] = uint64(shares[0] + fee - sum(shares))
+    return shares
+
+
+async def build_groups(
+    manager: CBManager,
+    groups: List[List[Any]],
+    build: Callable[[List[Any], uint64], Awaitable[SpendBundle]],
+    fee: Optional[uint64],
+    shape: str,
+    target_blocks: int,
+) -> List[Tuple[SpendBundle, uint64]]:
+    """
+    Builds and validates a spend for each group of coins before any is pushed, so a group that
+    would be rejected leaves nothing half done. The fee is split over the spends. If any spend
+    fails, the coins reserved by every spend built are released and ValueError is raised.
+    """
+    built: List[Tuple[SpendBundle, uint64]] = []
+    try:
+        for group, group_fee in zip(groups, split_fee(fee, [len(group) for group in groups])):
+            spend, spend_fee = await manager.build_with_fee(
+                lambda fee_amount: build(group, fee_amount), group_fee, shape, target_blocks, len(group)
+            )
+            built.append((spend, spend_fee))
+            await manager.validator.check(spend)
+    except Exception:
+        for spend, _ in built:
+            await manager.discard(spend)
+        raise
+    return built
+
+
+async def push_groups(
+    manager: CBManager,
+    built: List[Tuple[SpendBundle, uint64]],
+    push: Callable[[int, SpendBundle, uint64], Awaitable[None]],
+    operation: str,
+) -> uint64:
+    """
+    Pushes the spends built for each group in order, returning the fees paid. If one is turned
+    down, it and the spends after it are released, and the ValueError raised says how many
+    spends were already submitted.
+    """
+    total_fee = uint64(0)
+    for index, (spend, spend_fee) in enumerate(built):
+        try:
+            await push(index, spend, spend_fee)
+        except ValueError as e:
+            for unpushed, _ in built[index:]:
+                await manager.discard(unpushed)
+            if index > 0:
+                raise ValueError(f"Submitted {index} of {len(built)} spends, the rest failed: {e}") from e
+            raise
+        await manager.track(spend, operation, spend_fee)
+        total_fee = uint64(total_fee + spend_fee)
+    return total_fee
+
+
+async def claw_coin(
+    manager: CBManager,
+    wallet_client: WalletRpcClient,
+    coin_ids: List[bytes32],
+    target_address: Optional[str],
+    wallet_id: int,
+    fee: Optional[uint64],
+    target_blocks: int,
+) -> uint64:
+    """
+    Submits spends clawing the coins back to the target address or the wallet, returning the
+    fees paid. Coins are merged into one output per spend, as many as fit under the cost limit,
+    and the fee is split over the spends.
+    """
+    if not target_address:
+        target_address = await wallet_client.get_next_address(wallet_id, True)
+    target_ph = decode_puzzle_hash(target_address)
+    coin_records = await get_unspent_coin_records(manager, coin_ids)
+    cb_infos = await asyncio.gather(*(manager.get_cb_info_by_id(coin_id) for coin_id in coin_ids))
+    for coin_id, cb_info in zip(coin_ids, cb_infos):
+        if cb_info is None:
+            raise ValueError(f"Not a clawback coin: {coin_id.hex()}")
+    group_size = max_merged_spends(CLAW)
+    groups = [cb_infos[i : i + group_size] for i in range(0, len(cb_infos), group_size)]
+    built = await build_groups(
+        manager,
+        groups,
+        lambda group, fee_amount: manager.create_merged_clawback_spend(group, target_ph, fee_amount),
+        fee,
+        CLAW_WITH_FEE,
+        target_blocks,
+    )
+
+    async def push(index: int, spend: SpendBundle, spend_fee: uint64) -> None:
+        amount = uint64(
+            sum(coin_record.coin.amount for coin_record in coin_records[index * group_size : (index + 1) * group_size])
+        )
+        res = await push_wallet_spend(wallet_client, spend, target_ph, amount, spend_fee, wallet_id)
+        if not res["success"]:
+            raise ValueError(f"Failed to submit clawback spend: {res}")
+
+    return await push_groups(manager, built, push, CLAW)
+
+
+async def claim_coin(
+    manager: CBManager,
+    wallet_client: WalletRpcClient,
+    coin_ids: List[bytes32],
+    target_address: Optional[str],
+    wallet_id: int,
+    fee: Optional[uint64],
+    target_blocks: int,
+) -> uint64:
+    """
+    Submits spends claiming the coins to the target address or the wallet, returning the fees
+    paid. Coins are merged into one output per spend, as many as fit under the cost limit, and
+    the fee is split over the spends.
+    """
+    if not target_address:
+        target_address = await wallet_client.get_next_address(wallet_id, True)
+    target_ph = decode_puzzle_hash(target_address)
+    coins = [coin_record.coin for coin_record in await get_unspent_coin_records(manager, coin_ids)]
+    group_size = max_merged_spends(CLAIM)
+    groups = [coins[i : i + group_size] for i in range(0, len(coins), group_size)]
+
+    def claim_error(e: ValueError) -> ValueError:
+        if "_RELATIVE_FAILED" in str(e.args[0]):
+            return ValueError("You are trying to claim the coin too early")
+        return ValueError(f"Error: {e}")
+
+    async def push(index: int, spend: SpendBundle, spend_fee: uint64) -> None:
+        try:
+            await manager.node_client.push_tx(spend)
+        except ValueError as e:
+            raise claim_error(e)
+
+    try:
+        built = await build_groups(
+            manager,
+            groups,
+            lambda group, fee_amount: manager.create_merged_claim_spend(group, target_ph, fee_amount),
+            fee,
+            CLAIM_WITH_FEE,
+            target_blocks,
+        )
+    except ValueError as e:
+        raise claim_error(e)
+    return await push_groups(manager, built, push, CLAIM)
+
+
+async def run_operation(
+    manager: CBManager,
+    wallet_client: WalletRpcClient,
+    operation: Dict[str, Any],
+    payout_queue: Optional[PayoutQueue] = None,
+) -> Dict[str, Any]:
+    """
+    Runs one batch operation and returns what it did, raising ValueError for a failed or malformed
+    one. Creates from the payout queue's wallet are queued to be created with others in one spend.
+    """
+
+    def field(name: str) -> Any:
+        if name not in operation:
+            raise ValueError(f"{operation.get('op')} needs {name}")
+        return operation[name]
+
+    op = field("op")
+    fee = parse_fee(str(operation.get("fee", "0")))
+    wallet_id = int(operation.get("wallet_id", 1))
+    target_blocks = int(operation.get("target_blocks", DEFAULT_TARGET_BLOCKS))
+    if op == CREATE:
+        timelock_unit = operation.get("timelock_unit", SECONDS)
+        if timelock_unit not in TIMELOCK_CONDITIONS:
+            raise ValueError(f"Unknown timelock unit: {timelock_unit}")
+        timelock = operation.get("timelock")
+        if timelock is None:
+            timelock = TWO_WEEKS if timelock_unit == SECONDS else int(TWO_WEEKS / SECONDS_PER_BLOCK)
+        if payout_queue is not None and wallet_id == payout_queue.wallet_id:
+            sender_ph = decode_puzzle_hash(await wallet_client.get_next_address(wallet_id, True))
+            payment = CBPayment(
+                uint64(int(Decimal(str(field("amount"))) * MOJO_CONST)),
+                decode_puzzle_hash(field("to")),
+                sender_ph,
+                uint64(timelock),
+                timelock_unit,
+                bool(operation.get("hint_sender", False)),
+            )
+            cb_coin = await payout_queue.submit(payment, fee)
+            return {"coin_id": cb_coin.name().hex(), "amount": cb_coin.amount}
+        cb_coin = await create_coin(
+            manager,
+            wallet_client,
+            decode_puzzle_hash(field("to")),
+            int(Decimal(str(field("amount"))) * MOJO_CONST),
+            int(timelock),
+            timelock_unit,
+            wallet_id,
+            fee,
+            target_blocks,
+            bool(operation.get("hint_sender", False)),
+        )
+        return {"coin_id": cb_coin.name().hex(), "amount": cb_coin.amount}
+    coin_id = bytes32.from_hexstr(field("coin_id"))
+    if op in (CLAW, CLAIM):
+        spend_coin = claw_coin if op == CLAW else claim_coin
+        fee = await spend_coin(
+            manager, wallet_client, [coin_id], operation.get("target_address"), wallet_id, fee, target_blocks
+        )
+        return {"coin_id": coin_id.hex(), "fee": fee}
+    if op == "show":
+        record = await manager.get_cb_info_by_id(coin_id)
+        if record is None:
+            raise ValueError(f"Not a clawback coin: {coin_id.hex()}")
+        return record.to_json_dict(int(time.time()), await manager.node_client.get_peak_height() or 0)
+    raise ValueError(f"Unknown operation: {op}")
+
+
+async def run_batch(
+    source: TextIO,
+    output: TextIO,
+    run: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+    concurrency: int = BATCH_CONCURRENCY,
+) -> Tuple[int, int]:
+    """
+    Runs the operations read from NDJSON lines, up to concurrency at once, and writes one NDJSON
+    result per operation as it finishes. Results carry the operation's line number and its id if
+    it had one. Returns the number of operations run and how many of them failed.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    tasks: List["asyncio.Future[bool]"] = []
+
+    async def run_line(number: int, line: str) -> bool:
+        result: Dict[str, Any] = {"line": number}
+        try:
+            operation = json.loads(line)
+            if not isinstance(operation, dict):
+                raise ValueError("Each line must hold a JSON object")
+            result.update((key, operation[key]) for key in ["id", "op"] if key in operation)
+            result.update(await run(operation))
+            result["success"] = True
+        except Exception as e:
+            result["success"] = False
+            result["error"] = str(e) or type(e).__name__
+        finally:
+            semaphore.release()
+        output.write(json.dumps(result) + "\n")
+        output.flush()
+        return result["success"]
+
+    number = 0
+    while True:
+        # Read off the event loop, a slow producer on stdin mustn't hold up the running operations
+        line = await loop.run_in_executor(None, source.readline)
+        if line == "":
+            break
+        number += 1
+        if line.strip():
+            await semaphore.acquire()
+            tasks.append(asyncio.ensure_future(run_line(number, line)))
+    results = await asyncio.gather(*tasks)
+    return len(results), results.count(False)
+
+
+def target_blocks_option(func):
+    return click.option(
+        "-tb",
+        "--target-blocks",
+        help="With --fee auto, the number of transaction blocks the spend should confirm within",
+        required=False,
+        type=int,
+        default=DEFAULT_TARGET_BLOCKS,
+    )(func)
+
+
 def common_options(func):
     func = click.option(
         "-db",
@@ -37,6 +489,12 @@ def common_options(func):
         type=str,
         default="",
     )(func)
+    func = click.option(
+        "--shared-db",
+        help="Keep this wallet's coins in the clawback.db shared by all wallets instead of its own database",
+        is_flag=True,
+        default=False,
+    )(func)
     func = click.option(
         "-wp",
         "--wallet-rpc-port",
@@ -61,6 +519,14 @@ def common_options(func):
         type=int,
         default=None,
     )(func)
+    func = click.option(
+        "-nu",
+        "--node-url",
+        help="The host:port of another full node RPC to fail over to. Can be given more than once",
+        required=False,
+        type=str,
+        multiple=True,
+    )(func)
     return func
 
 
@@ -69,9 +535,23 @@ def common_options(func):
     context_settings=CONTEXT_SETTINGS,
 )
 @click.version_option(__version__)
+@click.option(
+    "--profile",
+    "profile_path",
+    help="Write a CPU profile of the command to this file, and a report of its hot spots, RPCs and SQLite calls"
+    " to the same path with .json added",
+    required=False,
+    type=str,
+    default=None,
+)
 @click.pass_context
-def cli(ctx: click.Context) -> None:
+def cli(ctx: click.Context, profile_path: Optional[str] = None) -> None:
     ctx.ensure_object(dict)
+    if profile_path:
+        profiler = CommandProfiler(profile_path, sys.argv[1:])
+        profiler.start()
+        # Runs once the command finishes, fails or exits
+        ctx.call_on_close(lambda: print(format_summary(profiler.stop()), file=sys.stderr))
 
 
 @cli.command(
@@ -88,10 +568,18 @@ def cli(ctx: click.Context) -> None:
 @click.option(
     "-l",
     "--timelock",
-    help="The timelock to use for the cb coin you're creating. Default is two weeks",
+    help="The timelock to use for the cb coin you're creating, in seconds or in blocks. Default is two weeks",
     required=False,
     type=int,
-    default=TWO_WEEKS,
+    default=None,
+)
+@click.option(
+    "-u",
+    "--timelock-unit",
+    help="Lock the coin for a number of seconds, or for a number of blocks which needs no timestamp lookups",
+    required=False,
+    type=click.Choice([SECONDS, HEIGHT]),
+    default=SECONDS,
 )
 @click.option(
     "-a",
@@ -113,70 +601,71 @@ def cli(ctx: click.Context) -> None:
     "-m",
     "--fee",
     "fee_str",
-    help="The fee in XCH",
+    help='The fee in XCH, or "auto" to use the node\'s fee estimate',
     required=False,
     type=str,
     default="0",
 )
+@click.option(
+    "--hint-sender",
+    help="Add the sender's puzzle hash as a second memo after the recipient hint",
+    is_flag=True,
+    default=False,
+)
+@target_blocks_option
 @common_options
 def create_cmd(
     to: str,
-    timelock: int,
+    timelock: Optional[int],
+    timelock_unit: str,
     amount_str: str,
     wallet_id: int,
     fee_str: str = "0",
+    hint_sender: bool = False,
+    target_blocks: int = DEFAULT_TARGET_BLOCKS,
     db_path: str = "",
     wallet_rpc_port: Optional[int] = None,
     fingerprint: Optional[int] = None,
     node_rpc_port: Optional[int] = None,
+    node_url: Tuple[str, ...] = (),
+    shared_db: bool = False,
 ):
     """
     \b
     Make a transaction to create a clawback coin
     """
     amount = int(Decimal(amount_str) * MOJO_CONST)
-    fee = int(Decimal(fee_str) * MOJO_CONST)
+    fee = parse_fee(fee_str)
+    if timelock is None:
+        timelock = TWO_WEEKS if timelock_unit == SECONDS else int(TWO_WEEKS / SECONDS_PER_BLOCK)
 
     async def do_command(fingerprint, amount, fee):
-        node_client, wallet_client = await get_node_and_wallet_clients(node_rpc_port, wallet_rpc_port, fingerprint)
+        node_client, wallet_client = await get_node_and_wallet_clients(
+            node_rpc_port, wallet_rpc_port, fingerprint, node_url
+        )
         if not fingerprint:
             fingerprint = await wallet_client.get_logged_in_fingerprint()
-        db_file = Path(db_path) / f"clawback_{fingerprint}.db"
-        wrapper = await DBWrapper2.create(database=db_file)
-        cb_store = await CBStore.create(wrapper)
+        cb_store = await open_cb_store(db_path, fingerprint, shared_db)
         try:
             manager = await CBManager.create(node_client, wallet_client, cb_store)
-            recipient_ph = decode_puzzle_hash(to)
-            sender_addr = await wallet_client.get_next_address(wallet_id, True)
-            sender_ph = decode_puzzle_hash(sender_addr)
-            spend = await manager.create_cb_coin(amount, recipient_ph, sender_ph, timelock, fee=fee)
-            cb_coin = [coin for coin in spend.additions() if coin.amount == amount][0]
-            tx = TransactionRecord(
-                confirmed_at_height=uint32(0),
-                created_at_time=uint64(time.time()),
-                to_puzzle_hash=cb_coin.puzzle_hash,
-                amount=uint64(amount),
-                fee_amount=uint64(fee),
-                confirmed=False,
-                sent=uint32(10),
-                spend_bundle=spend,
-                additions=spend.additions(),
-                removals=spend.removals(),
-                wallet_id=wallet_id,
-                sent_to=[],
-                trade_id=None,
-                type=uint32(TransactionType.INCOMING_TX.value),
-                name=bytes32(token_bytes(32)),
-                memos=[],
-            )
-            res = await wallet_client.push_transactions([tx])
-            if res["success"]:
-                cb_coin = [coin for coin in spend.additions() if coin.amount == amount][0]
-                await manager.add_new_coin(cb_coin, recipient_ph, sender_ph, timelock)
+            await manager.reconcile_reservations()
+            try:
+                cb_coin = await create_coin(
+                    manager,
+                    wallet_client,
+                    decode_puzzle_hash(to),
+                    amount,
+                    timelock,
+                    timelock_unit,
+                    wallet_id,
+                    fee,
+                    target_blocks,
+                    hint_sender,
+                )
                 print("Created Coin with ID: {}".format(cb_coin.name().hex()))
                 print(cb_coin)
-            else:
-                print(f"Failed to create clawback coin: {res}")
+            except ValueError as e:
+                print(e)
         finally:
             await cb_store.close()
             node_client.close()
@@ -199,55 +688,93 @@ def create_cmd(
     type=str,
     default=None,
 )
+@click.option(
+    "--cache-stats",
+    help="Print how many node lookups were served from the cache",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--json",
+    "output_json",
+    help="Print the coins as a JSON array, streamed as their records are refreshed",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--ndjson",
+    help="Print each coin as a line of JSON as soon as its record is refreshed",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--no-refresh",
+    help="Show the coins as stored, for a database kept up to date by the watch command",
+    is_flag=True,
+    default=False,
+)
 @common_options
 def show_cmd(
     coin_id: str,
+    cache_stats: bool = False,
+    output_json: bool = False,
+    ndjson: bool = False,
+    no_refresh: bool = False,
     db_path: str = "clawback.db",
     wallet_rpc_port: Optional[int] = None,
     fingerprint: Optional[int] = None,
     node_rpc_port: Optional[int] = None,
+    node_url: Tuple[str, ...] = (),
+    shared_db: bool = False,
 ):
     """
     \b
     Get details for all clawback coins
     """
+    if output_json and ndjson:
+        raise click.UsageError("--json and --ndjson can't be used together")
 
     async def do_command(coin_id, fingerprint):
-        node_client, wallet_client = await get_node_and_wallet_clients(node_rpc_port, wallet_rpc_port, fingerprint)
+        node_client, wallet_client = await get_node_and_wallet_clients(
+            node_rpc_port, wallet_rpc_port, fingerprint, node_url
+        )
         if not fingerprint:
             fingerprint = await wallet_client.get_logged_in_fingerprint()
-        db_file = Path(db_path) / f"clawback_{fingerprint}.db"
-        wrapper = await DBWrapper2.create(database=db_file)
-        cb_store = await CBStore.create(wrapper)
+        cb_store = await open_cb_store(db_path, fingerprint, shared_db)
         try:
             manager = await CBManager.create(node_client, wallet_client, cb_store)
-            print("Updating coin records...")
-            await manager.update_records()
             if coin_id:
                 record = await manager.get_cb_info_by_id(bytes32.from_hexstr(coin_id))
-                records = [record]
+                batches = single_batch([record] if record else [])
+            elif no_refresh:
+                batches = single_batch(await manager.get_cb_coins())
             else:
-                records = await manager.get_cb_coins()
-            current_time = time.time()
+                batches = manager.refresh_records(await manager.get_cb_coins())
+            # Height locked coins mature against the peak, one lookup covers all of them
+            peak_height = await manager.node_client.get_peak_height() or 0
+            if output_json or ndjson:
+                await print_json_records(batches, ndjson, peak_height)
+                return
+            print("Updating coin records...")
+            records = sorted(
+                [record async for batch in batches for record in batch], key=lambda r: r.confirmed_block_height
+            )
+            now = int(time.time())
             if records:
                 for record in records:
-                    block = await node_client.get_block_record_by_height(record.confirmed_block_height)
-                    if block.height > 0:
-                        time_left = int(record.timelock - (current_time - block.timestamp))
-                        if time_left <= 0:
-                            time_left = 0
-                    else:
-                        time_left = "pending"
                     print("\n")
                     print(f"Coin ID: {record.coin.name().hex()}")
                     print(f"Amount: {record.coin.amount / MOJO_CONST} XCH ({record.coin.amount} mojos)")
-                    print(f"Timelock: {record.timelock} seconds")
-                    if time_left == "pending":
-                        print("Time left: pending")
-                    else:
-                        print(f"Time left: {time_left} seconds")
+                    print(f"Timelock: {record.timelock} {timelock_unit_name(record)}")
+                    print(f"Time left: {describe_time_left(record, now, peak_height)}")
+                    print(f"State: {record.state(now, peak_height)}")
             else:
                 print("No coins found")
+            if cache_stats:
+                print("\n")
+                evictions = manager.node_client.get_evictions()
+                for path, ratio in sorted(manager.node_client.get_hit_ratios().items()):
+                    print(f"Cache hit ratio for {path}: {ratio:.0%}, {evictions.get(path, 0)} evicted")
         finally:
             await cb_store.close()
             node_client.close()
@@ -265,15 +792,17 @@ def show_cmd(
 @click.option(
     "-c",
     "--coin-id",
-    help="The coin ID you want to claw back",
+    "coin_ids",
+    help="The coin ID you want to claw back. Give it more than once to claw back several coins into one output",
     required=True,
     type=str,
+    multiple=True,
 )
 @click.option(
     "-m",
     "--fee",
     "fee_str",
-    help="The fee in XCH for this transaction",
+    help='The fee in XCH for this transaction, or "auto" to use the node\'s fee estimate',
     required=False,
     type=str,
     default="0",
@@ -294,64 +823,50 @@ def show_cmd(
     type=str,
     default=None,
 )
+@target_blocks_option
 @common_options
 def claw_cmd(
-    coin_id: str,
+    coin_ids: Tuple[str, ...],
     fee_str: str = "",
     wallet_id: int = 1,
     target_address: Optional[str] = None,
+    target_blocks: int = DEFAULT_TARGET_BLOCKS,
     db_path: str = "clawback.db",
     wallet_rpc_port: Optional[int] = None,
     fingerprint: Optional[int] = None,
     node_rpc_port: Optional[int] = None,
+    node_url: Tuple[str, ...] = (),
+    shared_db: bool = False,
 ):
     """
     \b
     Clawback an unclaimed coin
     """
-    fee: int = int(Decimal(fee_str) * MOJO_CONST)
+    fee = parse_fee(fee_str)
 
     async def do_command(fee, wallet_id, target_address, fingerprint):
-        node_client, wallet_client = await get_node_and_wallet_clients(node_rpc_port, wallet_rpc_port, fingerprint)
+        node_client, wallet_client = await get_node_and_wallet_clients(
+            node_rpc_port, wallet_rpc_port, fingerprint, node_url
+        )
         if not fingerprint:
             fingerprint = await wallet_client.get_logged_in_fingerprint()
-        db_file = Path(db_path) / f"clawback_{fingerprint}.db"
-        wrapper = await DBWrapper2.create(database=db_file)
-        cb_store = await CBStore.create(wrapper)
+        cb_store = await open_cb_store(db_path, fingerprint, shared_db)
         try:
             manager = await CBManager.create(node_client, wallet_client, cb_store)
-            if not target_address:
-                target_address = await wallet_client.get_next_address(wallet_id, True)
-            target_ph = decode_puzzle_hash(target_address)
-            cb_info = await manager.get_cb_info_by_id(bytes32.from_hexstr(coin_id))
-            coin_record = await node_client.get_coin_record_by_name(bytes32.from_hexstr(coin_id))
-            if coin_record.spent:
-                raise ValueError("This coin has already been spent")
-            cb_coin = coin_record.coin
-            spend = await manager.create_clawback_spend(cb_info, target_ph, fee)
-            tx = TransactionRecord(
-                confirmed_at_height=uint32(0),
-                created_at_time=uint64(time.time()),
-                to_puzzle_hash=target_ph,
-                amount=uint64(cb_coin.amount),
-                fee_amount=uint64(fee),
-                confirmed=False,
-                sent=uint32(10),
-                spend_bundle=spend,
-                additions=spend.additions(),
-                removals=spend.removals(),
-                wallet_id=wallet_id,
-                sent_to=[],
-                trade_id=None,
-                type=uint32(TransactionType.INCOMING_TX.value),
-                name=bytes32(token_bytes(32)),
-                memos=[],
-            )
-            res = await wallet_client.push_transactions([tx])
-            if res["success"]:
-                print(f"Submitted spend to claw back coin: {coin_id}")
-            else:
-                print(f"Failed to submit clawback spend: {res}")
+            await manager.reconcile_reservations()
+            try:
+                await claw_coin(
+                    manager,
+                    wallet_client,
+                    [bytes32.from_hexstr(coin_id) for coin_id in coin_ids],
+                    target_address,
+                    wallet_id,
+                    fee,
+                    target_blocks,
+                )
+                print(f"Submitted spend to claw back coin: {', '.join(coin_ids)}")
+            except ValueError as e:
+                print(e)
         finally:
             await cb_store.close()
             node_client.close()
@@ -369,15 +884,17 @@ def claw_cmd(
 @click.option(
     "-c",
     "--coin-id",
-    help="The coin ID you want to claim",
+    "coin_ids",
+    help="The coin ID you want to claim. Give it more than once to claim several coins into one output",
     required=True,
     type=str,
+    multiple=True,
 )
 @click.option(
     "-m",
     "--fee",
     "fee_str",
-    help="The fee in XCH for this transaction",
+    help='The fee in XCH for this transaction, or "auto" to use the node\'s fee estimate',
     required=False,
     type=str,
     default="0",
@@ -393,50 +910,50 @@ def claw_cmd(
 @click.option(
     "-t", "--target-address", help="The address you want to send the coin to", required=False, type=str, default=None
 )
+@target_blocks_option
 @common_options
 def claim_cmd(
-    coin_id: str,
+    coin_ids: Tuple[str, ...],
     fee_str: str = "0",
     wallet_id: int = 1,
     target_address: Optional[str] = None,
+    target_blocks: int = DEFAULT_TARGET_BLOCKS,
     db_path: str = "clawback.db",
     wallet_rpc_port: Optional[int] = None,
     fingerprint: Optional[int] = None,
     node_rpc_port: Optional[int] = None,
+    node_url: Tuple[str, ...] = (),
+    shared_db: bool = False,
 ):
     """
     \b
     Claim a clawback coin as recipient
     """
-    fee: int = int(Decimal(fee_str) * MOJO_CONST)
+    fee = parse_fee(fee_str)
 
     async def do_command(fee, wallet_id, target_address, fingerprint):
-        node_client, wallet_client = await get_node_and_wallet_clients(node_rpc_port, wallet_rpc_port, fingerprint)
+        node_client, wallet_client = await get_node_and_wallet_clients(
+            node_rpc_port, wallet_rpc_port, fingerprint, node_url
+        )
         if not fingerprint:
             fingerprint = await wallet_client.get_logged_in_fingerprint()
-        db_file = Path(db_path) / f"clawback_{fingerprint}.db"
-        wrapper = await DBWrapper2.create(database=db_file)
-        cb_store = await CBStore.create(wrapper)
+        cb_store = await open_cb_store(db_path, fingerprint, shared_db)
         try:
             manager = await CBManager.create(node_client, wallet_client, cb_store)
-            if not target_address:
-                target_address = await wallet_client.get_next_address(wallet_id, True)
-            target_ph = decode_puzzle_hash(target_address)
-            coin_record = await node_client.get_coin_record_by_name(bytes32.from_hexstr(coin_id))
-            if coin_record.spent:
-                raise ValueError("This coin has already been spent")
-            cb_coin = coin_record.coin
-            spend = await manager.create_claim_spend(coin_record.coin, target_ph, fee)
-
+            await manager.reconcile_reservations()
             try:
-                await node_client.push_tx(spend)
-                print(f"Submitted spend to claim coin: {cb_coin.name()}")
+                await claim_coin(
+                    manager,
+                    wallet_client,
+                    [bytes32.from_hexstr(coin_id) for coin_id in coin_ids],
+                    target_address,
+                    wallet_id,
+                    fee,
+                    target_blocks,
+                )
+                print(f"Submitted spend to claim coin: {', '.join(coin_ids)}")
             except ValueError as e:
-                if "ASSERT_SECONDS_RELATIVE_FAILED" in e.args[0]["error"]:
-                    print("You are trying to claim the coin too early")
-                else:
-                    print(f"Error: {e}")
-
+                print(e)
         finally:
             await cb_store.close()
             node_client.close()
@@ -447,9 +964,1117 @@ def claim_cmd(
     asyncio.get_event_loop().run_until_complete(do_command(fee, wallet_id, target_address, fingerprint))
 
 
+@cli.command(
+    "split",
+    short_help="Split wallet funds into a pool of fee coins",
+)
+@click.option(
+    "-n",
+    "--count",
+    help="The number of fee coins to create",
+    required=True,
+    type=int,
+)
+@click.option(
+    "-a",
+    "--amount",
+    "amount_str",
+    help="The amount in XCH of each fee coin",
+    required=True,
+    type=str,
+)
+@click.option(
+    "-w",
+    "--wallet-id",
+    help="The wallet id to split funds from",
+    required=False,
+    type=int,
+    default=1,
+)
+@click.option(
+    "-m",
+    "--fee",
+    "fee_str",
+    help="The fee in XCH for the split transaction",
+    required=False,
+    type=str,
+    default="0",
+)
+@common_options
+def split_cmd(
+    count: int,
+    amount_str: str,
+    wallet_id: int = 1,
+    fee_str: str = "0",
+    db_path: str = "",
+    wallet_rpc_port: Optional[int] = None,
+    fingerprint: Optional[int] = None,
+    node_rpc_port: Optional[int] = None,
+    node_url: Tuple[str, ...] = (),
+    shared_db: bool = False,
+):
+    """
+    \b
+    Create fee coins so that concurrent claws and claims don't compete for the same coin
+    """
+    amount = uint64(int(Decimal(amount_str) * MOJO_CONST))
+    fee = uint64(int(Decimal(fee_str) * MOJO_CONST))
+
+    async def do_command(fingerprint):
+        node_client, wallet_client = await get_node_and_wallet_clients(
+            node_rpc_port, wallet_rpc_port, fingerprint, node_url
+        )
+        if not fingerprint:
+            fingerprint = await wallet_client.get_logged_in_fingerprint()
+        cb_store = await open_cb_store(db_path, fingerprint, shared_db)
+        try:
+            manager = await CBManager.create(node_client, wallet_client, cb_store)
+            tx = await manager.fee_pool.split(count, amount, fee, wallet_id)
+            print(f"Submitted transaction {tx.name.hex()} to create {count} fee coins of {amount} mojos")
+        finally:
+            await cb_store.close()
+            node_client.close()
+            wallet_client.close()
+            await node_client.await_closed()
+            await wallet_client.await_closed()
+
+    asyncio.get_event_loop().run_until_complete(do_command(fingerprint))
+
+
+@cli.command(
+    "status",
+    short_help="Show submitted spends that haven't confirmed yet",
+)
+@click.option(
+    "--rebroadcast/--no-rebroadcast",
+    help="Resubmit pending spends that have dropped out of the mempool",
+    default=True,
+)
+@click.option(
+    "--auto-bump/--no-auto-bump",
+    help="Bump the fee of pending claws whose recipient can claim the coin within the hour",
+    default=True,
+)
+@common_options
+def status_cmd(
+    rebroadcast: bool = True,
+    auto_bump: bool = True,
+    db_path: str = "",
+    wallet_rpc_port: Optional[int] = None,
+    fingerprint: Optional[int] = None,
+    node_rpc_port: Optional[int] = None,
+    node_url: Tuple[str, ...] = (),
+    shared_db: bool = False,
+):
+    """
+    \b
+    Check submitted spends against the chain, rebroadcast any that dropped out of the mempool
+    and list the ones still in flight
+    """
+
+    async def do_command(fingerprint):
+        node_client, wallet_client = await get_node_and_wallet_clients(
+            node_rpc_port, wallet_rpc_port, fingerprint, node_url
+        )
+        if not fingerprint:
+            fingerprint = await wallet_client.get_logged_in_fingerprint()
+        cb_store = await open_cb_store(db_path, fingerprint, shared_db)
+        try:
+            manager = await CBManager.create(node_client, wallet_client, cb_store)
+            pending_spends = await manager.tracker.check(rebroadcast)
+            if auto_bump:
+                for spend in await manager.bump_due_spends():
+                    print(f"Bumped the fee of a claw nearing its deadline, new spend: {spend.name().hex()}")
+                pending_spends = await cb_store.get_pending_spends()
+            now = time.time()
+            if pending_spends:
+                for pending in pending_spends:
+                    print("\n")
+                    print(f"Spend: {pending.name().hex()}")
+                    print(f"Operation: {pending.operation}")
+                    print(f"Coins: {', '.join(name.hex() for name in pending.coin_ids())}")
+                    print(f"Fee: {pending.fee / MOJO_CONST} XCH ({pending.fee} mojos)")
+                    print(f"Submitted: {int(now - pending.submitted_at)} seconds ago")
+                    print(f"Broadcasts: {pending.broadcast_count}")
+            else:
+                print("No pending spends")
+            summary = await manager.tracker.get_latency_summary()
+            if summary["confirmed"] > 0:
+                print("\n")
+                print(
+                    f"Confirmation latency over {summary['confirmed']} spends: "
+                    f"p50 {summary['p50']}s, p90 {summary['p90']}s, max {summary['max']}s"
+                )
+        finally:
+            await cb_store.close()
+            node_client.close()
+            wallet_client.close()
+            await node_client.await_closed()
+            await wallet_client.await_closed()
+
+    asyncio.get_event_loop().run_until_complete(do_command(fingerprint))
+
+
+@cli.command(
+    "maturing",
+    short_help="List clawback coins across all wallets whose timelock expires soon",
+)
+@click.option(
+    "-s",
+    "--within",
+    help="List coins whose timelock expires within this many seconds. Default is one day",
+    required=False,
+    type=int,
+    default=ONE_DAY,
+)
+@common_options
+def maturing_cmd(
+    within: int = ONE_DAY,
+    db_path: str = "",
+    wallet_rpc_port: Optional[int] = None,
+    fingerprint: Optional[int] = None,
+    node_rpc_port: Optional[int] = None,
+    node_url: Tuple[str, ...] = (),
+    shared_db: bool = True,
+):
+    """
+    \b
+    Refresh every wallet's coins in the shared database and list the ones whose timelock
+    expires within the given time, soonest first. With --fingerprint only that wallet's
+    coins are listed
+    """
+
+    async def do_command(fingerprint):
+        node_client, wallet_client = await get_node_and_wallet_clients(
+            node_rpc_port, wallet_rpc_port, fingerprint, node_url
+        )
+        # The listing always comes from the shared database, it's the only one holding every wallet
+        cb_store = await open_cb_store(db_path, fingerprint, shared_db=True)
+        try:
+            fingerprints = [fingerprint] if fingerprint else await cb_store.get_fingerprints()
+            manager = await CBManager.create(node_client, wallet_client, cb_store, fingerprints=fingerprints)
+            print("Updating coin records...")
+            await manager.update_records()
+            now = int(time.time())
+            peak_height = await manager.node_client.get_peak_height() or 0
+            maturing = await cb_store.get_coins_maturing(
+                uint64(now),
+                uint64(now + within),
+                uint32(peak_height + 1),
+                uint32(peak_height + 1 + int(within / SECONDS_PER_BLOCK)),
+            )
+            if maturing:
+                for coin_fingerprint, record in maturing:
+                    print("\n")
+                    print(f"Coin ID: {record.coin.name().hex()}")
+                    print(f"Fingerprint: {coin_fingerprint}")
+                    print(f"Amount: {record.coin.amount / MOJO_CONST} XCH ({record.coin.amount} mojos)")
+                    print(f"Time left: {describe_time_left(record, now, peak_height)}")
+            else:
+                print("No coins maturing")
+        finally:
+            await cb_store.close()
+            node_client.close()
+            wallet_client.close()
+            await node_client.await_closed()
+            await wallet_client.await_closed()
+
+    asyncio.get_event_loop().run_until_complete(do_command(fingerprint))
+
+
+@cli.command(
+    "discover",
+    short_help="Find clawback coins sent to your wallet",
+)
+@click.option(
+    "--include-spent",
+    help="Also find coins that have already been clawed back or claimed",
+    is_flag=True,
+    default=False,
+)
+@common_options
+def discover_cmd(
+    include_spent: bool = False,
+    db_path: str = "",
+    wallet_rpc_port: Optional[int] = None,
+    fingerprint: Optional[int] = None,
+    node_rpc_port: Optional[int] = None,
+    node_url: Tuple[str, ...] = (),
+    shared_db: bool = False,
+):
+    """
+    \b
+    Look up the coins hinted to each of the wallet's addresses, keep the ones that are clawback
+    coins and add them to the database so show and claim can use them
+    """
+
+    async def do_command(fingerprint):
+        node_client, wallet_client = await get_node_and_wallet_clients(
+            node_rpc_port, wallet_rpc_port, fingerprint, node_url
+        )
+        if not fingerprint:
+            fingerprint = await wallet_client.get_logged_in_fingerprint()
+        cb_store = await open_cb_store(db_path, fingerprint, shared_db)
+        try:
+            manager = await CBManager.create(node_client, wallet_client, cb_store, fingerprints=[fingerprint])
+            discovered = await manager.discover_cb_coins(include_spent)
+            puzzle_hashes = set(manager.key_cache)
+            now = int(time.time())
+            peak_height = await manager.node_client.get_peak_height() or 0
+            for _, record in discovered:
+                direction = "incoming" if record.recipient_ph in puzzle_hashes else "outgoing"
+                print("\n")
+                print(f"Coin ID: {record.coin.name().hex()}")
+                print(f"Direction: {direction}")
+                print(f"Amount: {record.coin.amount / MOJO_CONST} XCH ({record.coin.amount} mojos)")
+                print(f"State: {record.state(now, peak_height)}")
+            print(f"Found {len(discovered)} new clawback coins")
+        finally:
+            await cb_store.close()
+            node_client.close()
+            wallet_client.close()
+            await node_client.await_closed()
+            await wallet_client.await_closed()
+
+    asyncio.get_event_loop().run_until_complete(do_command(fingerprint))
+
+
+@cli.command(
+    "stats",
+    short_help="Summarize the value held in clawback coins",
+)
+@click.option(
+    "-d",
+    "--days",
+    help="Show the value maturing on each of this many days. Default is 7",
+    required=False,
+    type=int,
+    default=7,
+)
+@click.option(
+    "-n",
+    "--top",
+    help="Show this many recipients with the most value locked. Default is 10",
+    required=False,
+    type=int,
+    default=10,
+)
+@click.option(
+    "--refresh",
+    help="Refresh the coins' chain state before summarizing them",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--json",
+    "as_json",
+    help="Print the summary as a JSON object",
+    is_flag=True,
+    default=False,
+)
+@common_options
+def stats_cmd(
+    days: int = 7,
+    top: int = 10,
+    refresh: bool = False,
+    as_json: bool = False,
+    db_path: str = "",
+    wallet_rpc_port: Optional[int] = None,
+    fingerprint: Optional[int] = None,
+    node_rpc_port: Optional[int] = None,
+    node_url: Tuple[str, ...] = (),
+    shared_db: bool = False,
+):
+    """
+    \b
+    Show the value locked per recipient, the value maturing on each of the coming days and how
+    many coins were clawed back or claimed. With --shared-db and no --fingerprint every wallet
+    in the shared database is included
+    """
+
+    async def do_command(fingerprint):
+        node_client, wallet_client = await get_node_and_wallet_clients(
+            node_rpc_port, wallet_rpc_port, fingerprint, node_url
+        )
+        if not fingerprint and not shared_db:
+            fingerprint = await wallet_client.get_logged_in_fingerprint()
+        cb_store = await open_cb_store(db_path, fingerprint, shared_db)
+        try:
+            if refresh:
+                fingerprints = [fingerprint] if fingerprint else await cb_store.get_fingerprints()
+                manager = await CBManager.create(node_client, wallet_client, cb_store, fingerprints=fingerprints)
+                await manager.update_records()
+            now = uint64(int(time.time()))
+            peak = (await node_client.get_blockchain_state())["peak"]
+            peak_height = uint32(0 if peak is None else peak.height)
+            locked = await cb_store.get_value_locked(top)
+            maturing = await cb_store.get_value_maturing_by_day(now, peak_height, days)
+            outcomes = await cb_store.get_spend_outcomes()
+            if as_json:
+                summary = {
+                    "value_locked": [
+                        {"recipient_ph": recipient_ph.hex(), "coins": coins, "amount": amount}
+                        for recipient_ph, coins, amount in locked
+                    ],
+                    "maturing": [
+                        {"day": time.strftime("%Y-%m-%d", time.gmtime(day)), "coins": coins, "amount": amount}
+                        for day, coins, amount in maturing
+                    ],
+                    "outcomes": {
+                        outcome: {"coins": coins, "amount": amount} for outcome, (coins, amount) in outcomes.items()
+                    },
+                }
+                print(json.dumps(summary, indent=2))
+                return
+            print("Value locked by recipient:")
+            for recipient_ph, coins, amount in locked:
+                print(f"  {recipient_ph.hex()}: {amount / MOJO_CONST} XCH in {coins} coins")
+            if not locked:
+                print("  No unspent coins")
+            print(f"Value maturing over the next {days} days:")
+            for day, coins, amount in maturing:
+                print(f"  {time.strftime('%Y-%m-%d', time.gmtime(day))}: {amount / MOJO_CONST} XCH in {coins} coins")
+            if not maturing:
+                print("  No coins maturing")
+            spent = sum(coins for outcome, (coins, _) in outcomes.items() if outcome != UNSPENT)
+            print("Outcomes:")
+            for outcome, (coins, amount) in sorted(outcomes.items()):
+                share = f" ({coins * 100 / spent:.1f}% of spent coins)" if outcome != UNSPENT else ""
+                print(f"  {outcome}: {coins} coins, {amount / MOJO_CONST} XCH{share}")
+            if not outcomes:
+                print("  No coins")
+        finally:
+            await cb_store.close()
+            node_client.close()
+            wallet_client.close()
+            await node_client.await_closed()
+            await wallet_client.await_closed()
+
+    asyncio.get_event_loop().run_until_complete(do_command(fingerprint))
+
+
+async def get_store_fingerprint(
+    fingerprint: Optional[int], shared_db: bool, wallet_rpc_port: Optional[int]
+) -> Optional[int]:
+    """
+    Returns the fingerprint whose coins a command that doesn't need the node works on. Only a
+    wallet's own database needs one, and the wallet is only asked when none was given.
+    """
+    if fingerprint or shared_db:
+        return fingerprint
+    wallet_client = await get_wallet_client(wallet_rpc_port)
+    try:
+        return await wallet_client.get_logged_in_fingerprint()
+    finally:
+        wallet_client.close()
+        await wallet_client.await_closed()
+
+
+@cli.command(
+    "watch",
+    short_help="Keep the database's clawback coins up to date as new blocks arrive",
+)
+@click.option(
+    "-i",
+    "--interval",
+    help="Seconds between checks for a new peak. Default is 10",
+    required=False,
+    type=float,
+    default=WATCH_INTERVAL,
+)
+@click.option(
+    "--max-coins",
+    help="Merge the wallet's smallest coins whenever it holds more than this many spendable coins",
+    required=False,
+    type=int,
+    default=None,
+)
+@click.option(
+    "-m",
+    "--consolidation-fee",
+    "fee_str",
+    help="The fee in XCH for each consolidation spend. The node's estimate can't be used, as the spends vary in size",
+    required=False,
+    type=str,
+    default="0",
+)
+@click.option(
+    "--auto-bump/--no-auto-bump",
+    help="Check pending spends and bump the fee of claws whose recipient can claim the coin within the hour",
+    default=True,
+)
+@click.option(
+    "--discover/--no-discover",
+    help="Also add the clawback coins hinted to the wallets as new blocks arrive, one lookup per address per peak",
+    default=False,
+)
+@common_options
+def watch_cmd(
+    interval: float = WATCH_INTERVAL,
+    max_coins: Optional[int] = None,
+    fee_str: str = "0",
+    auto_bump: bool = True,
+    discover: bool = False,
+    db_path: str = "",
+    wallet_rpc_port: Optional[int] = None,
+    fingerprint: Optional[int] = None,
+    node_rpc_port: Optional[int] = None,
+    node_url: Tuple[str, ...] = (),
+    shared_db: bool = False,
+):
+    """
+    \b
+    Refresh every unspent coin once, then apply the coins added and spent in each new block
+    until interrupted, printing the coins that change. Only coins already in the database are
+    followed unless --discover is given. With --shared-db and no --fingerprint
+    every wallet in the shared database is watched. With --max-coins the logged in wallet's
+    smallest coins are merged after each change whenever it holds too many
+    """
+    fee = parse_fee(fee_str)
+    if fee is None:
+        # A consolidation merges a varying number of coins, so there's no standard spend to price
+        raise click.BadParameter("the consolidation fee must be an amount of XCH", param_hint="'--consolidation-fee'")
+
+    async def do_command(fingerprint):
+        node_client, wallet_client = await get_node_and_wallet_clients(
+            node_rpc_port, wallet_rpc_port, fingerprint, node_url
+        )
+        if not fingerprint and not shared_db:
+            fingerprint = await wallet_client.get_logged_in_fingerprint()
+        cb_store = await open_cb_store(db_path, fingerprint, shared_db)
+        try:
+            fingerprints = [fingerprint] if fingerprint else await cb_store.get_fingerprints()
+            manager = await CBManager.create(node_client, wallet_client, cb_store, fingerprints=fingerprints)
+            watcher = await CBWatcher.create(node_client, manager, discover)
+            consolidator = None
+            if max_coins is not None:
+                consolidator = await WalletConsolidator.create(manager, ConsolidationPolicy(max_coins, fee=fee))
+            print("Watching for new blocks, press Ctrl-C to stop")
+            async for changed in watcher.watch(interval):
+                assert watcher.peak is not None
+                now = int(time.time())
+                for record in changed:
+                    print(
+                        f"Height {watcher.peak.height}: {record.coin.name().hex()} "
+                        f"{record.state(now, watcher.peak.height)}"
+                    )
+                if auto_bump:
+                    await manager.tracker.check()
+                    for spend in await manager.bump_due_spends():
+                        print(f"Bumped the fee of a claw nearing its deadline, new spend: {spend.name().hex()}")
+                if consolidator is not None and len(changed) > 0:
+                    for tx in await consolidator.consolidate():
+                        print(f"Consolidated {len(tx.removals)} coins: {tx.name.hex()}")
+        finally:
+            await cb_store.close()
+            node_client.close()
+            wallet_client.close()
+            await node_client.await_closed()
+            await wallet_client.await_closed()
+
+    try:
+        asyncio.get_event_loop().run_until_complete(do_command(fingerprint))
+    except KeyboardInterrupt:
+        pass
+
+
+@cli.command(
+    "export",
+    short_help="Export clawback coin records as NDJSON or binary",
+)
+@click.option(
+    "-o",
+    "--output",
+    help="The file to write the records to, or - for stdout",
+    required=False,
+    type=str,
+    default="-",
+)
+@click.option(
+    "--format",
+    "export_format",
+    help="ndjson writes one JSON object per line, binary writes length prefixed streamable records",
+    required=False,
+    type=click.Choice(EXPORT_FORMATS),
+    default=NDJSON,
+)
+@click.option(
+    "--since-height",
+    help="Only export coins confirmed or spent at or after this height",
+    required=False,
+    type=int,
+    default=0,
+)
+@common_options
+def export_cmd(
+    output: str = "-",
+    export_format: str = NDJSON,
+    since_height: int = 0,
+    db_path: str = "",
+    wallet_rpc_port: Optional[int] = None,
+    fingerprint: Optional[int] = None,
+    node_rpc_port: Optional[int] = None,
+    node_url: Tuple[str, ...] = (),
+    shared_db: bool = False,
+):
+    """
+    \b
+    Stream the stored clawback coins to a file, a batch at a time. The highest height in the
+    export is printed so the next one can pick up from it with --since-height
+    """
+
+    async def do_command(fingerprint):
+        fingerprint = await get_store_fingerprint(fingerprint, shared_db, wallet_rpc_port)
+        cb_store = await open_cb_store(db_path, fingerprint, shared_db)
+        try:
+            if output == "-":
+                count, last_height = await export_records(
+                    cb_store, sys.stdout.buffer, export_format, uint32(since_height)
+                )
+            else:
+                with open(output, "wb") as file:
+                    count, last_height = await export_records(cb_store, file, export_format, uint32(since_height))
+            print(f"Exported {count} records up to height {last_height}", file=sys.stderr)
+        finally:
+            await cb_store.close()
+
+    asyncio.get_event_loop().run_until_complete(do_command(fingerprint))
+
+
+@cli.command(
+    "import",
+    short_help="Import clawback coin records written by export",
+)
+@click.option(
+    "-i",
+    "--input",
+    "input_file",
+    help="The export to read, in either format, or - for stdin",
+    required=True,
+    type=str,
+)
+@common_options
+def import_cmd(
+    input_file: str,
+    db_path: str = "",
+    wallet_rpc_port: Optional[int] = None,
+    fingerprint: Optional[int] = None,
+    node_rpc_port: Optional[int] = None,
+    node_url: Tuple[str, ...] = (),
+    shared_db: bool = False,
+):
+    """
+    \b
+    Add the records in an export to the database. Coins already in it are updated rather than
+    added twice. With --shared-db the coins keep the wallet they were exported from, unless
+    --fingerprint is given
+    """
+
+    async def do_command(fingerprint):
+        fingerprint = await get_store_fingerprint(fingerprint, shared_db, wallet_rpc_port)
+        cb_store = await open_cb_store(db_path, fingerprint, shared_db)
+        try:
+            if input_file == "-":
+                count, added = await import_records(cb_store, sys.stdin.buffer)
+            else:
+                with open(input_file, "rb") as file:
+                    count, added = await import_records(cb_store, file)
+            print(f"Imported {count} records, {added} new")
+        finally:
+            await cb_store.close()
+
+    asyncio.get_event_loop().run_until_complete(do_command(fingerprint))
+
+
+@cli.command(
+    "batch",
+    short_help="Run create, claw, claim and show operations from a JSON lines file in one process",
+)
+@click.option(
+    "-i",
+    "--input",
+    "input_file",
+    help="The NDJSON file of operations to run, or - for stdin. Default is -",
+    required=False,
+    type=str,
+    default="-",
+)
+@click.option(
+    "-o",
+    "--output",
+    help="The file to write NDJSON results to, or - for stdout. Default is -",
+    required=False,
+    type=str,
+    default="-",
+)
+@click.option(
+    "-j",
+    "--concurrency",
+    help="The number of operations to run at once. Default is 4",
+    required=False,
+    type=click.IntRange(min=1),
+    default=BATCH_CONCURRENCY,
+)
+@click.option(
+    "--uvloop",
+    "use_uvloop",
+    help="Run on the uvloop event loop, which needs the uvloop package",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--payout-window",
+    help="Create the coins of create operations arriving within this many seconds of each other in one spend. "
+    "Off by default",
+    required=False,
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+)
+@click.option(
+    "--max-payouts",
+    help="The most coins a queued spend creates. Default is 100",
+    required=False,
+    type=click.IntRange(min=1),
+    default=DEFAULT_MAX_PAYOUTS,
+)
+@click.option(
+    "--max-latency",
+    help="The longest in seconds a create operation waits in the queue. Default is 5",
+    required=False,
+    type=click.FloatRange(min=0),
+    default=DEFAULT_MAX_LATENCY,
+)
+@click.option(
+    "--payout-wallet-id",
+    help="The wallet queued creates are funded from, creates from other wallets aren't queued. Default is 1",
+    required=False,
+    type=int,
+    default=1,
+)
+@common_options
+def batch_cmd(
+    input_file: str = "-",
+    output: str = "-",
+    concurrency: int = BATCH_CONCURRENCY,
+    use_uvloop: bool = False,
+    payout_window: Optional[float] = None,
+    max_payouts: int = DEFAULT_MAX_PAYOUTS,
+    max_latency: float = DEFAULT_MAX_LATENCY,
+    payout_wallet_id: int = 1,
+    db_path: str = "",
+    wallet_rpc_port: Optional[int] = None,
+    fingerprint: Optional[int] = None,
+    node_rpc_port: Optional[int] = None,
+    node_url: Tuple[str, ...] = (),
+    shared_db: bool = False,
+):
+    """
+    \b
+    Run one operation per line of JSON, such as {"op": "create", "to": "xch1...", "amount": "0.1"},
+    {"op": "claw", "coin_id": "..."}, {"op": "claim", "coin_id": "..."} or {"op": "show", "coin_id": "..."},
+    sharing one set of clients and one database. Each result is printed as a line of JSON when
+    its operation finishes. With --payout-window, creates are queued and their coins created
+    together, up to --max-payouts per spend, and enough operations run at once to fill a
+    spend. Exits with status 1 if any operation failed
+    """
+    if use_uvloop:
+        try:
+            import uvloop
+        except ImportError:
+            raise click.UsageError("--uvloop needs the uvloop package, install it with pip install uvloop")
+        loop = uvloop.new_event_loop()
+    else:
+        loop = asyncio.new_event_loop()
+
+    async def do_command(fingerprint) -> int:
+        node_client, wallet_client = await get_node_and_wallet_clients(
+            node_rpc_port, wallet_rpc_port, fingerprint, node_url
+        )
+        if not fingerprint:
+            fingerprint = await wallet_client.get_logged_in_fingerprint()
+        cb_store = await open_cb_store(db_path, fingerprint, shared_db)
+        try:
+            manager = await CBManager.create(node_client, wallet_client, cb_store)
+            await manager.reconcile_reservations()
+            payout_queue: Optional[PayoutQueue] = None
+            running = concurrency
+            if payout_window is not None:
+                payout_queue = await PayoutQueue.create(
+                    manager, payout_window, max_payouts, max_latency, payout_wallet_id, DEFAULT_TARGET_BLOCKS
+                )
+                # Queued creates wait on each other, too few in flight would cap every spend's size
+                running = max(concurrency, max_payouts)
+            try:
+                with ExitStack() as stack:
+                    source = sys.stdin if input_file == "-" else stack.enter_context(open(input_file))
+                    results = sys.stdout if output == "-" else stack.enter_context(open(output, "w"))
+                    count, failed = await run_batch(
+                        source,
+                        results,
+                        lambda operation: run_operation(manager, wallet_client, operation, payout_queue),
+                        running,
+                    )
+            finally:
+                if payout_queue is not None:
+                    await payout_queue.close()
+            print(f"Ran {count} operations, {failed} failed", file=sys.stderr)
+            return failed
+        finally:
+            await cb_store.close()
+            node_client.close()
+            wallet_client.close()
+            await node_client.await_closed()
+            await wallet_client.await_closed()
+
+    try:
+        failed = loop.run_until_complete(do_command(fingerprint))
+    finally:
+        loop.close()
+    if failed > 0:
+        sys.exit(1)
+
+
+@cli.command(
+    "bump",
+    short_help="Raise the fee of a pending claw or claim",
+)
+@click.option(
+    "-c",
+    "--coin-id",
+    help="The ID of the clawback coin the pending spend is spending",
+    required=True,
+    type=str,
+)
+@click.option(
+    "-m",
+    "--fee",
+    "fee_str",
+    help='The new fee in XCH, or "auto" to use the node\'s fee estimate',
+    required=False,
+    type=str,
+    default="auto",
+)
+@click.option(
+    "-tb",
+    "--target-blocks",
+    help="With --fee auto, the number of transaction blocks the spend should confirm within",
+    required=False,
+    type=int,
+    default=1,
+)
+@common_options
+def bump_cmd(
+    coin_id: str,
+    fee_str: str = "auto",
+    target_blocks: int = 1,
+    db_path: str = "",
+    wallet_rpc_port: Optional[int] = None,
+    fingerprint: Optional[int] = None,
+    node_rpc_port: Optional[int] = None,
+    node_url: Tuple[str, ...] = (),
+    shared_db: bool = False,
+):
+    """
+    \b
+    Replace a pending claw or claim in the mempool with the same spend paying a higher fee
+    """
+    fee = parse_fee(fee_str)
+
+    async def do_command(fee, fingerprint):
+        node_client, wallet_client = await get_node_and_wallet_clients(
+            node_rpc_port, wallet_rpc_port, fingerprint, node_url
+        )
+        if not fingerprint:
+            fingerprint = await wallet_client.get_logged_in_fingerprint()
+        cb_store = await open_cb_store(db_path, fingerprint, shared_db)
+        try:
+            manager = await CBManager.create(node_client, wallet_client, cb_store)
+            await manager.reconcile_reservations()
+            cb_coin_id = bytes32.from_hexstr(coin_id)
+            pending_spends = [pending for pending in await manager.tracker.check() if cb_coin_id in pending.coin_ids()]
+            if len(pending_spends) == 0:
+                print(f"No pending spend found for coin: {coin_id}")
+                return
+            try:
+                spend = await manager.bump_fee(pending_spends[0], fee, target_blocks)
+                print(f"Submitted spend {spend.name().hex()} with fee {spend.fees()} mojos")
+            except ValueError as e:
+                print(f"Failed to bump fee: {e}")
+        finally:
+            await cb_store.close()
+            node_client.close()
+            wallet_client.close()
+            await node_client.await_closed()
+            await wallet_client.await_closed()
+
+    asyncio.get_event_loop().run_until_complete(do_command(fee, fingerprint))
+
+
+@cli.command(
+    "prepare",
+    short_help="Write unsigned claws or claims to a file for an offline signer",
+)
+@click.option(
+    "-c",
+    "--coin-id",
+    "coin_ids",
+    help="The ID of a clawback coin to spend. Can be given more than once",
+    required=True,
+    type=str,
+    multiple=True,
+)
+@click.option(
+    "--claim",
+    help="Prepare claims as the recipient instead of claws as the sender",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "-t",
+    "--target-address",
+    help="The address to send the coins to",
+    required=False,
+    type=str,
+    default=None,
+)
+@click.option(
+    "-mpk",
+    "--master-public-key",
+    help="The master public key of the signing wallet. Defaults to the logged in wallet's key",
+    required=False,
+    type=str,
+    default=None,
+)
+@click.option(
+    "-o",
+    "--output",
+    help="The file to write the unsigned spends to",
+    required=True,
+    type=str,
+)
+@click.option(
+    "-w",
+    "--wallet-id",
+    help="The wallet id to send the coins to if no target address is given",
+    required=False,
+    type=int,
+    default=1,
+)
+@common_options
+def prepare_cmd(
+    coin_ids: Tuple[str, ...],
+    claim: bool,
+    target_address: Optional[str],
+    master_public_key: Optional[str],
+    output: str,
+    wallet_id: int = 1,
+    db_path: str = "",
+    wallet_rpc_port: Optional[int] = None,
+    fingerprint: Optional[int] = None,
+    node_rpc_port: Optional[int] = None,
+    node_url: Tuple[str, ...] = (),
+    shared_db: bool = False,
+):
+    """
+    \b
+    Build unsigned claws or claims and the data an offline machine needs to sign them
+    """
+
+    async def do_command(fingerprint, target_address):
+        node_client, wallet_client = await get_node_and_wallet_clients(
+            node_rpc_port, wallet_rpc_port, fingerprint, node_url
+        )
+        if not fingerprint:
+            fingerprint = await wallet_client.get_logged_in_fingerprint()
+        cb_store = await open_cb_store(db_path, fingerprint, shared_db)
+        try:
+            manager = await CBManager.create(node_client, wallet_client, cb_store)
+            if master_public_key:
+                master_pk = G1Element.from_bytes(hexstr_to_bytes(master_public_key))
+            else:
+                master_pk = G1Element.from_bytes(
+                    hexstr_to_bytes((await wallet_client.get_private_key(fingerprint))["pk"])
+                )
+            if not target_address:
+                target_address = await wallet_client.get_next_address(wallet_id, True)
+            target_ph = decode_puzzle_hash(target_address)
+            try:
+                # Signing offline takes a while, a coin that's gone now won't be back by then
+                ids = [bytes32.from_hexstr(coin_id) for coin_id in coin_ids]
+                coin_records = await get_unspent_coin_records(manager, ids)
+                spends = []
+                for coin_id, coin_record in zip(ids, coin_records):
+                    if claim:
+                        spends.append(await manager.prepare_claim_spend(coin_record.coin, target_ph, master_pk))
+                    else:
+                        cb_info = await manager.get_cb_info_by_id(coin_id)
+                        if cb_info is None:
+                            raise ValueError(f"Not a clawback coin: {coin_id.hex()}")
+                        spends.append(await manager.prepare_clawback_spend(cb_info, target_ph, master_pk))
+            except ValueError as e:
+                print(e)
+                return
+            Path(output).write_bytes(bytes(SigningRequest(spends)))
+            print(f"Wrote {len(spends)} unsigned spends to {output}")
+        finally:
+            await cb_store.close()
+            node_client.close()
+            wallet_client.close()
+            await node_client.await_closed()
+            await wallet_client.await_closed()
+
+    asyncio.get_event_loop().run_until_complete(do_command(fingerprint, target_address))
+
+
+@cli.command(
+    "sign",
+    short_help="Sign prepared spends with a key from the local keychain, no node or wallet needed",
+)
+@click.option(
+    "-i",
+    "--input",
+    "input_file",
+    help="The file of unsigned spends written by prepare",
+    required=True,
+    type=str,
+)
+@click.option(
+    "-o",
+    "--output",
+    help="The file to write the signatures to",
+    required=True,
+    type=str,
+)
+@click.option(
+    "-f",
+    "--fingerprint",
+    help="The fingerprint of the key to sign with. Defaults to the first key in the keychain",
+    required=False,
+    type=int,
+    default=None,
+)
+@click.option(
+    "--workers",
+    help="The number of processes to sign with. Defaults to one per core",
+    required=False,
+    type=int,
+    default=None,
+)
+def sign_cmd(input_file: str, output: str, fingerprint: Optional[int] = None, workers: Optional[int] = None):
+    """
+    \b
+    Sign prepared spends on an offline machine
+    """
+    request = SigningRequest.from_bytes(Path(input_file).read_bytes())
+    keychain = Keychain()
+    if fingerprint:
+        key = keychain.get_private_key_by_fingerprint(fingerprint)
+    else:
+        key = keychain.get_first_private_key()
+    if key is None:
+        print("No matching private key found in the keychain")
+        return
+    start = time.perf_counter()
+    response = sign_request(key[0], request, workers)
+    Path(output).write_bytes(bytes(response))
+    messages = sum(len(spend.targets) for spend in request.spends)
+    print(f"Signed {messages} messages for {len(request.spends)} spends in {time.perf_counter() - start:.2f}s")
+
+
+@cli.command(
+    "submit",
+    short_help="Push spends signed offline",
+)
+@click.option(
+    "-i",
+    "--input",
+    "input_file",
+    help="The file of unsigned spends written by prepare",
+    required=True,
+    type=str,
+)
+@click.option(
+    "-s",
+    "--signatures",
+    help="The file of signatures written by sign",
+    required=True,
+    type=str,
+)
+@click.option(
+    "-m",
+    "--fee",
+    "fee_str",
+    help="The fee in XCH to add to each spend, paid from the online wallet",
+    required=False,
+    type=str,
+    default="0",
+)
+@click.option(
+    "-g",
+    "--generator-out",
+    help="Also write the submitted spends as one compressed block generator to this file and report the savings",
+    required=False,
+    type=str,
+    default=None,
+)
+@common_options
+def submit_cmd(
+    input_file: str,
+    signatures: str,
+    fee_str: str = "0",
+    generator_out: Optional[str] = None,
+    db_path: str = "",
+    wallet_rpc_port: Optional[int] = None,
+    fingerprint: Optional[int] = None,
+    node_rpc_port: Optional[int] = None,
+    node_url: Tuple[str, ...] = (),
+    shared_db: bool = False,
+):
+    """
+    \b
+    Merge offline signatures into the prepared spends and push them all
+    """
+    fee = uint64(int(Decimal(fee_str) * MOJO_CONST))
+    request = SigningRequest.from_bytes(Path(input_file).read_bytes())
+    response = SigningResponse.from_bytes(Path(signatures).read_bytes())
+
+    async def do_command(fingerprint):
+        node_client, wallet_client = await get_node_and_wallet_clients(
+            node_rpc_port, wallet_rpc_port, fingerprint, node_url
+        )
+        if not fingerprint:
+            fingerprint = await wallet_client.get_logged_in_fingerprint()
+        cb_store = await open_cb_store(db_path, fingerprint, shared_db)
+        manager: Optional[CBManager] = None
+        try:
+            manager = await CBManager.create(node_client, wallet_client, cb_store)
+            await manager.reconcile_reservations()
+            pushed = await manager.submit_signed_spends(request, response, fee)
+            print(f"Submitted {len(pushed)} of {len(request.spends)} spends")
+            if generator_out and pushed:
+                generator, report = compress_spend_bundle(SpendBundle.aggregate(pushed))
+                Path(generator_out).write_bytes(bytes(generator))
+                print(
+                    f"Wrote a block generator sharing {report.shared_subtrees} subtrees to {generator_out}: "
+                    f"{report.original_size} -> {report.compressed_size} bytes, "
+                    f"cost {report.original_cost} -> {report.compressed_cost}"
+                )
+        finally:
+            if manager is not None:
+                manager.validator.close()
+            await cb_store.close()
+            node_client.close()
+            wallet_client.close()
+            await node_client.await_closed()
+            await wallet_client.await_closed()
+
+    asyncio.get_event_loop().run_until_complete(do_command(fingerprint))
+
+
 def main() -> None:
     monkey_patch_click()
-    asyncio.run(cli())  # pylint: disable=no-value-for-parameter
+    # Commands run their own event loop, so none is started around them
+    cli()  # pylint: disable=no-value-for-parameter
 
 
 if __name__ == "__main__":
@@ -1,25 +1,236 @@
+import asyncio
+import logging
+import random
+import time
+import weakref
 from pprint import pprint
-from typing import Optional, Tuple
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type, TypeVar
 
 import aiohttp
 
 # from chia.cmds.wallet_funcs import get_wallet
 from chia.rpc.full_node_rpc_client import FullNodeRpcClient
+from chia.rpc.rpc_client import RpcClient
 from chia.rpc.wallet_rpc_client import WalletRpcClient
 from chia.util.config import load_config
 from chia.util.default_root import DEFAULT_ROOT_PATH
 from chia.util.ints import uint16
 
+log = logging.getLogger(__name__)
 
-async def get_node_client(full_node_rpc_port: Optional[int]):
+# Seconds to wait for a single RPC before giving up on the endpoint
+REQUEST_TIMEOUT = 30
+# Rounds over all endpoints before an idempotent call fails
+MAX_ATTEMPTS = 3
+# Backoff between rounds and before retrying a failed endpoint, in seconds
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 10.0
+# Concurrent requests allowed to a single endpoint
+MAX_IN_FLIGHT = 16
+# Weight of the newest sample in an endpoint's latency average
+LATENCY_SMOOTHING = 0.2
+
+# Calls that change node state, which are never repeated once they may have reached a node
+NON_IDEMPOTENT_PATHS = {"push_tx", "stop_node", "open_connection", "close_connection"}
+
+_T_RpcClient = TypeVar("_T_RpcClient", bound=RpcClient)
+
+
+class SharedSession:
+    """
+    The HTTP session shared by the RPC clients on one event loop, so connections to a node are
+    kept alive and reused instead of repeating the TLS handshake for each client. Every client
+    acquires it when created and releases it when closed, and the last release closes it.
+    """
+
+    sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, SharedSession]" = weakref.WeakKeyDictionary()
+
+    session: aiohttp.ClientSession
+    users: int
+
+    def __init__(self) -> None:
+        self.session = aiohttp.ClientSession()
+        self.users = 0
+
+    @classmethod
+    def acquire(cls) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        shared = cls.sessions.get(loop)
+        if shared is None or shared.session.closed:
+            shared = cls()
+            cls.sessions[loop] = shared
+        shared.users += 1
+        return shared.session
+
+    @classmethod
+    async def release(cls, session: aiohttp.ClientSession) -> None:
+        shared = cls.sessions.get(asyncio.get_running_loop())
+        if shared is None or shared.session is not session:
+            # Not the shared session, or one already replaced, so this client is its only user
+            await session.close()
+            return
+        shared.users -= 1
+        if shared.users == 0:
+            await session.close()
+
+
+class SharedSessionClient(RpcClient):
+    """An RPC client that releases the shared session on close instead of closing it for everyone."""
+
+    def close(self) -> None:
+        # Closing twice must not release the session twice
+        if self.closing_task is None:
+            self.closing_task = asyncio.create_task(SharedSession.release(self.session))
+
+
+class NodeClient(SharedSessionClient, FullNodeRpcClient):
+    pass
+
+
+class WalletClient(SharedSessionClient, WalletRpcClient):
+    pass
+
+
+async def create_rpc_client(
+    client_type: Type[_T_RpcClient], hostname: str, port: uint16, config: Dict[str, Any]
+) -> _T_RpcClient:
+    client = await client_type.create(hostname, port, DEFAULT_ROOT_PATH, config)
+    await client.session.close()
+    client.session = SharedSession.acquire()
+    return client
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter, so clients that failed together retry apart."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def parse_node_url(node_url: str) -> Tuple[str, uint16]:
+    hostname, _, port = node_url.rpartition(":")
+    if not hostname or not port.isdigit():
+        raise ValueError(f"Expected a full node as host:port, got {node_url}")
+    return hostname, uint16(int(port))
+
+
+class NodeEndpoint:
+    """
+    One full node behind a FullNodeClientPool, with its recent latency and health.
+    """
+
+    client: FullNodeRpcClient
+    semaphore: asyncio.Semaphore
+    latency: float
+    failures: int
+    retry_at: float
+
+    def __init__(self, client: FullNodeRpcClient, max_in_flight: int = MAX_IN_FLIGHT):
+        self.client = client
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.latency = 0.0
+        self.failures = 0
+        self.retry_at = 0.0
+
+    def __str__(self) -> str:
+        return f"{self.client.hostname}:{self.client.port}"
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.retry_at
+
+    async def fetch(self, path: str, request_json: Dict[str, Any]) -> Dict[str, Any]:
+        async with self.semaphore:
+            start = time.monotonic()
+            try:
+                response = await asyncio.wait_for(self.client.fetch(path, request_json), REQUEST_TIMEOUT)
+            except ValueError:
+                # The node answered, it just didn't like the request
+                self.record_success(time.monotonic() - start)
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.record_failure(time.monotonic())
+                raise
+            self.record_success(time.monotonic() - start)
+            return response
+
+    def record_success(self, elapsed: float) -> None:
+        if self.latency == 0:
+            self.latency = elapsed
+        else:
+            self.latency += LATENCY_SMOOTHING * (elapsed - self.latency)
+        self.failures = 0
+        self.retry_at = 0.0
+
+    def record_failure(self, now: float) -> None:
+        self.failures += 1
+        self.retry_at = now + backoff_delay(self.failures)
+
+
+class FullNodeClientPool(FullNodeRpcClient):
+    """
+    A FullNodeRpcClient that spreads calls over several full nodes. Each call goes to the
+    fastest healthy node and fails over to the next one on connection errors or timeouts.
+    Idempotent calls are retried with jittered backoff once every node has failed.
+    """
+
+    endpoints: List[NodeEndpoint]
+
+    @classmethod
+    async def from_clients(cls, clients: List[FullNodeRpcClient], max_in_flight: int = MAX_IN_FLIGHT):
+        if len(clients) == 0:
+            raise ValueError("A client pool needs at least one full node")
+        self = cls()
+        self.endpoints = [NodeEndpoint(client, max_in_flight) for client in clients]
+        self.hostname = clients[0].hostname
+        self.port = clients[0].port
+        self.url = clients[0].url
+        self.session = clients[0].session
+        self.ssl_context = clients[0].ssl_context
+        self.closing_task = None
+        return self
+
+    def ranked_endpoints(self) -> List[NodeEndpoint]:
+        """Healthy endpoints fastest first, then the rest in the order they come off backoff."""
+        now = time.monotonic()
+        healthy = sorted([e for e in self.endpoints if e.healthy(now)], key=lambda e: e.latency)
+        backing_off = sorted([e for e in self.endpoints if not e.healthy(now)], key=lambda e: e.retry_at)
+        return healthy + backing_off
+
+    async def fetch(self, path, request_json) -> Dict[str, Any]:
+        idempotent = path not in NON_IDEMPOTENT_PATHS
+        attempts = MAX_ATTEMPTS if idempotent else 1
+        last_error: Optional[Exception] = None
+        for attempt in range(attempts):
+            if attempt > 0:
+                await asyncio.sleep(backoff_delay(attempt))
+            for endpoint in self.ranked_endpoints():
+                try:
+                    return await endpoint.fetch(path, request_json)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    last_error = e
+                    log.warning(f"Full node {endpoint} failed {path}: {e!r}")
+                    # Only a call that never reached the node is safe to send to another one
+                    if not idempotent and not isinstance(e, aiohttp.ClientConnectorError):
+                        raise
+        raise ConnectionError(f"No full node could serve {path}: {last_error!r}")
+
+    def close(self) -> None:
+        # The pool borrows its endpoints' session, so each endpoint releases it once
+        for endpoint in self.endpoints:
+            endpoint.client.close()
+
+    async def await_closed(self) -> None:
+        for endpoint in self.endpoints:
+            await endpoint.client.await_closed()
+
+
+async def get_node_client(full_node_rpc_port: Optional[int], node_urls: Sequence[str] = ()):
     try:
+        config = load_config(DEFAULT_ROOT_PATH, "config.yaml")
+        self_hostname = config["self_hostname"]
         if full_node_rpc_port is None:
-            config = load_config(DEFAULT_ROOT_PATH, "config.yaml")
-            self_hostname = config["self_hostname"]
             full_node_rpc_port = config["full_node"]["rpc_port"]
-        full_node_client = await FullNodeRpcClient.create(
-            self_hostname, uint16(full_node_rpc_port), DEFAULT_ROOT_PATH, config
-        )
+        endpoints = [(self_hostname, uint16(full_node_rpc_port))] + [parse_node_url(url) for url in node_urls]
+        clients = [await create_rpc_client(NodeClient, host, port, config) for host, port in endpoints]
+        full_node_client = await FullNodeClientPool.from_clients(clients)
         return full_node_client
     except Exception as e:
         if isinstance(e, aiohttp.ClientConnectorError):
@@ -31,11 +242,11 @@ async def get_node_client(full_node_rpc_port: Optional[int]):
 
 async def get_wallet_client(wallet_rpc_port: Optional[int]):
     try:
+        config = load_config(DEFAULT_ROOT_PATH, "config.yaml")
+        self_hostname = config["self_hostname"]
         if wallet_rpc_port is None:
-            config = load_config(DEFAULT_ROOT_PATH, "config.yaml")
-            self_hostname = config["self_hostname"]
             wallet_rpc_port = config["wallet"]["rpc_port"]
-        wallet_client = await WalletRpcClient.create(self_hostname, uint16(wallet_rpc_port), DEFAULT_ROOT_PATH, config)
+        wallet_client = await create_rpc_client(WalletClient, self_hostname, uint16(wallet_rpc_port), config)
         return wallet_client
     except Exception as e:
         if isinstance(e, aiohttp.ClientConnectorError):
@@ -49,9 +260,10 @@ async def get_node_and_wallet_clients(
     full_node_rpc_port: Optional[int],
     wallet_rpc_port: Optional[int],
     fingerprint: Optional[int],
+    node_urls: Sequence[str] = (),
 ) -> Optional[Tuple[FullNodeRpcClient, WalletRpcClient]]:
     try:
-        full_node_client: FullNodeRpcClient = await get_node_client(full_node_rpc_port)
+        full_node_client: FullNodeRpcClient = await get_node_client(full_node_rpc_port, node_urls)
         wallet_client: WalletRpcClient = await get_wallet_client(wallet_rpc_port)
         # wallet_client_f = await get_wallet(_wallet_client, fingerprint)
         # assert wallet_client_f is not None
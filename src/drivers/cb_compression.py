@@ -0,0 +1,204 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from chia.consensus.default_constants import DEFAULT_CONSTANTS
+from chia.full_node.bundle_tools import simple_solution_generator
+from chia.full_node.mempool_check_conditions import get_name_puzzle_conditions
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.program import Program
+from chia.types.blockchain_format.serialized_program import SerializedProgram
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_spend import CoinSpend
+from chia.types.generator_types import BlockGenerator
+from chia.types.spend_bundle import SpendBundle
+from chia.util.errors import Err
+from chia.util.hash import std_hash
+from chia.util.ints import uint32, uint64
+
+from src.drivers.cb_costs import MAX_BLOCK_COST
+
+# Subtrees smaller than this many serialized bytes are cheaper to repeat than to reference
+MIN_SHARED_SIZE = 8
+
+# CLVM operators used by the generator
+QUOTE = 1
+APPLY = 2
+CONS = 4
+
+
+@dataclass(frozen=True)
+class CompressionReport:
+    original_size: int
+    compressed_size: int
+    original_cost: uint64
+    compressed_cost: uint64
+    shared_subtrees: int
+
+
+class _Node:
+    """A subtree of a coin spend with its tree hash and serialized size worked out once."""
+
+    __slots__ = ("program", "key", "size", "children", "shared", "has_shared")
+
+    def __init__(self, program: Program, key: bytes32, size: int, children: Optional[Tuple["_Node", "_Node"]]):
+        self.program = program
+        self.key = key
+        self.size = size
+        self.children = children
+        self.shared = False
+        self.has_shared = False
+
+
+def _atom_size(atom: bytes) -> int:
+    # Serialized size of an atom, following the length prefixes in clvm.serialize
+    if len(atom) == 0 or (len(atom) == 1 and atom[0] <= 0x7F):
+        return 1
+    for prefix_size, limit in enumerate((0x40, 0x2000, 0x100000, 0x8000000), start=1):
+        if len(atom) < limit:
+            return prefix_size + len(atom)
+    return 5 + len(atom)
+
+
+def _index_subtrees(program: Program, counts: Dict[bytes32, int]) -> _Node:
+    # Tree hashes and sizes are built bottom up so each subtree is only walked once
+    if program.pair is None:
+        node = _Node(program, std_hash(b"\1" + program.atom), _atom_size(program.atom), None)
+    else:
+        left = _index_subtrees(program.pair[0], counts)
+        right = _index_subtrees(program.pair[1], counts)
+        node = _Node(program, std_hash(b"\2" + left.key + right.key), 1 + left.size + right.size, (left, right))
+    counts[node.key] = counts.get(node.key, 0) + 1
+    return node
+
+
+def _select_shared(node: _Node, counts: Dict[bytes32, int], shared: Dict[bytes32, Program]) -> bool:
+    # Keeps the largest repeated subtrees, anything inside them is stored once along with them
+    if counts[node.key] > 1 and node.size >= MIN_SHARED_SIZE:
+        shared.setdefault(node.key, node.program)
+        node.shared = True
+        return True
+    if node.children is None:
+        return False
+    found_left = _select_shared(node.children[0], counts, shared)
+    found_right = _select_shared(node.children[1], counts, shared)
+    node.has_shared = found_left or found_right
+    return node.has_shared
+
+
+def _path_for_steps(steps: List[int]) -> int:
+    # CLVM environment paths are read from the least significant bit, 0 for first and 1 for rest
+    path = 1 << len(steps)
+    for i, step in enumerate(steps):
+        path |= step << i
+    return path
+
+
+def _build_table(entries: List[Tuple[bytes32, Program]], steps: List[int], paths: Dict[bytes32, int]) -> Program:
+    # A balanced tree keeps every reference to a few bits no matter how many subtrees are shared
+    if len(entries) == 1:
+        key, program = entries[0]
+        paths[key] = _path_for_steps(steps)
+        return program
+    middle = len(entries) // 2
+    left = _build_table(entries[:middle], steps + [0], paths)
+    right = _build_table(entries[middle:], steps + [1], paths)
+    return Program.to((left, right))
+
+
+def _encode(node: _Node, paths: Dict[bytes32, int]) -> Program:
+    # Returns a program that rebuilds the subtree, reading the shared ones from the environment
+    if node.shared:
+        return Program.to(paths[node.key])
+    if not node.has_shared or node.children is None:
+        return Program.to((QUOTE, node.program))
+    return Program.to([CONS, _encode(node.children[0], paths), _encode(node.children[1], paths)])
+
+
+def _coin_spend_entries(spend_bundle: SpendBundle) -> List[Program]:
+    return [
+        Program.to(
+            [
+                coin_spend.coin.parent_coin_info,
+                coin_spend.puzzle_reveal.to_program(),
+                coin_spend.coin.amount,
+                coin_spend.solution.to_program(),
+            ]
+        )
+        for coin_spend in spend_bundle.coin_spends
+    ]
+
+
+def compressed_generator(spend_bundle: SpendBundle) -> BlockGenerator:
+    """
+    Builds a block generator for the spend bundle that stores every repeated subtree, like the
+    clawback mod or a curried puzzle shared by several coins, once in a table and rebuilds
+    each coin spend from references into it.
+    """
+    return _compress(spend_bundle)[0]
+
+
+def _compress(spend_bundle: SpendBundle) -> Tuple[BlockGenerator, int]:
+    counts: Dict[bytes32, int] = {}
+    nodes = [_index_subtrees(entry, counts) for entry in _coin_spend_entries(spend_bundle)]
+    shared: Dict[bytes32, Program] = {}
+    for node in nodes:
+        _select_shared(node, counts, shared)
+    plain = simple_solution_generator(spend_bundle)
+    if not shared:
+        return plain, 0
+
+    # The body runs with the table as the first item of its environment
+    paths: Dict[bytes32, int] = {}
+    table = _build_table(list(shared.items()), [0], paths)
+    # Built from the end so long bundles don't recurse once per spend
+    body = Program.to((QUOTE, 0))
+    for node in reversed(nodes):
+        body = Program.to([CONS, _encode(node, paths), body])
+    body = Program.to([CONS, body, (QUOTE, 0)])
+    program = Program.to([APPLY, (QUOTE, body), [CONS, (QUOTE, table), 1]])
+    generator = BlockGenerator(SerializedProgram.from_program(program), [], [])
+    # Rebuilding small bundles from references can take more bytes than just quoting them
+    if len(bytes(generator.program)) >= len(bytes(plain.program)):
+        return plain, 0
+    return generator, len(shared)
+
+
+def generator_coin_spends(generator: BlockGenerator) -> List[CoinSpend]:
+    """Runs a generator without refs and returns the coin spends it produces."""
+    output = generator.program.to_program().run([0, []])
+    coin_spends: List[CoinSpend] = []
+    for entry in output.first().as_iter():
+        parent_id, puzzle, amount, solution = entry.as_iter()
+        puzzle_reveal = SerializedProgram.from_program(puzzle)
+        coin = Coin(bytes32(parent_id.atom), puzzle_reveal.get_tree_hash(), uint64(amount.as_int()))
+        coin_spends.append(CoinSpend(coin, puzzle_reveal, SerializedProgram.from_program(solution)))
+    return coin_spends
+
+
+def generator_cost(generator: BlockGenerator, max_cost: int = MAX_BLOCK_COST) -> uint64:
+    """Returns the cost a block pays for the generator, including execution, condition and byte costs."""
+    npc_result = get_name_puzzle_conditions(
+        generator, max_cost, mempool_mode=True, height=uint32(DEFAULT_CONSTANTS.SOFT_FORK2_HEIGHT)
+    )
+    if npc_result.error is not None:
+        raise ValueError(f"Generator failed to run: {Err(npc_result.error).name}")
+    return uint64(npc_result.cost)
+
+
+def compress_spend_bundle(spend_bundle: SpendBundle) -> Tuple[BlockGenerator, CompressionReport]:
+    """
+    Returns the compressed generator for the spend bundle along with its size and cost next to
+    those of the plain generator the mempool would build for it.
+    """
+    original = simple_solution_generator(spend_bundle)
+    compressed, shared_subtrees = _compress(spend_bundle)
+    if generator_coin_spends(compressed) != spend_bundle.coin_spends:
+        raise ValueError("The compressed generator doesn't rebuild the spend bundle")
+    report = CompressionReport(
+        len(bytes(original.program)),
+        len(bytes(compressed.program)),
+        generator_cost(original),
+        generator_cost(compressed),
+        shared_subtrees,
+    )
+    return compressed, report
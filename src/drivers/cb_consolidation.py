@@ -0,0 +1,94 @@
+import logging
+from dataclasses import dataclass
+from secrets import token_bytes
+from typing import List
+
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.util.bech32m import decode_puzzle_hash
+from chia.util.ints import uint64
+from chia.wallet.transaction_record import TransactionRecord
+
+from src.drivers.cb_manager import CBManager
+
+log = logging.getLogger(__name__)
+
+# Consolidate once the wallet holds more than this many spendable coins
+DEFAULT_MAX_COINS = 200
+
+# Most coins merged by one consolidation spend, which keeps it well under the cost limit
+MAX_CONSOLIDATION_INPUTS = 100
+
+
+@dataclass(frozen=True)
+class ConsolidationPolicy:
+    max_coins: int = DEFAULT_MAX_COINS
+    max_inputs: int = MAX_CONSOLIDATION_INPUTS
+    # Paid by each consolidation spend out of the coins it merges
+    fee: uint64 = uint64(0)
+    wallet_id: int = 1
+
+
+class WalletConsolidator:
+    """
+    Keeps the number of spendable coins in a wallet bounded. Every claim or claw leaves a coin
+    behind, and once there are more than the policy allows the smallest are merged back into
+    the wallet, so coin selection and fee spends don't slow down as payouts pile up. Coins
+    reserved by pending spends and fee pool coins are left alone.
+    """
+
+    manager: CBManager
+    policy: ConsolidationPolicy
+
+    @classmethod
+    async def create(cls, manager: CBManager, policy: ConsolidationPolicy = ConsolidationPolicy()):
+        self = cls()
+        self.manager = manager
+        self.policy = policy
+        return self
+
+    async def get_spendable_coins(self) -> List[Coin]:
+        """Returns the wallet's spendable coins that no pending spend holds, smallest first."""
+        excluded = await self.manager.reservations.get_reserved_coins()
+        excluded += [record.coin for record in await self.manager.cb_store.get_fee_coin_records()]
+        records, _, _ = await self.manager.wallet_client.get_spendable_coins(
+            self.policy.wallet_id, excluded_coin_ids=[coin.name().hex() for coin in excluded]
+        )
+        return sorted((record.coin for record in records), key=lambda coin: coin.amount)
+
+    async def consolidate(self) -> List[TransactionRecord]:
+        """
+        Merges the smallest coins into one coin per spend until the wallet is back within the
+        policy's limit, and returns the transactions pushed.
+        """
+        coins = await self.get_spendable_coins()
+        # Merging n coins into one leaves n - 1 fewer
+        excess = len(coins) - self.policy.max_coins
+        txs: List[TransactionRecord] = []
+        while excess > 0 and len(coins) > 1:
+            count = min(excess + 1, self.policy.max_inputs, len(coins))
+            group, coins = coins[:count], coins[count:]
+            total = sum(coin.amount for coin in group)
+            if total <= self.policy.fee:
+                log.info(f"Not consolidating {count} coins worth {total} mojos, less than the fee")
+                break
+            reserved_for = bytes32(token_bytes(32))
+            if not await self.manager.reservations.reserve(group, reserved_for):
+                continue
+            address = await self.manager.wallet_client.get_next_address(self.policy.wallet_id, False)
+            addition = {"puzzle_hash": decode_puzzle_hash(address), "amount": uint64(total - self.policy.fee)}
+            try:
+                tx = await self.manager.wallet_client.create_signed_transaction(
+                    [addition], coins=group, fee=self.policy.fee, wallet_id=self.policy.wallet_id
+                )
+                assert tx.spend_bundle is not None
+                await self.manager.validator.check(tx.spend_bundle)
+                await self.manager.wallet_client.push_transactions([tx])
+            except ValueError as e:
+                log.warning(f"Failed to consolidate {count} coins: {e}")
+                await self.manager.reservations.release(reserved_for)
+                break
+            await self.manager.reservations.reassign(reserved_for, tx.spend_bundle.name())
+            txs.append(tx)
+            excess -= count - 1
+        return txs
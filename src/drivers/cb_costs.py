@@ -0,0 +1,230 @@
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from blspy import AugSchemeMPL, G2Element
+from chia.consensus.default_constants import DEFAULT_CONSTANTS
+from chia.full_node.bundle_tools import simple_solution_generator
+from chia.full_node.mempool_check_conditions import get_name_puzzle_conditions
+from chia.rpc.full_node_rpc_client import FullNodeRpcClient
+from chia.types.announcement import Announcement
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.program import Program
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_spend import CoinSpend
+from chia.types.condition_opcodes import ConditionOpcode
+from chia.types.spend_bundle import SpendBundle
+from chia.util.errors import Err
+from chia.util.hash import std_hash
+from chia.util.ints import uint32, uint64
+from chia.wallet.puzzles.p2_delegated_puzzle_or_hidden_puzzle import puzzle_for_pk, solution_for_conditions
+from clvm.casts import int_to_bytes
+
+from src.drivers.cb_puzzles import CB_FEE_ANNOUNCEMENT, create_clawback_puzzle, create_clawback_solution
+
+# The mempool refuses any single spend bundle costing more than half a block
+MAX_BLOCK_COST = uint64(DEFAULT_CONSTANTS.MAX_BLOCK_COST_CLVM)
+MAX_SPEND_BUNDLE_COST = uint64(DEFAULT_CONSTANTS.MAX_BLOCK_COST_CLVM // 2)
+
+# Transaction blocks arrive roughly every 52 seconds on mainnet
+SECONDS_PER_TRANSACTION_BLOCK = 52
+DEFAULT_TARGET_BLOCKS = 3
+
+# Shapes for the standard cost table
+CREATE = "create"
+CREATE_EXTRA_INPUT = "create_extra_input"
+CLAW = "claw"
+CLAW_WITH_FEE = "claw_with_fee"
+CLAIM = "claim"
+CLAIM_WITH_FEE = "claim_with_fee"
+
+# Amounts and timelocks used to build the sample spends behind the cost table
+MAX_AMOUNT = uint64(2 ** 64 - 1)
+
+
+def compute_spend_cost(spend_bundle: SpendBundle, max_cost: int = MAX_BLOCK_COST) -> uint64:
+    """
+    Runs the spend bundle through the same generator the mempool uses and returns its
+    total CLVM cost, including execution, condition and byte costs.
+    """
+    generator = simple_solution_generator(spend_bundle)
+    npc_result = get_name_puzzle_conditions(
+        generator, max_cost, mempool_mode=True, height=uint32(DEFAULT_CONSTANTS.SOFT_FORK2_HEIGHT)
+    )
+    if npc_result.error is not None:
+        raise ValueError(f"Spend bundle failed to run: {Err(npc_result.error).name}")
+    return uint64(npc_result.cost)
+
+
+@lru_cache(maxsize=1)
+def _sample_puzzle() -> Program:
+    return puzzle_for_pk(AugSchemeMPL.key_gen(bytes([1] * 32)).get_g1())
+
+
+def _sample_fee_spend(fee_coin: Coin, cb_coin: Coin) -> CoinSpend:
+    # Mirrors the shape of the standard wallet's fee transaction
+    change = Coin(fee_coin.name(), fee_coin.puzzle_hash, uint64(fee_coin.amount - 1))
+    message = std_hash(fee_coin.name() + change.name())
+    conditions = [
+        [ConditionOpcode.CREATE_COIN, fee_coin.puzzle_hash, change.amount],
+        [ConditionOpcode.RESERVE_FEE, 1],
+        [ConditionOpcode.CREATE_COIN_ANNOUNCEMENT, message],
+        [ConditionOpcode.ASSERT_COIN_ANNOUNCEMENT, Announcement(cb_coin.name(), CB_FEE_ANNOUNCEMENT).name()],
+    ]
+    return CoinSpend(fee_coin, _sample_puzzle(), solution_for_conditions(conditions))
+
+
+def _sample_cb_spend(shape: str) -> SpendBundle:
+    inner_puzzle = _sample_puzzle()
+    inner_ph = inner_puzzle.get_tree_hash()
+    cb_puzzle = create_clawback_puzzle(MAX_AMOUNT, inner_ph, bytes32(b"\x01" * 32))
+    if shape in (CLAIM, CLAIM_WITH_FEE):
+        cb_puzzle = create_clawback_puzzle(MAX_AMOUNT, bytes32(b"\x01" * 32), inner_ph)
+    cb_coin = Coin(bytes32(b"\x02" * 32), cb_puzzle.get_tree_hash(), MAX_AMOUNT)
+    conditions: List[List] = [
+        [ConditionOpcode.CREATE_COIN, inner_ph, MAX_AMOUNT],
+        [ConditionOpcode.CREATE_COIN_ANNOUNCEMENT, CB_FEE_ANNOUNCEMENT],
+    ]
+    spends: List[CoinSpend] = []
+    if shape in (CLAW_WITH_FEE, CLAIM_WITH_FEE):
+        spends.append(_sample_fee_spend(Coin(bytes32(b"\x03" * 32), inner_ph, MAX_AMOUNT), cb_coin))
+    inner_solution = solution_for_conditions(conditions)
+    if shape in (CLAIM, CLAIM_WITH_FEE):
+        solution = create_clawback_solution(MAX_AMOUNT, bytes32(b"\x01" * 32), inner_ph, inner_puzzle, inner_solution)
+    else:
+        solution = create_clawback_solution(MAX_AMOUNT, inner_ph, bytes32(b"\x01" * 32), inner_puzzle, inner_solution)
+    spends.insert(0, CoinSpend(cb_coin, cb_puzzle, solution))
+    return SpendBundle(spends, G2Element())
+
+
+def _sample_create_spend(extra_inputs: int) -> SpendBundle:
+    puzzle = _sample_puzzle()
+    ph = puzzle.get_tree_hash()
+    coins = [Coin(bytes32(bytes([i + 4]) * 32), ph, MAX_AMOUNT) for i in range(extra_inputs + 1)]
+    origin_coin = coins[0]
+    cb_puzzle_hash = create_clawback_puzzle(MAX_AMOUNT, ph, ph).get_tree_hash()
+    # Split the input three ways so every output amount is still eight bytes long
+    cb_amount = uint64(MAX_AMOUNT // 2)
+    change = uint64(MAX_AMOUNT // 4)
+    fee = uint64(MAX_AMOUNT - cb_amount - change)
+    cb_coin = Coin(origin_coin.name(), cb_puzzle_hash, cb_amount)
+    message = std_hash(b"".join([c.name() for c in coins] + [cb_coin.name()]))
+    announcement_hash = Announcement(origin_coin.name(), message).name()
+    conditions = [
+        # Hinted to the recipient and the sender
+        [ConditionOpcode.CREATE_COIN, cb_puzzle_hash, cb_amount, [ph, ph]],
+        [ConditionOpcode.RESERVE_FEE, fee],
+        [ConditionOpcode.REMARK, ph + ph + int_to_bytes(MAX_AMOUNT)],
+        [ConditionOpcode.CREATE_COIN_ANNOUNCEMENT, message],
+        [ConditionOpcode.CREATE_COIN, ph, change],
+    ]
+    spends = [CoinSpend(origin_coin, puzzle, solution_for_conditions(conditions))]
+    for coin in coins[1:]:
+        assertion = solution_for_conditions([[ConditionOpcode.ASSERT_COIN_ANNOUNCEMENT, announcement_hash]])
+        spends.append(CoinSpend(coin, puzzle, assertion))
+    return SpendBundle(spends, G2Element())
+
+
+@lru_cache(maxsize=1)
+def standard_spend_costs() -> Dict[str, uint64]:
+    """
+    Cost table for the standard clawback spend shapes. Amounts and timelocks are maxed out
+    so the values are upper bounds for any real spend of the same shape.
+    """
+    costs: Dict[str, uint64] = {}
+    for shape in (CLAW, CLAW_WITH_FEE, CLAIM, CLAIM_WITH_FEE):
+        costs[shape] = compute_spend_cost(_sample_cb_spend(shape))
+    costs[CREATE] = compute_spend_cost(_sample_create_spend(0))
+    costs[CREATE_EXTRA_INPUT] = uint64(compute_spend_cost(_sample_create_spend(1)) - costs[CREATE])
+    return costs
+
+
+def max_merged_spends(shape: str, max_cost: int = MAX_SPEND_BUNDLE_COST) -> int:
+    """
+    How many claws or claims fit in one bundle that merges their outputs, along with a fee spend.
+    Each merged spend is priced as a full claw or claim, which overcounts the ones that only
+    assert the first spend's announcement.
+    """
+    costs = standard_spend_costs()
+    return int((max_cost - (costs[CLAW_WITH_FEE] - costs[CLAW])) // costs[shape])
+
+
+def min_replacement_fee(old_fee: int, old_cost: int, new_cost: int) -> uint64:
+    """
+    The smallest fee at which a replacement costing new_cost pays a strictly higher fee per
+    cost than the spend it replaces, which the mempool requires on top of the fee increase.
+    """
+    return uint64(old_fee * new_cost // old_cost + 1)
+
+
+def pack_by_cost(spend_bundles: List[SpendBundle], max_cost: int = MAX_SPEND_BUNDLE_COST) -> List[SpendBundle]:
+    """
+    Greedily aggregates spend bundles, in order, into as few bundles as fit under max_cost.
+    Summing the individual costs slightly overcounts the generator overhead, so each packed
+    bundle is guaranteed to fit.
+    """
+    packed: List[SpendBundle] = []
+    current: List[SpendBundle] = []
+    current_cost = 0
+    for spend_bundle in spend_bundles:
+        cost = compute_spend_cost(spend_bundle)
+        if cost > max_cost:
+            raise ValueError(f"Spend bundle {spend_bundle.name()} costs {cost}, more than the limit of {max_cost}")
+        if current and current_cost + cost > max_cost:
+            packed.append(SpendBundle.aggregate(current))
+            current, current_cost = [], 0
+        current.append(spend_bundle)
+        current_cost += cost
+    if current:
+        packed.append(SpendBundle.aggregate(current))
+    return packed
+
+
+class FeePlanner:
+    """
+    Picks fees from the node's fee estimator for a target number of transaction blocks.
+    """
+
+    node_client: FullNodeRpcClient
+
+    @classmethod
+    async def create(cls, node_client: FullNodeRpcClient):
+        self = cls()
+        self.node_client = node_client
+        return self
+
+    async def fee_for_cost(self, cost: int, target_blocks: int = DEFAULT_TARGET_BLOCKS) -> uint64:
+        target_time = max(1, target_blocks) * SECONDS_PER_TRANSACTION_BLOCK
+        response = await self.node_client.get_fee_estimate([target_time], int(cost))
+        return uint64(response["estimates"][0])
+
+    async def fee_for_shape(self, shape: str, target_blocks: int = DEFAULT_TARGET_BLOCKS) -> uint64:
+        return await self.fee_for_cost(standard_spend_costs()[shape], target_blocks)
+
+    async def build_with_fee(
+        self,
+        build: Callable[[uint64], Awaitable[SpendBundle]],
+        estimated_cost: int,
+        target_blocks: int = DEFAULT_TARGET_BLOCKS,
+        discard: Optional[Callable[[SpendBundle], Awaitable[None]]] = None,
+    ) -> Tuple[SpendBundle, uint64]:
+        """
+        Builds a spend with a fee priced from estimated_cost, then measures the built bundle
+        and rebuilds it once if it turned out more expensive than estimated. A bundle that is
+        thrown away is passed to discard first, so the coins it reserved can be released.
+        """
+        fee = await self.fee_for_cost(estimated_cost, target_blocks)
+        spend_bundle = await build(fee)
+        cost = compute_spend_cost(spend_bundle)
+        if cost > estimated_cost:
+            try:
+                new_fee = await self.fee_for_cost(cost, target_blocks)
+            except Exception:
+                if discard is not None:
+                    await discard(spend_bundle)
+                raise
+            if new_fee > fee:
+                if discard is not None:
+                    await discard(spend_bundle)
+                fee = new_fee
+                spend_bundle = await build(fee)
+        return spend_bundle, fee
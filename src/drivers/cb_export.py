@@ -0,0 +1,149 @@
+import itertools
+import json
+from dataclasses import dataclass
+from typing import AsyncIterator, BinaryIO, Iterator, List, Optional, Tuple
+
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.util.ints import uint32, uint64
+from chia.util.streamable import Streamable, streamable
+
+from src.drivers.cb_info import CBInfo
+from src.drivers.cb_store import CBStore
+
+# Export formats
+NDJSON = "ndjson"
+BINARY = "binary"
+EXPORT_FORMATS = [NDJSON, BINARY]
+
+# Binary exports start with this, then hold each record as a 4 byte length and its streamable bytes
+BINARY_MAGIC = b"CBX\x01"
+LENGTH_SIZE = 4
+
+# Records read from the store or written to it per transaction
+EXPORT_BATCH_SIZE = 1000
+
+
+@streamable
+@dataclass(frozen=True)
+class ExportedRecord(Streamable):
+    """A stored clawback coin along with the wallet it belongs to and how it was spent, if known."""
+
+    coin: Coin
+    recipient_ph: bytes32
+    sender_ph: bytes32
+    timelock: uint64
+    timelock_unit: str
+    confirmed_block_height: uint32
+    spent_block_height: uint32
+    timestamp: uint64
+    fingerprint: uint32
+    spent_by: Optional[str]
+
+    @classmethod
+    def from_cb_info(cls, fingerprint: int, record: CBInfo, spent_by: Optional[str]) -> "ExportedRecord":
+        return cls(
+            record.coin,
+            record.recipient_ph,
+            record.sender_ph,
+            record.timelock,
+            record.timelock_unit,
+            record.confirmed_block_height,
+            record.spent_block_height,
+            record.timestamp,
+            uint32(fingerprint),
+            spent_by,
+        )
+
+    def to_cb_info(self) -> CBInfo:
+        return CBInfo(
+            self.coin,
+            self.recipient_ph,
+            self.sender_ph,
+            self.timelock,
+            self.confirmed_block_height,
+            self.spent_block_height,
+            self.spent_block_height > 0,
+            self.timestamp,
+            self.timelock_unit,
+        )
+
+
+async def write_records(
+    batches: AsyncIterator[List[Tuple[int, CBInfo, Optional[str]]]], output: BinaryIO, export_format: str
+) -> Tuple[int, uint32]:
+    """
+    Writes the records as each batch arrives, so only one batch is held in memory. Returns the
+    number of records written and the highest height any of them was confirmed or spent at,
+    which is where the next incremental export can start.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {export_format}")
+    if export_format == BINARY:
+        output.write(BINARY_MAGIC)
+    count = 0
+    last_height = 0
+    async for batch in batches:
+        for fingerprint, record, spent_by in batch:
+            exported = ExportedRecord.from_cb_info(fingerprint, record, spent_by)
+            if export_format == BINARY:
+                data = bytes(exported)
+                output.write(len(data).to_bytes(LENGTH_SIZE, "big") + data)
+            else:
+                output.write(json.dumps(exported.to_json_dict()).encode() + b"\n")
+            last_height = max(last_height, record.confirmed_block_height, record.spent_block_height)
+            count += 1
+        output.flush()
+    return count, uint32(last_height)
+
+
+def read_records(source: BinaryIO) -> Iterator[ExportedRecord]:
+    """Reads records one at a time from an export in either format, telling them apart by the header."""
+    header = source.read(len(BINARY_MAGIC))
+    if header == BINARY_MAGIC:
+        while True:
+            length = source.read(LENGTH_SIZE)
+            if len(length) == 0:
+                return
+            if len(length) < LENGTH_SIZE:
+                raise ValueError("The export ends partway through a record")
+            data = source.read(int.from_bytes(length, "big"))
+            yield ExportedRecord.from_bytes(data)
+    else:
+        # NDJSON has no header, the bytes read belong to the first line
+        for line in itertools.chain([header + source.readline()], source):
+            if line.strip():
+                yield ExportedRecord.from_json_dict(json.loads(line))
+
+
+def batched(records: Iterator[ExportedRecord], size: int = EXPORT_BATCH_SIZE) -> Iterator[List[ExportedRecord]]:
+    batch: List[ExportedRecord] = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def export_records(
+    cb_store: CBStore, output: BinaryIO, export_format: str = NDJSON, since_height: uint32 = uint32(0)
+) -> Tuple[int, uint32]:
+    """Exports the store's coins, or with since_height those confirmed or spent from that height on."""
+    return await write_records(cb_store.get_coin_record_batches(since_height, EXPORT_BATCH_SIZE), output, export_format)
+
+
+async def import_records(cb_store: CBStore, source: BinaryIO) -> Tuple[int, int]:
+    """
+    Imports an export into the store one batch per transaction. Coins the store already holds
+    are updated in place. Returns the number of records read and how many of them were new.
+    """
+    count = 0
+    added = 0
+    for batch in batched(read_records(source)):
+        added += await cb_store.add_coin_records(
+            [(record.fingerprint, record.to_cb_info(), record.spent_by) for record in batch]
+        )
+        count += len(batch)
+    return count, added
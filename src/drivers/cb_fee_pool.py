@@ -0,0 +1,111 @@
+from secrets import token_bytes
+from typing import Dict, List, Optional
+
+from chia.rpc.full_node_rpc_client import FullNodeRpcClient
+from chia.rpc.wallet_rpc_client import WalletRpcClient
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_record import CoinRecord
+from chia.util.bech32m import decode_puzzle_hash
+from chia.util.ints import uint32, uint64
+from chia.wallet.transaction_record import TransactionRecord
+
+from src.drivers.cb_reservations import CoinReservations
+from src.drivers.cb_store import CBStore
+
+
+class FeeCoinPool:
+    """
+    A pool of small coins used to pay fees, so that concurrent claws and claims each spend
+    their own fee coin instead of all racing for the first spendable coin in the wallet.
+    """
+
+    node_client: FullNodeRpcClient
+    wallet_client: WalletRpcClient
+    cb_store: CBStore
+    reservations: CoinReservations
+
+    @classmethod
+    async def create(
+        cls,
+        node_client: FullNodeRpcClient,
+        wallet_client: WalletRpcClient,
+        cb_store: CBStore,
+        reservations: CoinReservations,
+    ):
+        self = cls()
+        self.node_client = node_client
+        self.wallet_client = wallet_client
+        self.cb_store = cb_store
+        self.reservations = reservations
+        return self
+
+    async def split(self, count: int, amount: uint64, fee: uint64 = uint64(0), wallet_id: int = 1) -> TransactionRecord:
+        """
+        Splits wallet funds into count fee coins of the given amount and adds them to the pool.
+        Each coin gets its own address so the outputs of the split have distinct coin IDs.
+        """
+        additions: List[Dict] = []
+        for _ in range(count):
+            address = await self.wallet_client.get_next_address(wallet_id, True)
+            additions.append({"puzzle_hash": decode_puzzle_hash(address), "amount": amount})
+        tx = await self.wallet_client.create_signed_transaction(additions, fee=fee, wallet_id=wallet_id)
+        await self.wallet_client.push_transactions([tx])
+        pool_phs = set(addition["puzzle_hash"] for addition in additions)
+        for coin in tx.additions:
+            if coin.puzzle_hash in pool_phs and coin.amount == amount:
+                await self.cb_store.add_fee_coin_record(CoinRecord(coin, uint32(0), uint32(0), False, uint64(0)))
+        return tx
+
+    async def allocate(self, fee: uint64, wallet_id: int = 1, reserved_for: Optional[bytes32] = None) -> Coin:
+        """
+        Reserves a coin worth at least fee for the spend identified by reserved_for. Pool coins
+        are used first, falling back to any unreserved spendable coin in the wallet.
+        """
+        if reserved_for is None:
+            reserved_for = bytes32(token_bytes(32))
+        coin = await self.cb_store.reserve_fee_coin(
+            fee, reserved_for, self.reservations.now(), self.reservations.expiry()
+        )
+        if coin is not None:
+            return coin
+
+        reserved = await self.reservations.get_reserved_coins()
+        spendable_coins = await self.wallet_client.get_spendable_coins(
+            wallet_id, min_coin_amount=fee, excluded_coin_ids=[coin.name().hex() for coin in reserved]
+        )
+        for record in spendable_coins[0]:
+            if await self.reservations.reserve([record.coin], reserved_for):
+                return record.coin
+        raise ValueError(f"No unreserved coin available to pay a fee of {fee}")
+
+    async def release(self, reserved_for: bytes32) -> None:
+        await self.reservations.release(reserved_for)
+
+    async def refresh(self) -> None:
+        """
+        Syncs the pool with the chain. Spent fee coins leave the pool and release their
+        reservations, and the change they paid back to themselves joins it.
+        """
+        pool_records = await self.cb_store.get_fee_coin_records()
+        if len(pool_records) == 0:
+            return
+        names = [record.name for record in pool_records]
+        coin_records = await self.node_client.get_coin_records_by_names(names, include_spent_coins=True)
+        spent: Dict[bytes32, Coin] = {
+            coin_record.name: coin_record.coin for coin_record in coin_records if coin_record.spent
+        }
+        children: List[CoinRecord] = []
+        if len(spent) > 0:
+            children = await self.node_client.get_coin_records_by_parent_ids(
+                list(spent.keys()), include_spent_coins=False
+            )
+        async with self.cb_store.db_wrapper.writer():
+            for coin_record in coin_records:
+                if not coin_record.spent:
+                    await self.cb_store.add_fee_coin_record(coin_record)
+            for child in children:
+                if child.coin.puzzle_hash == spent[child.coin.parent_coin_info].puzzle_hash:
+                    await self.cb_store.add_fee_coin_record(child)
+            await self.cb_store.delete_fee_coins(list(spent.keys()))
+            await self.cb_store.release_coins(list(spent.keys()))
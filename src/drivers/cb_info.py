@@ -1,12 +1,87 @@
+import struct
+import sys
+from array import array
 from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 from chia.types.blockchain_format.sized_bytes import bytes32
 from chia.types.coin_record import Coin
 from chia.util.ints import uint32, uint64
 
+from src.drivers.cb_puzzles import HEIGHT, SECONDS
+
+# Coin states
+PENDING = "pending"
+LOCKED = "locked"
+CLAIMABLE = "claimable"
+SPENT = "spent"
+
+# Who spent a spent coin, stored with it. The values are those written before they had names here
+CLAWED_BACK = "claw"
+CLAIMED = "claim"
+
+# Blocks arrive every 18.75 seconds on average, 32 per 10 minute sub slot
+SECONDS_PER_BLOCK = 18.75
+
+# A CompactCBInfo packs its coin name, parent, puzzle hash, recipient and sender, followed by
+# its amount, timelock, confirmed and spent heights and timestamp
+COMPACT_HASHES = 5
+COMPACT_NUMBERS = struct.Struct(">QQIIQ")
+
+
+class CBTimelock:
+    """
+    The maturity and state of a clawback coin, shared by CBInfo and CompactCBInfo. Only the
+    timelock, confirmation and spent fields are read, so no hashes are decoded.
+    """
+
+    __slots__ = ()
+
+    timelock: int
+    timelock_unit: str
+    confirmed_block_height: int
+    spent: bool
+    timestamp: int
+
+    def matures_at(self) -> Optional[int]:
+        """
+        The time, or for height based coins the block height, from which the recipient can
+        claim the coin. None if it isn't confirmed yet.
+        """
+        if self.confirmed_block_height == 0:
+            return None
+        if self.timelock_unit == HEIGHT:
+            return int(self.confirmed_block_height + self.timelock)
+        return int(self.timestamp + self.timelock)
+
+    def remaining(self, now: int, peak_height: int) -> Optional[int]:
+        """Seconds, or blocks for height based coins, until the coin can be claimed."""
+        matures_at = self.matures_at()
+        if matures_at is None:
+            return None
+        if self.timelock_unit == HEIGHT:
+            # A claim can go in the block after the peak
+            return max(matures_at - (peak_height + 1), 0)
+        return max(matures_at - now, 0)
+
+    def estimated_maturity(self, now: int, peak_height: int) -> Optional[int]:
+        """The time the coin can be claimed, estimated from the block rate for height based coins."""
+        remaining = self.remaining(now, peak_height)
+        if remaining is None or self.timelock_unit == SECONDS:
+            return self.matures_at()
+        return int(now + remaining * SECONDS_PER_BLOCK)
+
+    def state(self, now: int, peak_height: int) -> str:
+        if self.spent:
+            return SPENT
+        remaining = self.remaining(now, peak_height)
+        if remaining is None:
+            return PENDING
+        return CLAIMABLE if remaining == 0 else LOCKED
+
 
 @dataclass(frozen=True)
-class CBInfo:
+class CBInfo(CBTimelock):
     coin: Coin
     recipient_ph: bytes32
     sender_ph: bytes32
@@ -15,6 +90,205 @@ class CBInfo:
     spent_block_height: uint32
     spent: bool
     timestamp: uint64
+    timelock_unit: str = SECONDS
 
     def name(self) -> bytes32:
         return self.coin.name()
+
+    def to_json_dict(self, now: int, peak_height: int) -> Dict[str, Any]:
+        matures_at = self.matures_at()
+        remaining = self.remaining(now, peak_height)
+        return {
+            "coin_id": self.name().hex(),
+            "parent_coin_info": self.coin.parent_coin_info.hex(),
+            "puzzle_hash": self.coin.puzzle_hash.hex(),
+            "amount": self.coin.amount,
+            "recipient_ph": self.recipient_ph.hex(),
+            "sender_ph": self.sender_ph.hex(),
+            "timelock": self.timelock,
+            "timelock_unit": self.timelock_unit,
+            "confirmed_height": self.confirmed_block_height,
+            "spent_height": self.spent_block_height,
+            "timestamp": self.timestamp,
+            "matures_at": matures_at,
+            "time_left": remaining if self.timelock_unit == SECONDS else None,
+            "blocks_left": remaining if self.timelock_unit == HEIGHT else None,
+            "state": self.state(now, peak_height),
+        }
+
+
+class CompactCBInfo(CBTimelock):
+    """
+    A read only clawback coin packed into a single bytes object: the coin name, parent, puzzle
+    hash, recipient and sender as raw 32 byte hashes followed by the amount, timelock, heights
+    and timestamp. The hashes, the coin and the numbers are only decoded when they're read, so
+    large working sets that mostly look at amounts and maturities hold one allocation per coin
+    instead of a Coin, its hashes and boxed ints. to_cb_info gives the full record for anything
+    that updates it.
+    """
+
+    __slots__ = ("packed", "spent", "timelock_unit")
+
+    packed: bytes
+
+    @classmethod
+    def from_hex(
+        cls,
+        coin_name: str,
+        parent_coin_info_hex: str,
+        puzzle_hash_hex: str,
+        amount: int,
+        recipient_ph_hex: str,
+        sender_ph_hex: str,
+        timelock: int,
+        confirmed_block_height: int,
+        spent_block_height: int,
+        spent: bool,
+        timestamp: int,
+        timelock_unit: str = SECONDS,
+    ) -> "CompactCBInfo":
+        """Packs the hex encoded hashes and the numbers of a cb_record row."""
+        hashes = bytes.fromhex(coin_name + parent_coin_info_hex + puzzle_hash_hex + recipient_ph_hex + sender_ph_hex)
+        numbers = COMPACT_NUMBERS.pack(amount, timelock, confirmed_block_height, spent_block_height, timestamp)
+        return cls(hashes + numbers, spent, timelock_unit)
+
+    def __init__(self, packed: bytes, spent: bool, timelock_unit: str = SECONDS) -> None:
+        self.packed = packed
+        self.spent = bool(spent)
+        # Every record shares the one string per unit rather than holding its own copy
+        self.timelock_unit = sys.intern(timelock_unit)
+
+    def hash_at(self, index: int) -> bytes32:
+        return bytes32(self.packed[index * 32 : (index + 1) * 32])
+
+    def numbers(self) -> Tuple[int, int, int, int, int]:
+        return COMPACT_NUMBERS.unpack_from(self.packed, COMPACT_HASHES * 32)
+
+    def name(self) -> bytes32:
+        # The stored name saves hashing the coin
+        return self.hash_at(0)
+
+    @property
+    def amount(self) -> int:
+        return self.numbers()[0]
+
+    @property
+    def timelock(self) -> int:  # type: ignore[override]
+        return self.numbers()[1]
+
+    @property
+    def confirmed_block_height(self) -> int:  # type: ignore[override]
+        return self.numbers()[2]
+
+    @property
+    def spent_block_height(self) -> int:
+        return self.numbers()[3]
+
+    @property
+    def timestamp(self) -> int:  # type: ignore[override]
+        return self.numbers()[4]
+
+    @property
+    def coin(self) -> Coin:
+        return Coin(self.hash_at(1), self.hash_at(2), uint64(self.amount))
+
+    @property
+    def recipient_ph(self) -> bytes32:
+        return self.hash_at(3)
+
+    @property
+    def sender_ph(self) -> bytes32:
+        return self.hash_at(4)
+
+    def to_cb_info(self) -> CBInfo:
+        amount, timelock, confirmed_block_height, spent_block_height, timestamp = self.numbers()
+        return CBInfo(
+            Coin(self.hash_at(1), self.hash_at(2), uint64(amount)),
+            self.recipient_ph,
+            self.sender_ph,
+            uint64(timelock),
+            uint32(confirmed_block_height),
+            uint32(spent_block_height),
+            self.spent,
+            uint64(timestamp),
+            self.timelock_unit,
+        )
+
+    def to_json_dict(self, now: int, peak_height: int) -> Dict[str, Any]:
+        return self.to_cb_info().to_json_dict(now, peak_height)
+
+
+@dataclass
+class CBColumns:
+    """
+    Clawback coins as parallel arrays, for aggregate and scheduling code that looks at every coin
+    but only at its amount and timelock. Names are kept as hex to map a position back to its coin.
+    """
+
+    names: List[str]
+    amounts: array
+    confirmed_heights: array
+    timestamps: array
+    timelocks: array
+    # 1 for height locked coins, 0 for seconds based ones
+    height_locked: array
+
+    @classmethod
+    def create(cls) -> "CBColumns":
+        return cls([], array("Q"), array("I"), array("Q"), array("Q"), array("B"))
+
+    @classmethod
+    def from_records(cls, records: Iterable[CBTimelock]) -> "CBColumns":
+        columns = cls.create()
+        for record in records:
+            name = record.name().hex()
+            amount = record.amount if isinstance(record, CompactCBInfo) else record.coin.amount
+            columns.append(
+                name, amount, record.confirmed_block_height, record.timestamp, record.timelock, record.timelock_unit
+            )
+        return columns
+
+    def append(
+        self, name: str, amount: int, confirmed_height: int, timestamp: int, timelock: int, timelock_unit: str
+    ) -> None:
+        self.names.append(name)
+        self.amounts.append(amount)
+        self.confirmed_heights.append(confirmed_height)
+        self.timestamps.append(timestamp)
+        self.timelocks.append(timelock)
+        self.height_locked.append(timelock_unit == HEIGHT)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def matures_at(self) -> array:
+        """Each coin's maturity as in CBTimelock.matures_at, with -1 for coins that aren't confirmed yet."""
+        return array(
+            "q",
+            (
+                -1 if height == 0 else (height if by_height else timestamp) + timelock
+                for height, timestamp, timelock, by_height in zip(
+                    self.confirmed_heights, self.timestamps, self.timelocks, self.height_locked
+                )
+            ),
+        )
+
+    def remaining(self, now: int, peak_height: int) -> array:
+        """Seconds, or blocks for height locked coins, until each coin can be claimed, -1 if it isn't confirmed."""
+        return array(
+            "q",
+            (
+                -1 if matures_at < 0 else max(matures_at - (peak_height + 1 if by_height else now), 0)
+                for matures_at, by_height in zip(self.matures_at(), self.height_locked)
+            ),
+        )
+
+    def claimable(self, now: int, peak_height: int) -> Tuple[int, int]:
+        """The number of coins that can be claimed now and the mojos in them."""
+        coins = 0
+        amount = 0
+        for left, coin_amount in zip(self.remaining(now, peak_height), self.amounts):
+            if left == 0:
+                coins += 1
+                amount += coin_amount
+        return coins, amount
@@ -1,8 +1,15 @@
-from typing import Dict, List, Optional, Tuple
+import asyncio
+import dataclasses
+import logging
+import time
+from dataclasses import dataclass
+from secrets import token_bytes
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 
 from blspy import AugSchemeMPL, G1Element, G2Element, PrivateKey
 from chia.consensus.block_record import BlockRecord
 from chia.consensus.default_constants import DEFAULT_CONSTANTS
+from chia.full_node.mempool_manager import MEMPOOL_MIN_FEE_INCREASE
 from chia.rpc.full_node_rpc_client import FullNodeRpcClient
 from chia.rpc.wallet_rpc_client import WalletRpcClient
 from chia.types.announcement import Announcement
@@ -16,8 +23,6 @@ from chia.types.spend_bundle import SpendBundle
 from chia.util.bech32m import encode_puzzle_hash
 from chia.util.byte_types import hexstr_to_bytes
 from chia.util.condition_tools import conditions_dict_for_solution, pkm_pairs_for_conditions_dict
-from chia.util.config import load_config
-from chia.util.default_root import DEFAULT_ROOT_PATH
 from chia.util.hash import std_hash
 from chia.util.ints import uint32, uint64
 from chia.wallet.derive_keys import master_sk_to_wallet_sk, master_sk_to_wallet_sk_unhardened
@@ -28,11 +33,47 @@ from chia.wallet.puzzles.p2_delegated_puzzle_or_hidden_puzzle import (
     puzzle_for_pk,
     solution_for_conditions,
 )
-from clvm.casts import int_from_bytes, int_to_bytes
-
-from src.drivers.cb_info import CBInfo
-from src.drivers.cb_puzzles import P2_1_OF_N, create_clawback_puzzle, create_clawback_solution
+from clvm.casts import int_to_bytes
+
+from src.drivers.cb_costs import (
+    CLAIM,
+    CLAIM_WITH_FEE,
+    CLAW,
+    CLAW_WITH_FEE,
+    FeePlanner,
+    compute_spend_cost,
+    min_replacement_fee,
+    standard_spend_costs,
+)
+from src.drivers.cb_fee_pool import FeeCoinPool
+from src.drivers.cb_info import CLAIMED, CLAWED_BACK, SECONDS_PER_BLOCK, CBInfo
+from src.drivers.cb_node_cache import CachingNodeClient
+from src.drivers.cb_pending_spend import PendingSpend
+from src.drivers.cb_puzzles import (
+    CB_FEE_ANNOUNCEMENT,
+    HEIGHT,
+    P2_1_OF_N,
+    SECONDS,
+    create_clawback_puzzle,
+    create_clawback_solution,
+    spent_by_sender,
+)
+from src.drivers.cb_reservations import DEFAULT_RESERVATION_TTL, CoinReservations
+from src.drivers.cb_resolver import CBDetailsResolver, cb_details_from_parent_spend
+from src.drivers.cb_signing import (
+    SigningRequest,
+    SigningResponse,
+    UnsignedSpend,
+    create_unsigned_spend,
+    find_unhardened_key,
+    get_additional_data,
+    merge_signatures,
+)
 from src.drivers.cb_store import CBStore
+from src.drivers.cb_tracker import REBROADCAST_INTERVAL, PendingSpendTracker
+from src.drivers.cb_validator import BundleValidator
+
+log = logging.getLogger(__name__)
 
 # Common Timelock Periods
 ONE_HOUR = 60 * 60
@@ -40,61 +81,187 @@ ONE_DAY = ONE_HOUR * 24
 ONE_WEEK = ONE_DAY * 7
 TWO_WEEKS = ONE_WEEK * 2
 
+# Times to retry coin selection when another process reserves the selected coins first
+MAX_SELECTION_ATTEMPTS = 3
+
+# Coins looked up per coin record request, and requests to the node in flight at once
+COIN_RECORD_BATCH_SIZE = 500
+MAX_CONCURRENT_LOOKUPS = 8
+
+# Pending claws are fee bumped once their deadline is this close
+BUMP_MARGIN = ONE_HOUR
+# Times a replacement is repriced, each added fee coin raises its cost and the fee it needs
+MAX_BUMP_ATTEMPTS = 3
+
+# The spend shape to price a bumped fee for, by tracked operation
+FEE_SHAPES = {CLAW: CLAW_WITH_FEE, CLAIM: CLAIM_WITH_FEE}
+
+
+@dataclass(frozen=True)
+class CBPayment:
+    amount: uint64
+    recipient_ph: bytes32
+    sender_ph: bytes32
+    timelock: uint64
+    timelock_unit: str = SECONDS
+    hint_sender: bool = False
+
+
+def merged_output_conditions(coins: List[Coin], to_puzzle_hash: bytes32) -> List[List[List[Any]]]:
+    """
+    The inner conditions for spending clawback coins together into one coin holding their total.
+    The first coin creates the output and the fee announcement, and the others assert its
+    announcement of the whole set, so none of them can be spent without the rest.
+    """
+    if len(coins) == 1:
+        return [
+            [
+                [ConditionOpcode.CREATE_COIN, to_puzzle_hash, coins[0].amount],
+                [ConditionOpcode.CREATE_COIN_ANNOUNCEMENT, CB_FEE_ANNOUNCEMENT],
+            ]
+        ]
+    message = std_hash(b"".join(coin.name() for coin in coins))
+    announcement = Announcement(coins[0].name(), message)
+    conditions = [
+        [
+            [ConditionOpcode.CREATE_COIN, to_puzzle_hash, sum(coin.amount for coin in coins)],
+            [ConditionOpcode.CREATE_COIN_ANNOUNCEMENT, CB_FEE_ANNOUNCEMENT],
+            [ConditionOpcode.CREATE_COIN_ANNOUNCEMENT, message],
+        ]
+    ]
+    for _ in coins[1:]:
+        conditions.append([[ConditionOpcode.ASSERT_COIN_ANNOUNCEMENT, announcement.name()]])
+    return conditions
+
 
 class CBManager:
-    node_client: FullNodeRpcClient
+    node_client: CachingNodeClient
     wallet_client: WalletRpcClient
     cb_store: CBStore
+    fee_planner: FeePlanner
+    fee_pool: FeeCoinPool
+    reservations: CoinReservations
+    tracker: PendingSpendTracker
+    validator: BundleValidator
+    resolver: CBDetailsResolver
+    base_spends: Dict[bytes32, Tuple[SpendBundle, uint64]]
+    # The wallets whose keys sign spends, or just the logged in wallet when None
+    fingerprints: Optional[List[int]]
+    private_keys: Dict[int, PrivateKey]
+    # Keys found so far by puzzle hash, and how far each wallet's keys have been derived
+    key_cache: Dict[bytes32, Tuple[PrivateKey, int, bool]]
+    derived_indexes: Dict[int, int]
+    # The puzzle hashes derived so far for each wallet
+    puzzle_hashes: Dict[int, List[bytes32]]
 
     @classmethod
-    async def create(cls, node_client: FullNodeRpcClient, wallet_client: WalletRpcClient, cb_store: CBStore):
+    async def create(
+        cls,
+        node_client: FullNodeRpcClient,
+        wallet_client: WalletRpcClient,
+        cb_store: CBStore,
+        reservation_ttl: int = DEFAULT_RESERVATION_TTL,
+        fingerprints: Optional[List[int]] = None,
+    ):
         self = CBManager()
-        self.node_client = node_client
+        # Only the manager's own lookups are cached, the trackers always need fresh coin states
+        self.node_client = await CachingNodeClient.from_client(node_client)
         self.wallet_client = wallet_client
         self.cb_store = cb_store
+        self.fee_planner = await FeePlanner.create(node_client)
+        self.reservations = await CoinReservations.create(node_client, cb_store, reservation_ttl)
+        self.fee_pool = await FeeCoinPool.create(node_client, wallet_client, cb_store, self.reservations)
+        self.tracker = await PendingSpendTracker.create(node_client, cb_store, self.reservations)
+        self.validator = await BundleValidator.create(node_client)
+        self.resolver = await CBDetailsResolver.create(self.node_client, COIN_RECORD_BATCH_SIZE, MAX_CONCURRENT_LOOKUPS)
+        self.base_spends = {}
+        self.fingerprints = fingerprints
+        self.private_keys = {}
+        self.key_cache = {}
+        self.derived_indexes = {}
+        self.puzzle_hashes = {}
         return self
 
     async def get_derivation_index(self) -> uint32:
         index = await self.wallet_client.get_current_derivation_index()
         return uint32(index)
 
-    async def get_private_key(self) -> PrivateKey:
-        fp = await self.wallet_client.get_logged_in_fingerprint()
-        sk_dict = await self.wallet_client.get_private_key(fp)
-        private_key = PrivateKey.from_bytes(hexstr_to_bytes(sk_dict["sk"]))
-        return private_key
+    async def get_fingerprints(self) -> List[int]:
+        if self.fingerprints is not None:
+            return self.fingerprints
+        return [await self.wallet_client.get_logged_in_fingerprint()]
+
+    async def get_private_key(self, fingerprint: Optional[int] = None) -> PrivateKey:
+        if fingerprint is None:
+            fingerprint = await self.wallet_client.get_logged_in_fingerprint()
+        if fingerprint not in self.private_keys:
+            sk_dict = await self.wallet_client.get_private_key(fingerprint)
+            self.private_keys[fingerprint] = PrivateKey.from_bytes(hexstr_to_bytes(sk_dict["sk"]))
+        return self.private_keys[fingerprint]
+
+    async def derive_keys(self, fingerprint: int, max_index: int) -> None:
+        """Derives the wallet's hardened and unhardened keys up to max_index, skipping those derived before."""
+        private_key = await self.get_private_key(fingerprint)
+        puzzle_hashes = self.puzzle_hashes.setdefault(fingerprint, [])
+        for i in range(self.derived_indexes.get(fingerprint, 0), max_index):
+            sk = master_sk_to_wallet_sk(private_key, uint32(i))
+            sk_u = master_sk_to_wallet_sk_unhardened(private_key, uint32(i))
+            for key, hardened in ((sk, True), (sk_u, False)):
+                puzzle_hash = puzzle_for_pk(key.get_g1()).get_tree_hash()
+                self.key_cache[puzzle_hash] = (key, i, hardened)
+                puzzle_hashes.append(puzzle_hash)
+            self.derived_indexes[fingerprint] = i + 1
 
     async def get_keys_for_puzzle_hash(
         self, puzzle_hash: bytes32, max_index: Optional[uint32] = None
     ) -> Tuple[PrivateKey, int, bool]:
-        private_key = await self.get_private_key()
+        """
+        Finds the wallet key for puzzle_hash in any of the manager's wallets. Keys are derived
+        once per wallet and remembered, so later lookups only derive the indexes not seen yet.
+        """
+        if puzzle_hash in self.key_cache:
+            return self.key_cache[puzzle_hash]
         if not max_index:
             max_index = await self.get_derivation_index()
-        for i in range(max_index):
-            sk = master_sk_to_wallet_sk(private_key, uint32(i))
-            ph = puzzle_for_pk(sk.get_g1()).get_tree_hash()
-            if puzzle_hash == ph:
-                return sk, i, True
-            sk_u = master_sk_to_wallet_sk_unhardened(private_key, uint32(i))
-            ph_u = puzzle_for_pk(sk_u.get_g1()).get_tree_hash()
-            if puzzle_hash == ph_u:
-                return sk_u, i, False
+        for fingerprint in await self.get_fingerprints():
+            await self.derive_keys(fingerprint, max_index)
+            if puzzle_hash in self.key_cache:
+                return self.key_cache[puzzle_hash]
         raise ValueError(f"Couldn't find a matching key for puzzle hash: {puzzle_hash}.")
 
+    async def get_puzzle_hashes(self, max_index: Optional[uint32] = None) -> Dict[int, List[bytes32]]:
+        """Returns the puzzle hashes of each of the manager's wallets up to the current derivation index."""
+        if not max_index:
+            max_index = await self.get_derivation_index()
+        for fingerprint in await self.get_fingerprints():
+            await self.derive_keys(fingerprint, max_index)
+        return {fingerprint: self.puzzle_hashes[fingerprint] for fingerprint in await self.get_fingerprints()}
+
     async def get_puzzle_for_puzzle_hash(self, puzzle_hash: bytes32) -> Program:
         private_key, _, _ = await self.get_keys_for_puzzle_hash(puzzle_hash)
         return puzzle_for_pk(private_key.get_g1())
 
-    def get_cb_puzzle(self, timelock: uint64, recipient_ph: bytes32, sender_ph: bytes32) -> Program:
-        cb_puzzle = create_clawback_puzzle(timelock, sender_ph, recipient_ph)
+    def get_cb_puzzle(
+        self, timelock: uint64, recipient_ph: bytes32, sender_ph: bytes32, timelock_unit: str = SECONDS
+    ) -> Program:
+        cb_puzzle = create_clawback_puzzle(timelock, sender_ph, recipient_ph, timelock_unit)
         return cb_puzzle
 
-    def get_cb_puzzle_hash(self, timelock: uint64, recipient_ph: bytes32, sender_ph: bytes32) -> bytes32:
-        cb_puzzle = self.get_cb_puzzle(timelock, recipient_ph, sender_ph)
+    def get_cb_puzzle_hash(
+        self, timelock: uint64, recipient_ph: bytes32, sender_ph: bytes32, timelock_unit: str = SECONDS
+    ) -> bytes32:
+        cb_puzzle = self.get_cb_puzzle(timelock, recipient_ph, sender_ph, timelock_unit)
         return cb_puzzle.get_tree_hash()
 
-    def get_cb_address(self, timelock: uint64, recipient_ph: bytes32, sender_ph: bytes32, prefix: str = "xch") -> str:
-        puzzle_hash = self.get_cb_puzzle_hash(timelock, recipient_ph, sender_ph)
+    def get_cb_address(
+        self,
+        timelock: uint64,
+        recipient_ph: bytes32,
+        sender_ph: bytes32,
+        prefix: str = "xch",
+        timelock_unit: str = SECONDS,
+    ) -> str:
+        puzzle_hash = self.get_cb_puzzle_hash(timelock, recipient_ph, sender_ph, timelock_unit)
         return encode_puzzle_hash(puzzle_hash, prefix)
 
     async def create_cb_coin(
@@ -105,10 +272,50 @@ class CBManager:
         timelock: uint64,
         fee: uint64 = uint64(0),
         wallet_id: int = 1,
+        timelock_unit: str = SECONDS,
+        hint_sender: bool = False,
     ) -> SpendBundle:
-        total_amount = amount + fee
-        coins = await self.wallet_client.select_coins(total_amount, wallet_id)
+        """
+        Builds a spend creating a clawback coin for the recipient. The coin is hinted to the
+        recipient, so they can find it with a hint lookup, and with hint_sender the sender's
+        puzzle hash is added as a second memo.
+        """
+        payment = CBPayment(amount, recipient_ph, sender_ph, timelock, timelock_unit, hint_sender)
+        return await self.create_cb_coins([payment], fee, wallet_id)
+
+    async def create_cb_coins(
+        self, payments: List[CBPayment], fee: uint64 = uint64(0), wallet_id: int = 1
+    ) -> SpendBundle:
+        """
+        Builds one spend creating a clawback coin for each payment, from a single coin selection
+        and signature set. Each coin gets its own REMARK, which is told apart by the coin's
+        puzzle hash when the coin is read back.
+        """
+        cb_puzzle_hashes = [
+            self.get_cb_puzzle_hash(payment.timelock, payment.recipient_ph, payment.sender_ph, payment.timelock_unit)
+            for payment in payments
+        ]
+        outputs = list(zip(cb_puzzle_hashes, [payment.amount for payment in payments]))
+        if len(set(outputs)) < len(outputs):
+            raise ValueError("Payments with the same terms and amount would create the same coin")
+        total_amount = sum(payment.amount for payment in payments) + fee
+        reserved_for = bytes32(token_bytes(32))
+        coins = await self.select_unreserved_coins(uint64(total_amount), wallet_id, reserved_for)
         assert len(coins) > 0
+        try:
+            spend = await self.sign_cb_coins_spend(payments, cb_puzzle_hashes, coins, fee)
+        except Exception:
+            # The coins were reserved for a spend that won't exist
+            await self.reservations.release(reserved_for)
+            raise
+        await self.reservations.reassign(reserved_for, spend.name())
+        return spend
+
+    async def sign_cb_coins_spend(
+        self, payments: List[CBPayment], cb_puzzle_hashes: List[bytes32], coins: List[Coin], fee: uint64
+    ) -> SpendBundle:
+        """Signs the spend of the selected coins creating each payment's cb coin, with the rest as change."""
+        total_amount = sum(payment.amount for payment in payments) + fee
         spend_value = sum([coin.amount for coin in coins])
         change = spend_value - total_amount
         assert change >= 0
@@ -118,9 +325,8 @@ class CBManager:
         origin_coin = coins.copy().pop()
         origin_id = origin_coin.name()
 
-        cb_puzzle_hash = self.get_cb_puzzle_hash(timelock, recipient_ph, sender_ph)
-        cb_coin = Coin(origin_id, cb_puzzle_hash, amount)
-        message_list.append(cb_coin.name())
+        for cb_puzzle_hash, payment in zip(cb_puzzle_hashes, payments):
+            message_list.append(Coin(origin_id, cb_puzzle_hash, payment.amount).name())
         message = std_hash(b"".join(message_list))
         announcement_hash = Announcement(origin_coin.name(), message).name()
 
@@ -128,13 +334,20 @@ class CBManager:
         pk = secret_key.get_g1()
         puzzle = puzzle_for_pk(pk)
         assert puzzle.get_tree_hash() == origin_coin.puzzle_hash
-        remark = sender_ph + recipient_ph + int_to_bytes(timelock)
-        conditions = [
-            [ConditionOpcode.CREATE_COIN, cb_puzzle_hash, amount],
-            [ConditionOpcode.RESERVE_FEE, fee],
-            [ConditionOpcode.REMARK, remark],
-            [ConditionOpcode.CREATE_COIN_ANNOUNCEMENT, message],
-        ]
+        conditions: List[List[Any]] = []
+        for cb_puzzle_hash, payment in zip(cb_puzzle_hashes, payments):
+            # The node only indexes the first memo as the coin's hint
+            memos = [payment.recipient_ph, payment.sender_ph] if payment.hint_sender else [payment.recipient_ph]
+            conditions.append([ConditionOpcode.CREATE_COIN, cb_puzzle_hash, payment.amount, memos])
+        conditions.append([ConditionOpcode.RESERVE_FEE, fee])
+        for payment in payments:
+            remark = payment.sender_ph + payment.recipient_ph + int_to_bytes(payment.timelock)
+            # Seconds based coins keep the original single argument REMARK
+            remark_condition = [ConditionOpcode.REMARK, remark]
+            if payment.timelock_unit != SECONDS:
+                remark_condition.append(payment.timelock_unit.encode())
+            conditions.append(remark_condition)
+        conditions.append([ConditionOpcode.CREATE_COIN_ANNOUNCEMENT, message])
         if change > 0:
             conditions.append([ConditionOpcode.CREATE_COIN, origin_coin.puzzle_hash, change])
 
@@ -154,10 +367,35 @@ class CBManager:
             coin_spend = CoinSpend(coin, puzzle, solution)
             spends.append(coin_spend)
 
-        spend = await self.sign_coin_spends(spends)
-        return spend
-
-    async def add_new_coin(self, coin: Coin, recipient_ph: bytes32, sender_ph: bytes32, timelock: uint64) -> None:
+        return await self.sign_coin_spends(spends)
+
+    async def select_unreserved_coins(self, amount: uint64, wallet_id: int, reserved_for: bytes32) -> List[Coin]:
+        """
+        Selects coins for amount that no other pending spend has reserved, and reserves them.
+        Fee pool coins are left alone for fee spends.
+        """
+        pool_coins = [record.coin for record in await self.cb_store.get_fee_coin_records()]
+        for _ in range(MAX_SELECTION_ATTEMPTS):
+            excluded_coins = await self.reservations.get_reserved_coins() + pool_coins
+            coins = await self.wallet_client.select_coins(amount, wallet_id, excluded_coins=excluded_coins)
+            if await self.reservations.reserve(coins, reserved_for):
+                return coins
+        raise ValueError("Couldn't select coins that aren't reserved by another pending spend")
+
+    async def reconcile_reservations(self) -> None:
+        """Releases the coins locked by pending spends that the chain shows have been settled."""
+        await self.fee_pool.refresh()
+        await self.reservations.reconcile()
+
+    async def add_new_coin(
+        self,
+        coin: Coin,
+        recipient_ph: bytes32,
+        sender_ph: bytes32,
+        timelock: uint64,
+        timelock_unit: str = SECONDS,
+        fingerprint: Optional[int] = None,
+    ) -> None:
         cb_record = CBInfo(
             coin,
             recipient_ph,
@@ -167,19 +405,103 @@ class CBManager:
             uint32(0),
             False,
             uint64(0),
+            timelock_unit,
         )
-        await self.cb_store.add_coin_record(cb_record)
+        cb_store = self.cb_store if fingerprint is None else self.cb_store.scoped(fingerprint)
+        await cb_store.add_coin_record(cb_record)
 
     async def update_coin_record(self, coin_id: bytes32) -> None:
         cb_info = await self.get_cb_info_by_id(coin_id)
         if cb_info:
             assert isinstance(cb_info, CBInfo)
-            await self.cb_store.add_coin_record(cb_info)
+            await self.cb_store.update_coin_states([cb_info])
+            if cb_info.spent:
+                await self.cb_store.set_spend_outcomes({coin_id: await self.get_spend_outcome(cb_info)})
 
     async def update_records(self) -> None:
+        """Refreshes the chain state of every unspent coin in the store, across all the wallets it holds."""
         records = await self.cb_store.get_all_unspent_coins()
-        for record in records:
-            await self.update_coin_record(record.coin.name())
+        async for _ in self.refresh_records(list(records)):
+            pass
+
+    async def refresh_records(self, records: List[CBInfo]) -> AsyncIterator[List[CBInfo]]:
+        """
+        Looks up the chain state of the records in batches, with a bounded number of lookups in
+        flight, and yields each batch once it's stored. Blocks are only fetched for seconds
+        based coins confirmed since the last refresh, once per height.
+        """
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_LOOKUPS)
+        timestamps: Dict[uint32, "asyncio.Future[uint64]"] = {}
+
+        async def get_timestamp(height: uint32) -> uint64:
+            async with semaphore:
+                block = await self.node_client.get_block_record_by_height(height)
+            assert isinstance(block, BlockRecord)
+            assert isinstance(block.timestamp, uint64)
+            return block.timestamp
+
+        async def get_outcome(record: CBInfo) -> str:
+            async with semaphore:
+                return await self.get_spend_outcome(record)
+
+        async def refresh_batch(batch: List[CBInfo]) -> List[CBInfo]:
+            async with semaphore:
+                coin_records = await self.node_client.get_coin_records_by_names(
+                    [record.name() for record in batch], include_spent_coins=True
+                )
+            by_name = {coin_record.name: coin_record for coin_record in coin_records}
+            for record in batch:
+                coin_record = by_name.get(record.name())
+                # Height based coins mature at a height, only seconds based ones need the block's timestamp
+                if coin_record is None or record.timestamp != 0 or record.timelock_unit != SECONDS:
+                    continue
+                height = coin_record.confirmed_block_index
+                if height > 0 and height not in timestamps:
+                    timestamps[height] = asyncio.ensure_future(get_timestamp(height))
+            updated: List[CBInfo] = []
+            for record in batch:
+                coin_record = by_name.get(record.name())
+                if coin_record is None:
+                    updated.append(record)
+                    continue
+                timestamp = record.timestamp
+                if timestamp == 0 and record.timelock_unit == SECONDS and coin_record.confirmed_block_index > 0:
+                    timestamp = await timestamps[coin_record.confirmed_block_index]
+                updated.append(
+                    dataclasses.replace(
+                        record,
+                        confirmed_block_height=coin_record.confirmed_block_index,
+                        spent_block_height=coin_record.spent_block_index,
+                        spent=coin_record.spent,
+                        timestamp=timestamp,
+                    )
+                )
+            await self.cb_store.update_coin_states(updated)
+            # Coins spent since the last refresh are looked up once to tell claws from claims
+            newly_spent = [new for old, new in zip(batch, updated) if new.spent and not old.spent]
+            if len(newly_spent) > 0:
+                outcomes = await asyncio.gather(*(get_outcome(record) for record in newly_spent))
+                await self.cb_store.set_spend_outcomes(dict(zip([record.name() for record in newly_spent], outcomes)))
+            return updated
+
+        tasks = [
+            asyncio.ensure_future(refresh_batch(records[i : i + COIN_RECORD_BATCH_SIZE]))
+            for i in range(0, len(records), COIN_RECORD_BATCH_SIZE)
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for future in tasks + list(timestamps.values()):
+                future.cancel()
+
+    async def get_spend_outcome(self, cb_info: CBInfo) -> str:
+        """Returns CLAWED_BACK if the sender spent the coin, or CLAIMED if the recipient did."""
+        coin_spend = await self.node_client.get_puzzle_and_solution(cb_info.name(), cb_info.spent_block_height)
+        assert isinstance(coin_spend, CoinSpend)
+        if spent_by_sender(coin_spend.solution.to_program(), cb_info.sender_ph):
+            return CLAWED_BACK
+        return CLAIMED
 
     async def get_cb_coin_by_id(self, coin_id: bytes32) -> Optional[CoinRecord]:
         coin_record = await self.node_client.get_coin_record_by_name(coin_id)
@@ -191,24 +513,25 @@ class CBManager:
             return None
         else:
             coin = coin_record.coin
-        sender_ph, recipient_ph, timelock = await self.get_cb_details(coin)
-        parent_cr = await self.node_client.get_coin_record_by_name(coin.parent_coin_info)
-        assert isinstance(parent_cr, CoinRecord)
-        block = await self.node_client.get_block_record_by_height(parent_cr.spent_block_index)
-        assert isinstance(block, BlockRecord)
-        assert isinstance(block.timestamp, uint64)
-        timestamp: uint64 = block.timestamp
-        cr = await self.node_client.get_coin_record_by_name(coin.name())
-        assert isinstance(cr, CoinRecord)
+        sender_ph, recipient_ph, timelock, timelock_unit = await self.get_cb_details(coin)
+        # Height based coins mature at a height, so they don't need the block's timestamp
+        timestamp = uint64(0)
+        if timelock_unit == SECONDS:
+            # The parent is spent in the block that confirmed the coin
+            block = await self.node_client.get_block_record_by_height(coin_record.confirmed_block_index)
+            assert isinstance(block, BlockRecord)
+            assert isinstance(block.timestamp, uint64)
+            timestamp = block.timestamp
         cb_info = CBInfo(
             coin,
             recipient_ph,
             sender_ph,
             timelock,
-            cr.confirmed_block_index,
-            cr.spent_block_index,
-            cr.spent,
+            coin_record.confirmed_block_index,
+            coin_record.spent_block_index,
+            coin_record.spent,
             timestamp,
+            timelock_unit,
         )
         return cb_info
 
@@ -219,30 +542,51 @@ class CBManager:
     async def create_clawback_spend(
         self, cb_info: CBInfo, to_puzzle_hash: bytes32, fee: uint64 = uint64(0)
     ) -> SpendBundle:
-        puzzle = self.get_cb_puzzle(cb_info.timelock, cb_info.recipient_ph, cb_info.sender_ph)
-        inner_puzzle = await self.get_puzzle_for_puzzle_hash(cb_info.sender_ph)
+        return await self.create_merged_clawback_spend([cb_info], to_puzzle_hash, fee)
+
+    async def create_merged_clawback_spend(
+        self, cb_infos: List[CBInfo], to_puzzle_hash: bytes32, fee: uint64 = uint64(0)
+    ) -> SpendBundle:
+        """Claws back all the coins in one bundle, into a single coin holding their total."""
+        conditions = merged_output_conditions([cb_info.coin for cb_info in cb_infos], to_puzzle_hash)
+        coin_spends: List[CoinSpend] = []
+        for cb_info, coin_conditions in zip(cb_infos, conditions):
+            inner_puzzle = await self.get_puzzle_for_puzzle_hash(cb_info.sender_ph)
+            coin_spends.append(self.build_clawback_coin_spend(cb_info, to_puzzle_hash, inner_puzzle, coin_conditions))
+        spend = await self.sign_coin_spends(coin_spends)
+        # The bundle has to confirm before the first of its coins can be claimed
+        deadline = min([await self.get_clawback_deadline(cb_info) for cb_info in cb_infos])
+        return await self.attach_fee(spend, fee, deadline)
+
+    def build_clawback_coin_spend(
+        self,
+        cb_info: CBInfo,
+        to_puzzle_hash: bytes32,
+        inner_puzzle: Program,
+        conditions: Optional[List[List[Any]]] = None,
+    ) -> CoinSpend:
+        puzzle = self.get_cb_puzzle(cb_info.timelock, cb_info.recipient_ph, cb_info.sender_ph, cb_info.timelock_unit)
         assert inner_puzzle.get_tree_hash() == cb_info.sender_ph
-        conditions = [
-            [ConditionOpcode.CREATE_COIN, to_puzzle_hash, cb_info.coin.amount],
-        ]
-        if fee > uint64(0):
-            fee_spend = await self.create_fee_spend(fee, [])
-            fee_coin = fee_spend.removals()[0]
-            message_list = [fee_spend.removals()[0].name(), fee_spend.additions()[0].name()]
-            message = std_hash(b"".join(message_list))
-            announcement = Announcement(fee_coin.name(), message)
-            conditions.append([ConditionOpcode.ASSERT_COIN_ANNOUNCEMENT, announcement.name()])
+        if conditions is None:
+            conditions = merged_output_conditions([cb_info.coin], to_puzzle_hash)[0]
         inner_solution = solution_for_conditions(conditions)
         solution = create_clawback_solution(
-            cb_info.timelock, cb_info.sender_ph, cb_info.recipient_ph, inner_puzzle, inner_solution
+            cb_info.timelock,
+            cb_info.sender_ph,
+            cb_info.recipient_ph,
+            inner_puzzle,
+            inner_solution,
+            cb_info.timelock_unit,
         )
-        coin_spend = CoinSpend(cb_info.coin, puzzle, solution)
-        spend = await self.sign_coin_spends([coin_spend])
-        if fee > uint64(0):
-            full_spend = SpendBundle.aggregate([spend, fee_spend])
-        else:
-            full_spend = spend
-        return full_spend
+        return CoinSpend(cb_info.coin, puzzle, solution)
+
+    async def get_clawback_deadline(self, cb_info: CBInfo) -> uint64:
+        # The claw has to confirm before the recipient can claim the coin
+        if cb_info.timelock_unit == HEIGHT:
+            peak_height = await self.node_client.get_peak_height()
+            blocks_left = cb_info.timelock if peak_height is None else cb_info.remaining(0, peak_height)
+            return uint64(time.time() + blocks_left * SECONDS_PER_BLOCK)
+        return uint64(cb_info.timestamp + cb_info.timelock)
 
     async def get_cb_details(self, coin: Coin) -> Tuple:
         parent_cr = await self.node_client.get_coin_record_by_name(coin.parent_coin_info)
@@ -251,48 +595,294 @@ class CBManager:
             coin.parent_coin_info, parent_cr.spent_block_index
         )
         assert isinstance(parent_spend, CoinSpend)
-        puzzle = parent_spend.puzzle_reveal.to_program()
-        solution = parent_spend.solution.to_program()
-        conditions = conditions_dict_for_solution(puzzle, solution, DEFAULT_CONSTANTS.MAX_BLOCK_COST_CLVM)
-        assert isinstance(conditions, Dict)
-        if ConditionOpcode.REMARK in conditions.keys():
-            remark = conditions[ConditionOpcode.REMARK][0].vars[0]
-        else:
-            raise ValueError("Coin doess not contain a valid clawback puzzle")
-        sender_ph = bytes32(remark[:32])
-        recipient_ph = bytes32(remark[32:64])
-        timelock = int_from_bytes(remark[64:])
-        return sender_ph, recipient_ph, timelock
+        return cb_details_from_parent_spend(parent_spend, coin)
+
+    async def find_cb_coins_by_hint(
+        self,
+        puzzle_hashes: List[bytes32],
+        include_spent_coins: bool = False,
+        start_height: Optional[uint32] = None,
+        skip_stored: bool = False,
+    ) -> List[CBInfo]:
+        """
+        Finds the clawback coins hinted to any of the puzzle hashes. Hinted coins are only
+        returned once the clawback puzzle rebuilt from their parent's REMARK matches their puzzle
+        hash, other hinted coins like CATs or spoofed REMARKs are dropped. With skip_stored, coins
+        already in the store aren't looked into. The timestamps of the returned coins are left
+        for a refresh to fill.
+        """
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_LOOKUPS)
+
+        async def by_hint(puzzle_hash: bytes32) -> List[CoinRecord]:
+            async with semaphore:
+                return await self.node_client.get_coin_records_by_hint(
+                    puzzle_hash, include_spent_coins=include_spent_coins, start_height=start_height
+                )
+
+        hinted: Dict[bytes32, CoinRecord] = {}
+        for coin_records in await asyncio.gather(*(by_hint(puzzle_hash) for puzzle_hash in puzzle_hashes)):
+            for coin_record in coin_records:
+                hinted[coin_record.name] = coin_record
+        if skip_stored and len(hinted) > 0:
+            stored = await self.cb_store.scoped(None).get_coin_records(list(hinted.keys()))
+            for record in stored:
+                if record is not None:
+                    del hinted[record.name()]
+
+        # Parents are looked up in batches and each block's spends are fetched once for all the parents spent in it
+        details = await self.resolver.resolve([coin_record.coin for coin_record in hinted.values()])
+        found: List[CBInfo] = []
+        for coin_record in hinted.values():
+            if coin_record.name not in details:
+                continue
+            sender_ph, recipient_ph, timelock, timelock_unit = details[coin_record.name]
+            if (
+                self.get_cb_puzzle_hash(timelock, recipient_ph, sender_ph, timelock_unit)
+                != coin_record.coin.puzzle_hash
+            ):
+                continue
+            found.append(
+                CBInfo(
+                    coin_record.coin,
+                    recipient_ph,
+                    sender_ph,
+                    uint64(timelock),
+                    coin_record.confirmed_block_index,
+                    coin_record.spent_block_index,
+                    coin_record.spent,
+                    uint64(0),
+                    timelock_unit,
+                )
+            )
+        return found
+
+    async def discover_cb_coins(
+        self, include_spent_coins: bool = False, start_height: Optional[uint32] = None
+    ) -> List[Tuple[int, CBInfo]]:
+        """
+        Finds the clawback coins hinted to any of the manager's wallets that the store doesn't
+        hold yet, adds them to the store with the wallet they were found for and refreshes them.
+        With start_height only coins created from that height on are looked for.
+        """
+        discovered: List[Tuple[int, CBInfo]] = []
+        for fingerprint, puzzle_hashes in (await self.get_puzzle_hashes()).items():
+            found = await self.find_cb_coins_by_hint(
+                puzzle_hashes, include_spent_coins, start_height=start_height, skip_stored=True
+            )
+            await self.cb_store.add_coin_records([(fingerprint, record, None) for record in found])
+            async for batch in self.refresh_records(found):
+                discovered.extend((fingerprint, record) for record in batch)
+        return discovered
 
     async def create_claim_spend(self, coin: Coin, claim_to: bytes32, fee: uint64 = uint64(0)) -> SpendBundle:
-        sender_ph, recipient_ph, timelock = await self.get_cb_details(coin)
-        puzzle = self.get_cb_puzzle(timelock, recipient_ph, sender_ph)
-        inner_puzzle = await self.get_puzzle_for_puzzle_hash(recipient_ph)
-        conditions = [[ConditionOpcode.CREATE_COIN, claim_to, coin.amount]]
-        if fee > uint64(0):
-            fee_spend = await self.create_fee_spend(fee, [])
-            fee_coin = fee_spend.removals()[0]
-            message_list = [fee_spend.removals()[0].name(), fee_spend.additions()[0].name()]
-            message = std_hash(b"".join(message_list))
-            announcement = Announcement(fee_coin.name(), message)
-            conditions.append([ConditionOpcode.ASSERT_COIN_ANNOUNCEMENT, announcement.name()])
+        return await self.create_merged_claim_spend([coin], claim_to, fee)
+
+    async def create_merged_claim_spend(
+        self, coins: List[Coin], claim_to: bytes32, fee: uint64 = uint64(0)
+    ) -> SpendBundle:
+        """Claims all the coins in one bundle, into a single coin holding their total."""
+        if len(coins) == 1:
+            details = {coins[0].name(): await self.get_cb_details(coins[0])}
+        else:
+            details = await self.resolver.resolve(coins)
+        conditions = merged_output_conditions(coins, claim_to)
+        coin_spends: List[CoinSpend] = []
+        for coin, coin_conditions in zip(coins, conditions):
+            if coin.name() not in details:
+                raise ValueError(f"Not a clawback coin: {coin.name().hex()}")
+            sender_ph, recipient_ph, timelock, timelock_unit = details[coin.name()]
+            inner_puzzle = await self.get_puzzle_for_puzzle_hash(recipient_ph)
+            coin_spends.append(
+                self.build_claim_coin_spend(
+                    coin, claim_to, sender_ph, recipient_ph, timelock, inner_puzzle, timelock_unit, coin_conditions
+                )
+            )
+        spend = await self.sign_coin_spends(coin_spends)
+        return await self.attach_fee(spend, fee)
+
+    def build_claim_coin_spend(
+        self,
+        coin: Coin,
+        claim_to: bytes32,
+        sender_ph: bytes32,
+        recipient_ph: bytes32,
+        timelock: uint64,
+        inner_puzzle: Program,
+        timelock_unit: str = SECONDS,
+        conditions: Optional[List[List[Any]]] = None,
+    ) -> CoinSpend:
+        puzzle = self.get_cb_puzzle(timelock, recipient_ph, sender_ph, timelock_unit)
+        if conditions is None:
+            conditions = merged_output_conditions([coin], claim_to)[0]
         inner_solution = solution_for_conditions(conditions)
-        solution = create_clawback_solution(timelock, sender_ph, recipient_ph, inner_puzzle, inner_solution)
-        coin_spend = CoinSpend(coin, puzzle, solution)
-        spend = await self.sign_coin_spends([coin_spend])
+        solution = create_clawback_solution(
+            timelock, sender_ph, recipient_ph, inner_puzzle, inner_solution, timelock_unit
+        )
+        return CoinSpend(coin, puzzle, solution)
+
+    async def prepare_clawback_spend(
+        self, cb_info: CBInfo, to_puzzle_hash: bytes32, master_pk: G1Element, max_index: Optional[uint32] = None
+    ) -> UnsignedSpend:
+        """
+        Builds an unsigned claw from the sender's master public key, for an offline signer.
+        The sender's address must come from an unhardened key.
+        """
+        if not max_index:
+            max_index = await self.get_derivation_index()
+        index, public_key = find_unhardened_key(master_pk, cb_info.sender_ph, max_index)
+        coin_spend = self.build_clawback_coin_spend(cb_info, to_puzzle_hash, puzzle_for_pk(public_key))
+        return create_unsigned_spend(coin_spend, CLAW, index, await self.get_clawback_deadline(cb_info))
+
+    async def prepare_claim_spend(
+        self, coin: Coin, claim_to: bytes32, master_pk: G1Element, max_index: Optional[uint32] = None
+    ) -> UnsignedSpend:
+        sender_ph, recipient_ph, timelock, timelock_unit = await self.get_cb_details(coin)
+        if not max_index:
+            max_index = await self.get_derivation_index()
+        index, public_key = find_unhardened_key(master_pk, recipient_ph, max_index)
+        coin_spend = self.build_claim_coin_spend(
+            coin, claim_to, sender_ph, recipient_ph, timelock, puzzle_for_pk(public_key), timelock_unit
+        )
+        return create_unsigned_spend(coin_spend, CLAIM, index)
+
+    async def submit_signed_spends(
+        self, request: SigningRequest, response: SigningResponse, fee: uint64 = uint64(0)
+    ) -> List[SpendBundle]:
+        """
+        Merges the signatures from an offline signer into the prepared spends, attaches a fee to
+        each and pushes them all at once. Spends that fail validation are dropped without being
+        pushed. Returns the spends the node accepted.
+        """
+        signed = merge_signatures(request, response)
+        spends: List[SpendBundle] = []
+        for unsigned, spend in zip(request.spends, signed):
+            spends.append(await self.attach_fee(spend, fee, unsigned.deadline))
+        validations = await self.validator.validate(spends)
+        valid = [validation.error is None for validation in validations]
+        results = await asyncio.gather(
+            *[self.node_client.push_tx(spend) for spend, ok in zip(spends, valid) if ok], return_exceptions=True
+        )
+        outcomes = iter(results)
+        pushed: List[SpendBundle] = []
+        for unsigned, spend, validation in zip(request.spends, spends, validations):
+            if validation.error is not None:
+                log.warning(f"Not pushing {spend.name().hex()}, it failed validation: {validation.error}")
+                await self.reservations.release(spend.name())
+                continue
+            result = next(outcomes)
+            if isinstance(result, Exception):
+                log.warning(f"Failed to push {spend.name().hex()}: {result}")
+                await self.reservations.release(spend.name())
+                continue
+            await self.track(spend, unsigned.operation, fee)
+            pushed.append(spend)
+        return pushed
+
+    async def attach_fee(self, spend: SpendBundle, fee: uint64, deadline: uint64 = uint64(0)) -> SpendBundle:
+        """
+        Adds a fee spend that asserts the claw or claim's announcement. The signed claw or claim
+        doesn't depend on the fee spend, so it's kept to rebuild the bundle with a bumped fee.
+        """
+        cb_coin = spend.coin_spends[0].coin
         if fee > uint64(0):
+            announcement = Announcement(cb_coin.name(), CB_FEE_ANNOUNCEMENT)
+            try:
+                fee_spend = await self.create_fee_spend(fee, [announcement], reserved_for=cb_coin.name())
+            except Exception:
+                await self.reservations.release(cb_coin.name())
+                raise
             full_spend = SpendBundle.aggregate([spend, fee_spend])
+            await self.reservations.reassign(cb_coin.name(), full_spend.name())
         else:
             full_spend = spend
+        self.base_spends[full_spend.name()] = (spend, deadline)
         return full_spend
 
-    async def sign_coin_spends(self, coin_spends: List[CoinSpend]) -> SpendBundle:
-        config = load_config(DEFAULT_ROOT_PATH, "config.yaml")
-        if config.get("selected_network") == "testnet10":
-            hex_data = config["network_overrides"]["constants"]["testnet10"]["AGG_SIG_ME_ADDITIONAL_DATA"]
-            additional_data = bytes.fromhex(hex_data)
+    async def discard(self, spend: SpendBundle) -> None:
+        """Forgets a spend that was built but won't be pushed, releasing the coins it reserved."""
+        await self.reservations.release(spend.name())
+        self.base_spends.pop(spend.name(), None)
+
+    async def track(self, spend: SpendBundle, operation: str, fee: uint64 = uint64(0)) -> PendingSpend:
+        """Tracks a submitted spend, keeping what's needed to bump its fee if it was built here."""
+        base_spend, deadline = self.base_spends.get(spend.name(), (None, uint64(0)))
+        return await self.tracker.add(spend, operation, fee, base_spend, deadline)
+
+    async def bump_fee(
+        self, pending: PendingSpend, fee: Optional[uint64] = None, target_blocks: int = 1
+    ) -> SpendBundle:
+        """
+        Replaces a pending claw or claim in the mempool with the same signed spend and a bigger
+        fee. The replacement spends the same fee coins, plus another if they can't cover the new
+        fee. It pays at least the minimum fee increase the mempool requires and a higher fee per
+        cost than the spend it replaces, which an added fee coin makes more expensive. With no
+        fee given, the fee is picked from the node's estimate for confirming within target_blocks.
+        """
+        base = await self.cb_store.get_spend_base(pending.name())
+        if base is None:
+            raise ValueError(f"Spend {pending.name().hex()} wasn't built by this tool and can't be bumped")
+        base_spend, deadline = base
+        if fee is None:
+            fee = await self.fee_planner.fee_for_shape(FEE_SHAPES[pending.operation], target_blocks)
+        old_fee = max(pending.fee, pending.spend_bundle.fees())
+        old_cost = compute_spend_cost(pending.spend_bundle)
+        fee = uint64(max(fee, old_fee + MEMPOOL_MIN_FEE_INCREASE))
+
+        base_coins = set(base_spend.removals())
+        fee_coins = [coin for coin in pending.spend_bundle.removals() if coin not in base_coins]
+        announcement = Announcement(base_spend.coin_spends[0].coin.name(), CB_FEE_ANNOUNCEMENT)
+        for _ in range(MAX_BUMP_ATTEMPTS):
+            fee_value = sum(coin.amount for coin in fee_coins)
+            if fee_value < fee:
+                fee_coins.append(await self.fee_pool.allocate(uint64(fee - fee_value), reserved_for=pending.name()))
+            fee_spend = await self.create_fee_spend(fee, [announcement], coins=fee_coins)
+            spend = SpendBundle.aggregate([base_spend, fee_spend])
+            min_fee = min_replacement_fee(old_fee, old_cost, compute_spend_cost(spend))
+            if fee >= min_fee:
+                break
+            fee = uint64(min_fee)
         else:
-            additional_data = DEFAULT_CONSTANTS.AGG_SIG_ME_ADDITIONAL_DATA
+            raise ValueError(f"Couldn't price a replacement for {pending.name().hex()} above its fee per cost")
+        await self.node_client.push_tx(spend)
+        await self.tracker.replace(pending, spend, fee, base_spend, deadline)
+        return spend
+
+    async def bump_due_spends(self, margin: int = BUMP_MARGIN) -> List[SpendBundle]:
+        """
+        Bumps the fee of every pending spend whose deadline is less than margin seconds away,
+        unless it was bumped or broadcast too recently for the last attempt to have landed.
+        """
+        now = uint64(int(time.time()))
+        bumped: List[SpendBundle] = []
+        for pending in await self.cb_store.get_pending_spends_due(uint64(now + margin)):
+            if now - pending.last_broadcast_at < REBROADCAST_INTERVAL:
+                continue
+            try:
+                bumped.append(await self.bump_fee(pending))
+            except ValueError as e:
+                log.warning(f"Failed to bump the fee of {pending.name().hex()}: {e}")
+        return bumped
+
+    async def build_with_fee(
+        self,
+        build: Callable[[uint64], Awaitable[SpendBundle]],
+        fee: Optional[uint64],
+        shape: str,
+        target_blocks: int,
+        spends: int = 1,
+    ) -> Tuple[SpendBundle, uint64]:
+        """
+        Builds a spend with the given fee, or when fee is None with a fee picked from the node's
+        estimate for the cost of the given number of spends of the given shape.
+        """
+        if fee is not None:
+            return await build(fee), fee
+        return await self.fee_planner.build_with_fee(
+            build, standard_spend_costs()[shape] * spends, target_blocks, self.discard
+        )
+
+    async def sign_coin_spends(self, coin_spends: List[CoinSpend]) -> SpendBundle:
+        additional_data = get_additional_data()
 
         signatures: List[G2Element] = []
         pk_list: List[G1Element] = []
@@ -327,13 +917,18 @@ class CBManager:
         return SpendBundle(coin_spends, aggsig)
 
     async def create_fee_spend(
-        self, fee: uint64, announcements: List[Announcement], fee_wallet_id: int = 1
+        self,
+        fee: uint64,
+        announcements: List[Announcement],
+        fee_wallet_id: int = 1,
+        reserved_for: Optional[bytes32] = None,
+        coins: Optional[List[Coin]] = None,
     ) -> SpendBundle:
-        spendable_coins = await self.wallet_client.get_spendable_coins(fee_wallet_id, min_coin_amount=fee)
-        coin = spendable_coins[0][0].coin
-        addition = {"puzzle_hash": coin.puzzle_hash, "amount": coin.amount - fee}
+        if coins is None:
+            coins = [await self.fee_pool.allocate(fee, fee_wallet_id, reserved_for)]
+        addition = {"puzzle_hash": coins[0].puzzle_hash, "amount": sum(coin.amount for coin in coins) - fee}
         fee_tx = await self.wallet_client.create_signed_transaction(
-            [addition], coins=[coin], coin_announcements=announcements, fee=fee
+            [addition], coins=coins, coin_announcements=announcements, fee=fee
         )
         assert isinstance(fee_tx.spend_bundle, SpendBundle)
         return fee_tx.spend_bundle
@@ -0,0 +1,185 @@
+import asyncio
+import copy
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from chia.rpc.full_node_rpc_client import FullNodeRpcClient
+
+log = logging.getLogger(__name__)
+
+# Seconds that coin records and the blockchain state are served from the cache
+COIN_RECORD_TTL = 10.0
+# Blocks this far below the peak are treated as final and cached until a reorg is seen
+FINALITY_DEPTH = 32
+# Immutable responses kept, least recently used first out, so long running commands stay bounded
+MAX_IMMUTABLE_ENTRIES = 10000
+
+# Cache policies by RPC path
+IMMUTABLE = "immutable"
+BY_HEIGHT = "by_height"
+TTL = "ttl"
+
+CACHE_POLICIES: Dict[str, str] = {
+    # A spent coin's puzzle and solution and anything looked up by header hash never change
+    "get_puzzle_and_solution": IMMUTABLE,
+    "get_block_record": IMMUTABLE,
+    "get_block_spends": IMMUTABLE,
+    "get_additions_and_removals": IMMUTABLE,
+    # The block at a height only changes if the chain reorgs that deep
+    "get_block_record_by_height": BY_HEIGHT,
+    "get_blockchain_state": TTL,
+    "get_coin_record_by_name": TTL,
+    "get_coin_records_by_names": TTL,
+    "get_coin_records_by_parent_ids": TTL,
+    "get_coin_records_by_puzzle_hash": TTL,
+    "get_coin_records_by_puzzle_hashes": TTL,
+    "get_coin_records_by_hint": TTL,
+}
+
+
+class CachingNodeClient(FullNodeRpcClient):
+    """
+    A FullNodeRpcClient that serves repeated reads from memory. Immutable data is kept until
+    the node reports a reorg or it's the least recently used of max_immutable entries, coin
+    records and chain state expire after a short TTL, and identical lookups made while one is
+    in flight share its response.
+    """
+
+    client: FullNodeRpcClient
+    coin_record_ttl: float
+    max_immutable: int
+    # Entries that expire, in the order they were stored, which is the order they expire in
+    cache: Dict[Tuple[str, str], Tuple[float, Dict[str, Any]]]
+    immutable: "OrderedDict[Tuple[str, str], Dict[str, Any]]"
+    in_flight: Dict[Tuple[str, str], "asyncio.Task[Dict[str, Any]]"]
+    # Hits, misses and evictions by path
+    stats: Dict[str, List[int]]
+    peak: Optional[Tuple[int, str]]
+
+    @classmethod
+    async def from_client(
+        cls,
+        client: FullNodeRpcClient,
+        coin_record_ttl: float = COIN_RECORD_TTL,
+        max_immutable: int = MAX_IMMUTABLE_ENTRIES,
+    ):
+        self = cls()
+        self.client = client
+        self.coin_record_ttl = coin_record_ttl
+        self.max_immutable = max_immutable
+        self.hostname = client.hostname
+        self.port = client.port
+        self.url = client.url
+        self.session = client.session
+        self.ssl_context = client.ssl_context
+        self.closing_task = None
+        self.cache = {}
+        self.immutable = OrderedDict()
+        self.in_flight = {}
+        self.stats = {}
+        self.peak = None
+        return self
+
+    async def fetch(self, path, request_json) -> Dict[str, Any]:
+        if path not in CACHE_POLICIES:
+            return await self.client.fetch(path, request_json)
+        stats = self.stats.setdefault(path, [0, 0, 0])
+        key = (path, json.dumps(request_json, sort_keys=True))
+        cached = self.get_cached(key)
+        if cached is not None:
+            stats[0] += 1
+            return copy.deepcopy(cached)
+        task = self.in_flight.get(key)
+        if task is not None:
+            stats[0] += 1
+        else:
+            stats[1] += 1
+            task = asyncio.ensure_future(self.fetch_and_cache(path, request_json, key))
+            self.in_flight[key] = task
+        try:
+            response = await asyncio.shield(task)
+        finally:
+            if self.in_flight.get(key) is task:
+                del self.in_flight[key]
+        # Callers get their own copy since the client methods modify responses as they parse them
+        return copy.deepcopy(response)
+
+    async def fetch_and_cache(self, path: str, request_json: Dict[str, Any], key: Tuple[str, str]) -> Dict[str, Any]:
+        response = await self.client.fetch(path, request_json)
+        if path == "get_blockchain_state":
+            self.observe_peak(response["blockchain_state"]["peak"])
+        policy = CACHE_POLICIES[path]
+        final = policy == IMMUTABLE
+        if policy == BY_HEIGHT:
+            # A peak up to a TTL old only makes the finality check stricter
+            await self.fetch("get_blockchain_state", {})
+            final = self.peak is not None and int(request_json["height"]) <= self.peak[0] - FINALITY_DEPTH
+        if final:
+            self.immutable[key] = response
+            self.immutable.move_to_end(key)
+            while len(self.immutable) > self.max_immutable:
+                (evicted_path, _), _ = self.immutable.popitem(last=False)
+                self.stats.setdefault(evicted_path, [0, 0, 0])[2] += 1
+        else:
+            now = time.monotonic()
+            self.prune_expired(now)
+            # Re-stored entries move to the back, keeping the dict in expiry order
+            self.cache.pop(key, None)
+            self.cache[key] = (now + self.coin_record_ttl, response)
+        return response
+
+    def get_cached(self, key: Tuple[str, str]) -> Optional[Dict[str, Any]]:
+        response = self.immutable.get(key)
+        if response is not None:
+            self.immutable.move_to_end(key)
+            return response
+        entry = self.cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def prune_expired(self, now: float) -> None:
+        """Drops the expired entries at the front of the TTL cache, the oldest stored."""
+        while len(self.cache) > 0:
+            key = next(iter(self.cache))
+            if self.cache[key][0] > now:
+                break
+            del self.cache[key]
+
+    async def get_peak_height(self) -> Optional[int]:
+        """The node's current peak, asked for every time since a cached one lags behind new blocks."""
+        response = await self.client.fetch("get_blockchain_state", {})
+        self.observe_peak(response["blockchain_state"]["peak"])
+        return None if self.peak is None else self.peak[0]
+
+    def observe_peak(self, peak: Optional[Dict[str, Any]]) -> None:
+        """Drops everything cached when the peak moves back or is swapped for another block."""
+        if peak is None:
+            return
+        new_peak = (int(peak["height"]), peak["header_hash"])
+        if self.peak is not None and (
+            new_peak[0] < self.peak[0] or (new_peak[0] == self.peak[0] and new_peak[1] != self.peak[1])
+        ):
+            log.info(f"Reorg from height {self.peak[0]} to {new_peak[0]}, clearing the node cache")
+            self.invalidate()
+        self.peak = new_peak
+
+    def invalidate(self) -> None:
+        self.cache.clear()
+        self.immutable.clear()
+
+    def get_hit_ratios(self) -> Dict[str, float]:
+        return {path: hits / (hits + misses) for path, (hits, misses, _) in self.stats.items() if hits + misses > 0}
+
+    def get_evictions(self) -> Dict[str, int]:
+        """The immutable entries dropped by path to stay within max_immutable."""
+        return {path: evictions for path, (_, _, evictions) in self.stats.items() if evictions > 0}
+
+    def close(self) -> None:
+        self.client.close()
+
+    async def await_closed(self) -> None:
+        await self.client.await_closed()
@@ -0,0 +1,206 @@
+import asyncio
+import dataclasses
+import logging
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Set
+
+from chia.types.blockchain_format.coin import Coin
+from chia.util.ints import uint64
+
+from src.drivers.cb_costs import CREATE
+from src.drivers.cb_manager import CBManager, CBPayment
+
+log = logging.getLogger(__name__)
+
+# How long the queue waits for another payment before flushing, in seconds
+DEFAULT_PAYOUT_WINDOW = 0.5
+
+# Most payments created by one spend, each adds an output and a REMARK well under the cost limit
+DEFAULT_MAX_PAYOUTS = 100
+
+# Longest a payment waits in the queue before its batch is flushed, in seconds
+DEFAULT_MAX_LATENCY = 5.0
+
+
+@dataclass
+class PayoutRequest:
+    payment: CBPayment
+    # None picks the fee from the node's estimate
+    fee: Optional[uint64]
+    future: "asyncio.Future[Coin]"
+    enqueued_at: float
+
+
+class PayoutQueue:
+    """
+    Collects clawback payments as they arrive and creates them in batches, one spend with an
+    output per payment, so a stream of payouts costs one coin selection, one signature set and
+    one push per batch rather than per payment. A batch is flushed once no payment has arrived
+    for the window, it holds max_batch_size payments or its oldest payment has waited for
+    max_latency, whichever comes first. Latency is measured with clock, the event loop's time
+    unless another is given.
+    """
+
+    manager: CBManager
+    window: float
+    max_batch_size: int
+    max_latency: float
+    wallet_id: int
+    target_blocks: int
+    clock: Callable[[], float]
+    queue: "asyncio.Queue[Optional[PayoutRequest]]"
+    deferred: List[PayoutRequest]
+    flushes: Set["asyncio.Task[None]"]
+    collector: "asyncio.Task[None]"
+
+    @classmethod
+    async def create(
+        cls,
+        manager: CBManager,
+        window: float = DEFAULT_PAYOUT_WINDOW,
+        max_batch_size: int = DEFAULT_MAX_PAYOUTS,
+        max_latency: float = DEFAULT_MAX_LATENCY,
+        wallet_id: int = 1,
+        target_blocks: int = 1,
+        clock: Optional[Callable[[], float]] = None,
+    ):
+        self = cls()
+        self.manager = manager
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.wallet_id = wallet_id
+        self.target_blocks = target_blocks
+        self.clock = clock if clock is not None else asyncio.get_running_loop().time
+        self.queue = asyncio.Queue()
+        # Payments held back from a batch that already creates the same coin
+        self.deferred = []
+        self.flushes = set()
+        self.collector = asyncio.create_task(self.collect())
+        return self
+
+    async def submit(self, payment: CBPayment, fee: Optional[uint64] = uint64(0)) -> Coin:
+        """
+        Queues the payment and returns its clawback coin once the batch holding it is pushed.
+        Raises ValueError if the batch couldn't be created or was rejected.
+        """
+        request = PayoutRequest(payment, fee, asyncio.get_running_loop().create_future(), self.clock())
+        self.queue.put_nowait(request)
+        return await request.future
+
+    async def next_request(self, timeout: Optional[float]) -> Optional[PayoutRequest]:
+        if len(self.deferred) > 0:
+            return self.deferred.pop(0)
+        if timeout is None:
+            return await self.queue.get()
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    async def collect(self) -> None:
+        closing = False
+        while not closing or len(self.deferred) > 0:
+            first = await self.next_request(None)
+            if first is None:
+                break
+            batch = [first]
+            deadline = first.enqueued_at + self.max_latency
+            while len(batch) < self.max_batch_size:
+                timeout = min(self.window, deadline - self.clock())
+                if timeout <= 0:
+                    break
+                try:
+                    request = await self.next_request(timeout)
+                except asyncio.TimeoutError:
+                    break
+                if request is None:
+                    closing = True
+                    break
+                batch.append(request)
+            batch = self.split_duplicates(batch)
+            flush = asyncio.create_task(self.flush(batch))
+            self.flushes.add(flush)
+            flush.add_done_callback(self.flushes.discard)
+
+    def split_duplicates(self, batch: List[PayoutRequest]) -> List[PayoutRequest]:
+        """Defers the payments that would create the same coin as one already in the batch."""
+        outputs = set()
+        unique: List[PayoutRequest] = []
+        for request in batch:
+            # Hints don't change the coin
+            output = dataclasses.replace(request.payment, hint_sender=False)
+            if output in outputs:
+                self.deferred.append(request)
+            else:
+                outputs.add(output)
+                unique.append(request)
+        return unique
+
+    async def flush(self, batch: List[PayoutRequest]) -> None:
+        """Creates the batch's spend, making sure every payment in it gets its coin or an error."""
+        error: Exception = ValueError("The batch was cancelled before it was pushed")
+        try:
+            await self.create_batch(batch)
+        except Exception as e:
+            log.warning(f"Failed to create a batch of {len(batch)} payments: {e}")
+            error = e
+        finally:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(ValueError(f"Failed to create clawback coin: {error}"))
+
+    async def create_batch(self, batch: List[PayoutRequest]) -> None:
+        """Creates, validates and pushes one spend for the batch, then hands each payment its coin."""
+        payments = [request.payment for request in batch]
+        # The batch pays what its payments offered, or the node's estimate if any left it to the estimate
+        fee: Optional[uint64] = None
+        if all(request.fee is not None for request in batch):
+            fee = uint64(sum(request.fee for request in batch if request.fee is not None))
+        spend = None
+        try:
+            spend, fee = await self.manager.build_with_fee(
+                lambda fee_amount: self.manager.create_cb_coins(payments, fee_amount, self.wallet_id),
+                fee,
+                CREATE,
+                self.target_blocks,
+                len(batch),
+            )
+            await self.manager.validator.check(spend)
+        except Exception:
+            if spend is not None:
+                await self.manager.discard(spend)
+            raise
+        try:
+            await self.manager.node_client.push_tx(spend)
+        except ValueError:
+            # The node answered and turned the spend down, so its coins can be spent again
+            await self.manager.discard(spend)
+            raise
+        except Exception as e:
+            # The spend may have reached the node, so its coins stay reserved and the tracker rebroadcasts it
+            log.warning(f"Pushing {spend.name().hex()} failed, tracking it in case it reached the node: {e!r}")
+        additions = {(coin.puzzle_hash, coin.amount): coin for coin in spend.additions()}
+        coins: List[Coin] = []
+        for payment in payments:
+            puzzle_hash = self.manager.get_cb_puzzle_hash(
+                payment.timelock, payment.recipient_ph, payment.sender_ph, payment.timelock_unit
+            )
+            coins.append(additions[(puzzle_hash, payment.amount)])
+        try:
+            for payment, coin in zip(payments, coins):
+                await self.manager.add_new_coin(
+                    coin, payment.recipient_ph, payment.sender_ph, payment.timelock, payment.timelock_unit
+                )
+            await self.manager.track(spend, CREATE, fee)
+        except Exception as e:
+            # The spend is out, its coins are created whether or not they were recorded
+            log.error(f"Pushed {spend.name().hex()} but failed to record its coins: {e}")
+        for request, coin in zip(batch, coins):
+            if not request.future.done():
+                request.future.set_result(coin)
+        log.info(f"Created {len(batch)} clawback coins in {spend.name().hex()}")
+
+    async def close(self) -> None:
+        """Flushes the payments still queued and waits for every batch to be pushed."""
+        self.queue.put_nowait(None)
+        await self.collector
+        if len(self.flushes) > 0:
+            await asyncio.gather(*self.flushes)
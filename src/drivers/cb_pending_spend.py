@@ -0,0 +1,41 @@
+from dataclasses import dataclass
+from typing import List, Optional
+
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.spend_bundle import SpendBundle
+from chia.util.ints import uint32, uint64
+
+# Pending spend states
+PENDING = "pending"
+CONFIRMED = "confirmed"
+FAILED = "failed"
+REPLACED = "replaced"
+
+
+@dataclass(frozen=True)
+class PendingSpend:
+    spend_bundle: SpendBundle
+    operation: str
+    fee: uint64
+    submitted_at: uint64
+    last_broadcast_at: uint64
+    broadcast_count: uint32
+    status: str
+    confirmed_height: uint32
+    confirmed_at: uint64
+
+    def name(self) -> bytes32:
+        return self.spend_bundle.name()
+
+    def coin_ids(self) -> List[bytes32]:
+        return [coin.name() for coin in self.spend_bundle.removals()]
+
+    def addition_id(self) -> Optional[bytes32]:
+        """A coin only this spend creates, which is on chain once the spend itself is."""
+        additions = self.spend_bundle.additions()
+        return additions[0].name() if len(additions) > 0 else None
+
+    def latency(self) -> uint64:
+        """Seconds from first submission to confirmation."""
+        assert self.status == CONFIRMED
+        return uint64(max(0, self.confirmed_at - self.submitted_at))
@@ -2,6 +2,7 @@ from typing import Any, Dict, List, Tuple
 
 from chia.types.blockchain_format.program import Program
 from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.condition_opcodes import ConditionOpcode
 from chia.util.ints import uint64
 from chia.wallet.util.merkle_utils import build_merkle_tree
 
@@ -11,6 +12,18 @@ P2_1_OF_N = load_clvm("p2_1_of_n.clsp", "src.clsp")
 P2_CURRIED_PUZZLE_HASH = load_clvm("p2_puzzle_hash.clsp", "src.clsp")
 AUGMENTED_CONDITION = load_clvm("augmented_condition.clsp", "src.clsp")
 
+# Timelock units. Seconds based coins were the only kind before height based ones were added,
+# so a coin whose REMARK doesn't name a unit is seconds based
+SECONDS = "seconds"
+HEIGHT = "height"
+TIMELOCK_CONDITIONS = {
+    SECONDS: ConditionOpcode.ASSERT_SECONDS_RELATIVE,
+    HEIGHT: ConditionOpcode.ASSERT_HEIGHT_RELATIVE,
+}
+
+# Claw and claim spends announce this message so a separately signed fee spend can bind to them
+CB_FEE_ANNOUNCEMENT = b"fee"
+
 
 def create_augmented_cond_puzzle(condition: List[Any], puzzle_hash: bytes32) -> Program:
     return AUGMENTED_CONDITION.curry(condition, puzzle_hash)
@@ -28,10 +41,16 @@ def create_p2_puzzle_hash_solution(inner_puzzle: Program, inner_solution: Progra
     return Program.to([inner_puzzle, inner_solution])
 
 
+def create_timelock_condition(timelock: uint64, timelock_unit: str = SECONDS) -> List[Any]:
+    if timelock_unit not in TIMELOCK_CONDITIONS:
+        raise ValueError(f"Unknown timelock unit: {timelock_unit}")
+    return [TIMELOCK_CONDITIONS[timelock_unit], timelock]
+
+
 def create_clawback_merkle_tree(
-    timelock: uint64, sender_ph: bytes32, recipient_ph: bytes32
+    timelock: uint64, sender_ph: bytes32, recipient_ph: bytes32, timelock_unit: str = SECONDS
 ) -> Tuple[bytes32, Dict[bytes32, Tuple[int, List[bytes32]]]]:
-    timelock_condition = [80, timelock]
+    timelock_condition = create_timelock_condition(timelock, timelock_unit)
     augmented_cond_puz = create_augmented_cond_puzzle(timelock_condition, recipient_ph)
     p2_puzzle_hash_puz = create_p2_puzzle_hash_puzzle(sender_ph)
     merkle_tree = build_merkle_tree([augmented_cond_puz.get_tree_hash(), p2_puzzle_hash_puz.get_tree_hash()])
@@ -42,8 +61,10 @@ def create_merkle_proof(merkle_tree, puzzle_hash: bytes32):
     return Program.to(merkle_tree[1][puzzle_hash])
 
 
-def create_clawback_puzzle(timelock: uint64, sender_ph: bytes32, recipient_ph: bytes32) -> Program:
-    merkle_tree = create_clawback_merkle_tree(timelock, sender_ph, recipient_ph)
+def create_clawback_puzzle(
+    timelock: uint64, sender_ph: bytes32, recipient_ph: bytes32, timelock_unit: str = SECONDS
+) -> Program:
+    merkle_tree = create_clawback_merkle_tree(timelock, sender_ph, recipient_ph, timelock_unit)
     return P2_1_OF_N.curry(merkle_tree[0])
 
 
@@ -53,15 +74,21 @@ def create_clawback_solution(
     recipient_ph: bytes32,
     inner_puzzle: Program,
     inner_solution: Program,
+    timelock_unit: str = SECONDS,
 ) -> Program:
-    merkle_tree = create_clawback_merkle_tree(timelock, sender_ph, recipient_ph)
+    merkle_tree = create_clawback_merkle_tree(timelock, sender_ph, recipient_ph, timelock_unit)
     if inner_puzzle.get_tree_hash() == sender_ph:
         cb_inner_puz = create_p2_puzzle_hash_puzzle(sender_ph)
         merkle_proof = create_merkle_proof(merkle_tree, cb_inner_puz.get_tree_hash())
         cb_inner_solution = create_p2_puzzle_hash_solution(inner_puzzle, inner_solution)
     elif inner_puzzle.get_tree_hash() == recipient_ph:
-        condition = [80, timelock]
+        condition = create_timelock_condition(timelock, timelock_unit)
         cb_inner_puz = create_augmented_cond_puzzle(condition, recipient_ph)
         merkle_proof = create_merkle_proof(merkle_tree, cb_inner_puz.get_tree_hash())
         cb_inner_solution = create_augmented_cond_solution(inner_puzzle, inner_solution)
     return Program.to([merkle_proof, cb_inner_puz, cb_inner_solution])
+
+
+def spent_by_sender(clawback_solution: Program, sender_ph: bytes32) -> bool:
+    """Whether a clawback solution spends the coin through the sender's path, clawing it back."""
+    return clawback_solution.at("rf").get_tree_hash() == create_p2_puzzle_hash_puzzle(sender_ph).get_tree_hash()
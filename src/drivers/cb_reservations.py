@@ -0,0 +1,68 @@
+import time
+from typing import List
+
+from chia.rpc.full_node_rpc_client import FullNodeRpcClient
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.util.ints import uint64
+
+from src.drivers.cb_store import CBStore
+
+# How long coins stay locked to a spend that never confirms
+DEFAULT_RESERVATION_TTL = 30 * 60
+
+
+class CoinReservations:
+    """
+    Tracks which coins each pending spend has locked, in the clawback DB so that every
+    process sharing the DB sees them. Reservations expire after a TTL, and reconcile()
+    releases them early once the chain shows their coins spent.
+    """
+
+    node_client: FullNodeRpcClient
+    cb_store: CBStore
+    ttl: int
+
+    @classmethod
+    async def create(cls, node_client: FullNodeRpcClient, cb_store: CBStore, ttl: int = DEFAULT_RESERVATION_TTL):
+        self = cls()
+        self.node_client = node_client
+        self.cb_store = cb_store
+        self.ttl = ttl
+        return self
+
+    def now(self) -> uint64:
+        return uint64(int(time.time()))
+
+    def expiry(self) -> uint64:
+        return uint64(self.now() + self.ttl)
+
+    async def reserve(self, coins: List[Coin], reserved_for: bytes32) -> bool:
+        return await self.cb_store.reserve_coins(coins, reserved_for, self.now(), self.expiry())
+
+    async def reassign(self, reserved_for: bytes32, spend_bundle_name: bytes32) -> None:
+        """Re-keys a reservation made before the spend was built to the final spend bundle name."""
+        await self.cb_store.reassign_reservation(reserved_for, spend_bundle_name)
+
+    async def release(self, reserved_for: bytes32) -> None:
+        await self.cb_store.release_reservation(reserved_for)
+
+    async def get_reserved_coins(self) -> List[Coin]:
+        return await self.cb_store.get_reserved_coins(self.now())
+
+    async def reconcile(self) -> None:
+        """
+        Checks every reserved coin against the chain in one call. Once any coin of a pending
+        spend is spent, that spend has either confirmed or been beaten by a conflicting one,
+        so all of its coins are released.
+        """
+        reservations = await self.cb_store.get_reservations(self.now())
+        if len(reservations) == 0:
+            return
+        names = [name for coin_names in reservations.values() for name in coin_names]
+        coin_records = await self.node_client.get_coin_records_by_names(names, include_spent_coins=True)
+        spent = set(coin_record.name for coin_record in coin_records if coin_record.spent)
+        async with self.cb_store.db_wrapper.writer():
+            for reserved_for, coin_names in reservations.items():
+                if any(name in spent for name in coin_names):
+                    await self.cb_store.release_reservation(reserved_for)
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from chia.consensus.default_constants import DEFAULT_CONSTANTS
+from chia.rpc.full_node_rpc_client import FullNodeRpcClient
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_record import CoinRecord
+from chia.types.coin_spend import CoinSpend
+from chia.types.condition_opcodes import ConditionOpcode
+from chia.util.condition_tools import conditions_dict_for_solution
+from chia.util.errors import ConsensusError
+from chia.util.ints import uint32, uint64
+from clvm.casts import int_from_bytes
+
+from src.drivers.cb_puzzles import SECONDS, TIMELOCK_CONDITIONS, create_clawback_puzzle
+
+log = logging.getLogger(__name__)
+
+# The sender, recipient, timelock and timelock unit of a cb coin
+CBDetails = Tuple[bytes32, bytes32, int, str]
+
+
+def cb_details_list_from_parent_spend(parent_spend: CoinSpend) -> List[CBDetails]:
+    """Reads the sender, recipient, timelock and timelock unit from each REMARK of the spend creating cb coins."""
+    puzzle = parent_spend.puzzle_reveal.to_program()
+    solution = parent_spend.solution.to_program()
+    conditions = conditions_dict_for_solution(puzzle, solution, DEFAULT_CONSTANTS.MAX_BLOCK_COST_CLVM)
+    assert isinstance(conditions, Dict)
+    if ConditionOpcode.REMARK not in conditions.keys():
+        raise ValueError("Coin doess not contain a valid clawback puzzle")
+    details: List[CBDetails] = []
+    for condition in conditions[ConditionOpcode.REMARK]:
+        remark_vars = condition.vars
+        remark = remark_vars[0]
+        sender_ph = bytes32(remark[:32])
+        recipient_ph = bytes32(remark[32:64])
+        timelock = int_from_bytes(remark[64:])
+        timelock_unit = remark_vars[1].decode(errors="replace") if len(remark_vars) > 1 else SECONDS
+        if timelock_unit not in TIMELOCK_CONDITIONS:
+            raise ValueError(f"Coin has an unknown timelock unit: {timelock_unit!r}")
+        details.append((sender_ph, recipient_ph, timelock, timelock_unit))
+    return details
+
+
+def match_cb_details(details: List[CBDetails], coin: Coin) -> CBDetails:
+    """
+    Picks the REMARK describing the coin from those of its parent. A spend creating several cb
+    coins has one REMARK per coin, so it's the one whose clawback puzzle hash is the coin's.
+    """
+    if len(details) == 1:
+        return details[0]
+    for sender_ph, recipient_ph, timelock, timelock_unit in details:
+        puzzle_hash = create_clawback_puzzle(uint64(timelock), sender_ph, recipient_ph, timelock_unit).get_tree_hash()
+        if puzzle_hash == coin.puzzle_hash:
+            return sender_ph, recipient_ph, timelock, timelock_unit
+    raise ValueError(f"No REMARK of the parent spend describes coin {coin.name().hex()}")
+
+
+def cb_details_from_parent_spend(parent_spend: CoinSpend, coin: Optional[Coin] = None) -> CBDetails:
+    """
+    Reads the sender, recipient, timelock and timelock unit from the REMARK of the spend creating
+    a cb coin. Given the coin, the REMARK is matched to it, otherwise the first one is read.
+    """
+    details = cb_details_list_from_parent_spend(parent_spend)
+    if coin is None:
+        return details[0]
+    return match_cb_details(details, coin)
+
+
+class CBDetailsResolver:
+    """
+    Reads the clawback details of many coins at once. The coins' parents are grouped by the
+    height they were spent at and each block's spends are fetched once, so coins that came out
+    of the same few blocks, like a batch of payouts, cost a lookup per block rather than per coin.
+    """
+
+    node_client: FullNodeRpcClient
+    batch_size: int
+    max_concurrent: int
+
+    @classmethod
+    async def create(cls, node_client: FullNodeRpcClient, batch_size: int, max_concurrent: int):
+        self = cls()
+        self.node_client = node_client
+        # Coins looked up per coin record request, and requests to the node in flight at once
+        self.batch_size = batch_size
+        self.max_concurrent = max_concurrent
+        return self
+
+    async def get_parent_records(self, coins: List[Coin]) -> Dict[bytes32, CoinRecord]:
+        parent_ids = list({coin.parent_coin_info for coin in coins})
+        parents: Dict[bytes32, CoinRecord] = {}
+        for i in range(0, len(parent_ids), self.batch_size):
+            batch = parent_ids[i : i + self.batch_size]
+            for parent in await self.node_client.get_coin_records_by_names(batch, include_spent_coins=True):
+                parents[parent.name] = parent
+        return parents
+
+    async def get_spends_at(self, height: uint32, parents: List[CoinRecord]) -> Dict[bytes32, CoinSpend]:
+        """Returns the spends of the parents, all spent at the given height, from one fetch of the block's spends."""
+        block = await self.node_client.get_block_record_by_height(height)
+        block_spends = None if block is None else await self.node_client.get_block_spends(block.header_hash)
+        if block_spends is not None:
+            wanted = {parent.name for parent in parents}
+            return {spend.coin.name(): spend for spend in block_spends if spend.coin.name() in wanted}
+        # The raw client swallows errors, fall back to fetching each parent's spend
+        log.info(f"Failed to fetch the spends of block {height}, fetching {len(parents)} parent spends instead")
+        spends: Dict[bytes32, CoinSpend] = {}
+        for parent in parents:
+            spend = await self.node_client.get_puzzle_and_solution(parent.name, parent.spent_block_index)
+            if isinstance(spend, CoinSpend):
+                spends[parent.name] = spend
+        return spends
+
+    async def resolve(self, coins: List[Coin]) -> Dict[bytes32, CBDetails]:
+        """
+        Returns the clawback details of each coin by coin name. Coins whose parent can't be found
+        or didn't leave a valid clawback REMARK are left out.
+        """
+        parents = await self.get_parent_records(coins)
+        by_height: Dict[uint32, List[CoinRecord]] = {}
+        for parent in parents.values():
+            if parent.spent_block_index > 0:
+                by_height.setdefault(parent.spent_block_index, []).append(parent)
+        semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        async def get_spends(height: uint32) -> Dict[bytes32, CoinSpend]:
+            async with semaphore:
+                return await self.get_spends_at(height, by_height[height])
+
+        parent_spends: Dict[bytes32, CoinSpend] = {}
+        for spends in await asyncio.gather(*(get_spends(height) for height in by_height)):
+            parent_spends.update(spends)
+        # A parent can create several cb coins, its REMARKs are read once for all of them
+        parent_details: Dict[bytes32, List[CBDetails]] = {}
+        for parent_id, spend in parent_spends.items():
+            try:
+                parent_details[parent_id] = cb_details_list_from_parent_spend(spend)
+            except (ValueError, ConsensusError):
+                continue
+        resolved: Dict[bytes32, CBDetails] = {}
+        for coin in coins:
+            if coin.parent_coin_info not in parent_details:
+                continue
+            try:
+                resolved[coin.name()] = match_cb_details(parent_details[coin.parent_coin_info], coin)
+            except ValueError:
+                continue
+        return resolved
@@ -0,0 +1,168 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from blspy import AugSchemeMPL, G1Element, G2Element, PrivateKey
+from chia.consensus.default_constants import DEFAULT_CONSTANTS
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_spend import CoinSpend
+from chia.types.spend_bundle import SpendBundle
+from chia.util.condition_tools import conditions_dict_for_solution, pkm_pairs_for_conditions_dict
+from chia.util.config import load_config
+from chia.util.default_root import DEFAULT_ROOT_PATH
+from chia.util.ints import uint32, uint64
+from chia.util.streamable import Streamable, streamable
+from chia.wallet.derive_keys import master_sk_to_wallet_sk_unhardened
+from chia.wallet.puzzles.p2_delegated_puzzle_or_hidden_puzzle import (
+    DEFAULT_HIDDEN_PUZZLE_HASH,
+    calculate_synthetic_secret_key,
+    puzzle_for_pk,
+)
+
+# Messages signed per task handed to a worker process
+SIGNING_CHUNK_SIZE = 256
+
+
+@streamable
+@dataclass(frozen=True)
+class SigningTarget(Streamable):
+    """A message to sign with the synthetic key of the wallet key at derivation_index."""
+
+    derivation_index: uint32
+    public_key: G1Element
+    message: bytes
+
+
+@streamable
+@dataclass(frozen=True)
+class UnsignedSpend(Streamable):
+    coin_spends: List[CoinSpend]
+    targets: List[SigningTarget]
+    operation: str
+    deadline: uint64
+
+
+@streamable
+@dataclass(frozen=True)
+class SigningRequest(Streamable):
+    spends: List[UnsignedSpend]
+
+
+@streamable
+@dataclass(frozen=True)
+class SigningResponse(Streamable):
+    # One aggregate signature per spend in the request, in the same order
+    signatures: List[G2Element]
+
+
+def get_additional_data() -> bytes:
+    config = load_config(DEFAULT_ROOT_PATH, "config.yaml")
+    if config.get("selected_network") == "testnet10":
+        hex_data = config["network_overrides"]["constants"]["testnet10"]["AGG_SIG_ME_ADDITIONAL_DATA"]
+        return bytes.fromhex(hex_data)
+    return DEFAULT_CONSTANTS.AGG_SIG_ME_ADDITIONAL_DATA
+
+
+def master_pk_to_wallet_pk_unhardened(master_pk: G1Element, index: uint32) -> G1Element:
+    pk = master_pk
+    for i in [12381, 8444, 2, index]:
+        pk = AugSchemeMPL.derive_child_pk_unhardened(pk, i)
+    return pk
+
+
+def find_unhardened_key(master_pk: G1Element, puzzle_hash: bytes32, max_index: uint32) -> Tuple[uint32, G1Element]:
+    """Finds the unhardened wallet key for puzzle_hash from the master public key alone."""
+    for i in range(max_index):
+        pk = master_pk_to_wallet_pk_unhardened(master_pk, uint32(i))
+        if puzzle_for_pk(pk).get_tree_hash() == puzzle_hash:
+            return uint32(i), pk
+    raise ValueError(f"Couldn't find an unhardened key for puzzle hash: {puzzle_hash}.")
+
+
+def create_unsigned_spend(
+    coin_spend: CoinSpend,
+    operation: str,
+    derivation_index: uint32,
+    deadline: uint64 = uint64(0),
+    additional_data: Optional[bytes] = None,
+) -> UnsignedSpend:
+    if additional_data is None:
+        additional_data = get_additional_data()
+    conditions_dict = conditions_dict_for_solution(
+        coin_spend.puzzle_reveal, coin_spend.solution, DEFAULT_CONSTANTS.MAX_BLOCK_COST_CLVM
+    )
+    targets = [
+        SigningTarget(derivation_index, G1Element.from_bytes(pk_bytes), msg)
+        for pk_bytes, msg in pkm_pairs_for_conditions_dict(conditions_dict, coin_spend.coin.name(), additional_data)
+    ]
+    return UnsignedSpend([coin_spend], targets, operation, deadline)
+
+
+def _sign_chunk(master_sk_bytes: bytes, targets: List[Tuple[int, bytes, bytes]]) -> List[bytes]:
+    # Runs in a worker process, so it takes and returns plain bytes
+    master_sk = PrivateKey.from_bytes(master_sk_bytes)
+    keys: Dict[int, PrivateKey] = {}
+    signatures: List[bytes] = []
+    for index, pk_bytes, message in targets:
+        if index not in keys:
+            wallet_sk = master_sk_to_wallet_sk_unhardened(master_sk, uint32(index))
+            keys[index] = calculate_synthetic_secret_key(wallet_sk, DEFAULT_HIDDEN_PUZZLE_HASH)
+        if bytes(keys[index].get_g1()) != pk_bytes:
+            raise ValueError(f"Key at derivation index {index} doesn't match the requested public key")
+        signatures.append(bytes(AugSchemeMPL.sign(keys[index], message)))
+    return signatures
+
+
+def verify_signatures(request: SigningRequest, response: SigningResponse) -> bool:
+    """Checks every signature in one aggregate verification."""
+    if len(request.spends) != len(response.signatures):
+        return False
+    public_keys = [target.public_key for spend in request.spends for target in spend.targets]
+    messages = [target.message for spend in request.spends for target in spend.targets]
+    return AugSchemeMPL.aggregate_verify(public_keys, messages, AugSchemeMPL.aggregate(response.signatures))
+
+
+def sign_request(master_sk: PrivateKey, request: SigningRequest, workers: Optional[int] = None) -> SigningResponse:
+    """
+    Signs every message in the request, spread across worker processes, and returns one
+    aggregate signature per spend. Needs nothing but the master private key, so it can run
+    on an offline machine.
+    """
+    targets = [
+        (int(target.derivation_index), bytes(target.public_key), target.message)
+        for spend in request.spends
+        for target in spend.targets
+    ]
+    chunks = [targets[i : i + SIGNING_CHUNK_SIZE] for i in range(0, len(targets), SIGNING_CHUNK_SIZE)]
+    master_sk_bytes = bytes(master_sk)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_sign_chunk, [master_sk_bytes] * len(chunks), chunks)
+        signatures = [G2Element.from_bytes(signature) for chunk in results for signature in chunk]
+
+    spend_signatures: List[G2Element] = []
+    start = 0
+    for spend in request.spends:
+        spend_signatures.append(AugSchemeMPL.aggregate(signatures[start : start + len(spend.targets)]))
+        start += len(spend.targets)
+    response = SigningResponse(spend_signatures)
+    if not verify_signatures(request, response):
+        raise ValueError("Signatures failed the aggregate verification")
+    return response
+
+
+def merge_signatures(request: SigningRequest, response: SigningResponse) -> List[SpendBundle]:
+    """
+    Attaches the signatures from an offline signer to the unsigned spends they were made for.
+    Each spend is checked on its own since the aggregate check can't tell if signatures were
+    swapped between spends.
+    """
+    if len(request.spends) != len(response.signatures):
+        raise ValueError("The signatures are for a different signing request")
+    bundles: List[SpendBundle] = []
+    for spend, signature in zip(request.spends, response.signatures):
+        public_keys = [target.public_key for target in spend.targets]
+        messages = [target.message for target in spend.targets]
+        if not AugSchemeMPL.aggregate_verify(public_keys, messages, signature):
+            raise ValueError(f"Bad signature for the spend of {spend.coin_spends[0].coin.name().hex()}")
+        bundles.append(SpendBundle(spend.coin_spends, signature))
+    return bundles
@@ -1,14 +1,113 @@
 from __future__ import annotations
 
 import sqlite3
-from typing import Dict, List, Optional, Set
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple, Union
 
+import aiosqlite
 from chia.types.blockchain_format.coin import Coin
 from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_record import CoinRecord
+from chia.types.spend_bundle import SpendBundle
 from chia.util.db_wrapper import DBWrapper2
 from chia.util.ints import uint32, uint64
 
-from src.drivers.cb_manager import CBInfo
+from src.drivers.cb_info import SECONDS_PER_BLOCK, SPENT, CBColumns, CBInfo, CompactCBInfo
+from src.drivers.cb_pending_spend import CONFIRMED, PENDING, PendingSpend
+from src.drivers.cb_puzzles import HEIGHT, SECONDS
+
+# Outcome of coins that haven't been spent yet, spent coins are CLAWED_BACK, CLAIMED or just
+# SPENT when it isn't known which path spent them
+UNSPENT = "unspent"
+
+ONE_DAY = 86400
+
+# SQLite integers are signed 64 bit, so amounts are kept as two 32 bit halves that can be summed
+# exactly over billions of coins
+AMOUNT_SPLIT = 32
+AMOUNT_LOW_MASK = (1 << AMOUNT_SPLIT) - 1
+
+SUMMARY_OUTCOME = (
+    "CASE WHEN {row}.spent_height=0 THEN '" + UNSPENT + "' ELSE COALESCE({row}.spent_by, '" + SPENT + "') END"
+)
+SUMMARY_ADD = (
+    "INSERT INTO cb_summary VALUES({row}.fingerprint, {row}.recipient_ph, " + SUMMARY_OUTCOME + ", 1,"
+    " {row}.amount_high, {row}.amount_low) ON CONFLICT(fingerprint, recipient_ph, outcome) DO UPDATE SET"
+    " coins=coins+1, amount_high=amount_high+excluded.amount_high, amount_low=amount_low+excluded.amount_low;"
+)
+SUMMARY_REMOVE = (
+    "UPDATE cb_summary SET coins=coins-1, amount_high=amount_high-{row}.amount_high,"
+    " amount_low=amount_low-{row}.amount_low WHERE fingerprint={row}.fingerprint AND"
+    " recipient_ph={row}.recipient_ph AND outcome=" + SUMMARY_OUTCOME + ";"
+)
+SUMMARY_TRIGGERS = {
+    "cb_summary_insert": "AFTER INSERT ON cb_record BEGIN " + SUMMARY_ADD.format(row="NEW") + " END",
+    "cb_summary_delete": "AFTER DELETE ON cb_record BEGIN " + SUMMARY_REMOVE.format(row="OLD") + " END",
+    "cb_summary_update": (
+        "AFTER UPDATE OF spent_height, spent_by, recipient_ph, fingerprint, amount_high, amount_low"
+        " ON cb_record BEGIN " + SUMMARY_REMOVE.format(row="OLD") + " " + SUMMARY_ADD.format(row="NEW") + " END"
+    ),
+}
+
+
+# An upsert rather than a replace, so the summary triggers see an update and not a new coin. How a
+# coin was spent is kept when the new record doesn't know it
+UPSERT_RECORD = (
+    "INSERT INTO cb_record VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(coin_name) DO UPDATE SET"
+    " confirmed_height=excluded.confirmed_height, spent_height=excluded.spent_height, spent=excluded.spent,"
+    " puzzle_hash=excluded.puzzle_hash, coin_parent=excluded.coin_parent, amount=excluded.amount,"
+    " recipient_ph=excluded.recipient_ph, sender_ph=excluded.sender_ph, timelock=excluded.timelock,"
+    " timestamp=excluded.timestamp, fingerprint=excluded.fingerprint, timelock_unit=excluded.timelock_unit,"
+    " amount_high=excluded.amount_high, amount_low=excluded.amount_low,"
+    " spent_by=COALESCE(excluded.spent_by, cb_record.spent_by)"
+)
+
+
+@dataclass(frozen=True)
+class DBSettings:
+    """How the connections to a clawback database are set up."""
+
+    journal_mode: str = "WAL"
+    # Connections serving reads, in WAL mode they keep answering while the writer holds a transaction
+    reader_count: int = 4
+    # Page cache per connection, in KiB
+    cache_size_kib: int = 64 * 1024
+    # Bytes of the database file each connection maps into memory rather than reading through the cache
+    mmap_size: int = 256 * 1024 * 1024
+    # In WAL mode NORMAL only syncs at checkpoints. A power cut can lose the last commits but can't
+    # corrupt the database, and they can be refreshed from the node again
+    synchronous: str = "NORMAL"
+    # Seconds to wait for a write from another process to finish before giving up
+    busy_timeout: float = 30.0
+
+
+async def connect(database: Union[str, Path], settings: DBSettings) -> aiosqlite.Connection:
+    connection = await aiosqlite.connect(database, timeout=settings.busy_timeout)
+    await (await connection.execute(f"pragma cache_size=-{settings.cache_size_kib}")).close()
+    await (await connection.execute(f"pragma mmap_size={settings.mmap_size}")).close()
+    await (await connection.execute("pragma temp_store=MEMORY")).close()
+    # The setting is per connection, so it's applied to the readers too for when one writes
+    await (await connection.execute(f"pragma synchronous={settings.synchronous}")).close()
+    return connection
+
+
+async def create_db_wrapper(database: Union[str, Path], settings: DBSettings = DBSettings()) -> DBWrapper2:
+    """Opens a clawback database with one writer and a pool of readers set up as settings says."""
+    writer = await connect(database, settings)
+    await (await writer.execute(f"pragma journal_mode={settings.journal_mode}")).close()
+    wrapper = DBWrapper2(writer)
+    for _ in range(settings.reader_count):
+        await wrapper.add_connection(await connect(database, settings))
+    return wrapper
+
+
+def split_amount(amount: int) -> Tuple[int, int]:
+    return amount >> AMOUNT_SPLIT, amount & AMOUNT_LOW_MASK
+
+
+def join_amount(high: Optional[int], low: Optional[int]) -> int:
+    return ((high or 0) << AMOUNT_SPLIT) + (low or 0)
 
 
 class CBStore:
@@ -17,12 +116,18 @@ class CBStore:
     """
 
     db_wrapper: DBWrapper2
+    # When set, clawback coins are read and written for this wallet only
+    fingerprint: Optional[int]
+    # Whether the per recipient totals in cb_summary are kept up to date as coins change
+    summaries: bool
 
     @classmethod
-    async def create(cls, wrapper: DBWrapper2):
+    async def create(cls, wrapper: DBWrapper2, fingerprint: Optional[int] = None, summaries: bool = True):
         self = cls()
 
         self.db_wrapper = wrapper
+        self.fingerprint = fingerprint
+        self.summaries = summaries
 
         async with self.db_wrapper.writer_maybe_transaction() as conn:
             await conn.execute(
@@ -38,9 +143,30 @@ class CBStore:
                     " recipient_ph text,"
                     " sender_ph text,"
                     " timelock bigint,"
-                    " timestamp bigint)"
+                    " timestamp bigint,"
+                    " fingerprint bigint DEFAULT 0,"
+                    " timelock_unit text DEFAULT 'seconds',"
+                    " amount_high bigint DEFAULT 0,"
+                    " amount_low bigint DEFAULT 0,"
+                    " spent_by text)"
                 )
             )
+            # Databases from before several wallets could share one store, coins could be height
+            # locked or amounts could be summed in SQL
+            columns = [row[1] for row in await conn.execute_fetchall("PRAGMA table_info(cb_record)")]
+            if "fingerprint" not in columns:
+                await conn.execute("ALTER TABLE cb_record ADD COLUMN fingerprint bigint DEFAULT 0")
+            if "timelock_unit" not in columns:
+                await conn.execute("ALTER TABLE cb_record ADD COLUMN timelock_unit text DEFAULT 'seconds'")
+            if "amount_high" not in columns:
+                await conn.execute("ALTER TABLE cb_record ADD COLUMN amount_high bigint DEFAULT 0")
+                await conn.execute("ALTER TABLE cb_record ADD COLUMN amount_low bigint DEFAULT 0")
+                await conn.execute("ALTER TABLE cb_record ADD COLUMN spent_by text")
+                rows = await conn.execute_fetchall("SELECT coin_name, amount FROM cb_record")
+                await conn.executemany(
+                    "UPDATE cb_record SET amount_high=?, amount_low=? WHERE coin_name=?",
+                    [split_amount(uint64.from_bytes(row[1])) + (row[0],) for row in rows],
+                )
 
             # Useful for reorg lookups
             await conn.execute("CREATE INDEX IF NOT EXISTS coin_confirmed_height on cb_record(confirmed_height)")
@@ -51,32 +177,213 @@ class CBStore:
 
             await conn.execute("CREATE INDEX IF NOT EXISTS coin_amount on cb_record(amount)")
             await conn.execute("CREATE INDEX IF NOT EXISTS recipients on cb_record(recipient_ph)")
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS coin_fingerprint on cb_record(fingerprint, spent_height, confirmed_height)"
+            )
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS coin_maturity"
+                " on cb_record(spent_height, (timestamp + timelock), fingerprint)"
+            )
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS coin_maturity_height"
+                " on cb_record(spent_height, (confirmed_height + timelock), fingerprint)"
+            )
+            # Covering indexes for the analytics queries, so they never read the records themselves
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS coin_recipient_value"
+                " on cb_record(spent_height, recipient_ph, fingerprint, amount_high, amount_low)"
+            )
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS coin_maturity_value on cb_record(spent_height, timelock_unit,"
+                " (timestamp + timelock), confirmed_height, fingerprint, amount_high, amount_low)"
+            )
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS coin_maturity_height_value on cb_record(spent_height, timelock_unit,"
+                " (confirmed_height + timelock), fingerprint, amount_high, amount_low)"
+            )
+            await self.set_up_summaries(conn)
+
+            # Small coins set aside to pay fees for claws and claims
+            await conn.execute(
+                (
+                    "CREATE TABLE IF NOT EXISTS fee_coin("
+                    "coin_name text PRIMARY KEY,"
+                    " confirmed_height bigint,"
+                    " spent_height bigint,"
+                    " puzzle_hash text,"
+                    " coin_parent text,"
+                    " amount bigint)"
+                )
+            )
+            await conn.execute("CREATE INDEX IF NOT EXISTS fee_coin_amount on fee_coin(spent_height, amount)")
+
+            # Coins locked by a pending spend so concurrent spends don't select them
+            await conn.execute(
+                (
+                    "CREATE TABLE IF NOT EXISTS coin_reservation("
+                    "coin_name text PRIMARY KEY,"
+                    " puzzle_hash text,"
+                    " coin_parent text,"
+                    " amount blob,"
+                    " reserved_for text,"
+                    " expires_at bigint)"
+                )
+            )
+            await conn.execute("CREATE INDEX IF NOT EXISTS reserved_for on coin_reservation(reserved_for)")
+            await conn.execute("CREATE INDEX IF NOT EXISTS reservation_expiry on coin_reservation(expires_at)")
+
+            # Signed spend bundles we've submitted, kept until they confirm so they can be rebroadcast
+            await conn.execute(
+                (
+                    "CREATE TABLE IF NOT EXISTS pending_spend("
+                    "bundle_name text PRIMARY KEY,"
+                    " spend_bundle blob,"
+                    " operation text,"
+                    " fee bigint,"
+                    " submitted_at bigint,"
+                    " last_broadcast_at bigint,"
+                    " broadcast_count int,"
+                    " status text,"
+                    " confirmed_height bigint,"
+                    " confirmed_at bigint)"
+                )
+            )
+            await conn.execute("CREATE INDEX IF NOT EXISTS pending_spend_status on pending_spend(status)")
+            await conn.execute(
+                (
+                    "CREATE TABLE IF NOT EXISTS spend_base("
+                    "bundle_name text PRIMARY KEY,"
+                    " base_spend blob,"
+                    " deadline bigint)"
+                )
+            )
 
         return self
 
+    async def set_up_summaries(self, conn: aiosqlite.Connection) -> None:
+        # Triggers keep coin counts and amounts per wallet, recipient and outcome as records change.
+        # Without them the analytics queries group the records instead, and the table is dropped
+        # so that turning them back on rebuilds it from scratch
+        if not self.summaries:
+            for trigger in SUMMARY_TRIGGERS:
+                await conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            await conn.execute("DROP TABLE IF EXISTS cb_summary")
+            return
+        rows = await conn.execute_fetchall("SELECT name FROM sqlite_master WHERE type='table' AND name='cb_summary'")
+        exists = len(list(rows)) > 0
+        await conn.execute(
+            (
+                "CREATE TABLE IF NOT EXISTS cb_summary("
+                "fingerprint bigint,"
+                " recipient_ph text,"
+                " outcome text,"
+                " coins bigint,"
+                " amount_high bigint,"
+                " amount_low bigint,"
+                " PRIMARY KEY(fingerprint, recipient_ph, outcome))"
+            )
+        )
+        if not exists:
+            await conn.execute(
+                "INSERT INTO cb_summary SELECT fingerprint, recipient_ph, "
+                + SUMMARY_OUTCOME.format(row="cb_record")
+                + ", COUNT(*), SUM(amount_high), SUM(amount_low) FROM cb_record GROUP BY 1, 2, 3"
+            )
+        for trigger, body in SUMMARY_TRIGGERS.items():
+            await conn.execute(f"CREATE TRIGGER IF NOT EXISTS {trigger} {body}")
+
     async def close(self) -> None:
         await self.db_wrapper.close()
 
+    def scoped(self, fingerprint: Optional[int]) -> CBStore:
+        """Returns a view of the same database limited to one wallet's clawback coins."""
+        store = CBStore()
+        store.db_wrapper = self.db_wrapper
+        store.fingerprint = fingerprint
+        store.summaries = self.summaries
+        return store
+
+    def fingerprint_clause(self) -> Tuple[str, Tuple[int, ...]]:
+        if self.fingerprint is None:
+            return "", ()
+        return " AND fingerprint=?", (self.fingerprint,)
+
     async def add_coin_record(self, record: CBInfo, name: Optional[bytes32] = None) -> None:
         if name is None:
             name = record.name()
         assert record.spent == (record.spent_block_height != 0)
         async with self.db_wrapper.writer_maybe_transaction() as conn:
-            await conn.execute_insert(
-                "INSERT OR REPLACE INTO cb_record VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                (
-                    name.hex(),
-                    record.confirmed_block_height,
-                    record.spent_block_height,
-                    int(record.spent),
-                    str(record.coin.puzzle_hash.hex()),
-                    str(record.coin.parent_coin_info.hex()),
-                    bytes(uint64(record.coin.amount)),
-                    str(record.recipient_ph.hex()),
-                    str(record.sender_ph.hex()),
-                    int(record.timelock),
-                    int(record.timestamp),
-                ),
+            await conn.execute_insert(UPSERT_RECORD, self.record_values(name, record, self.fingerprint or 0, None))
+
+    def record_values(
+        self, name: bytes32, record: CBInfo, fingerprint: int, spent_by: Optional[str]
+    ) -> Tuple[Any, ...]:
+        return (
+            (
+                name.hex(),
+                record.confirmed_block_height,
+                record.spent_block_height,
+                int(record.spent),
+                str(record.coin.puzzle_hash.hex()),
+                str(record.coin.parent_coin_info.hex()),
+                bytes(uint64(record.coin.amount)),
+                str(record.recipient_ph.hex()),
+                str(record.sender_ph.hex()),
+                int(record.timelock),
+                int(record.timestamp),
+                fingerprint,
+                record.timelock_unit,
+            )
+            + split_amount(record.coin.amount)
+            + (spent_by,)
+        )
+
+    async def add_coin_records(self, records: List[Tuple[int, CBInfo, Optional[str]]]) -> int:
+        """
+        Stores coins with the wallet each belongs to and how it was spent, in one transaction.
+        Coins already stored are updated rather than added twice. A scoped store puts every coin
+        in its own wallet. Returns how many of the coins are new.
+        """
+        names = [record.name() for _, record, _ in records]
+        async with self.db_wrapper.writer() as conn:
+            existing = await conn.execute_fetchall(
+                f"SELECT COUNT(*) FROM cb_record WHERE coin_name in ({','.join('?' * len(names))})",
+                tuple(name.hex() for name in names),
+            )
+            await conn.executemany(
+                UPSERT_RECORD,
+                [
+                    self.record_values(
+                        name, record, fingerprint if self.fingerprint is None else self.fingerprint, spent_by
+                    )
+                    for name, (fingerprint, record, spent_by) in zip(names, records)
+                ],
+            )
+        return len(set(names)) - list(existing)[0][0]
+
+    async def update_coin_states(self, records: List[CBInfo]) -> None:
+        """Updates the chain state of stored coins without changing the wallet they belong to."""
+        async with self.db_wrapper.writer_maybe_transaction() as conn:
+            await conn.executemany(
+                "UPDATE cb_record SET confirmed_height=?,spent_height=?,spent=?,timestamp=? WHERE coin_name=?",
+                [
+                    (
+                        int(record.confirmed_block_height),
+                        int(record.spent_block_height),
+                        int(record.spent),
+                        int(record.timestamp),
+                        record.name().hex(),
+                    )
+                    for record in records
+                ],
+            )
+
+    async def set_spend_outcomes(self, outcomes: Dict[bytes32, str]) -> None:
+        """Records which path, claw or claim, spent each of the coins."""
+        async with self.db_wrapper.writer_maybe_transaction() as conn:
+            await conn.executemany(
+                "UPDATE cb_record SET spent_by=? WHERE coin_name=?",
+                [(outcome, name.hex()) for name, outcome in outcomes.items()],
             )
 
     async def delete_coin_record(self, coin_name: bytes32) -> None:
@@ -107,12 +414,34 @@ class CBStore:
             uint32(row[2]),
             bool(row[3]),
             uint64(row[10]),
+            row[12],
+        )
+
+    def compact_cb_info_from_row(self, row: sqlite3.Row) -> CompactCBInfo:
+        return CompactCBInfo.from_hex(
+            row[0],
+            row[5],
+            row[4],
+            int.from_bytes(row[6], "big"),
+            row[7],
+            row[8],
+            row[9],
+            row[1],
+            row[2],
+            bool(row[3]),
+            row[10],
+            row[12],
         )
 
     async def get_coin_record(self, coin_name: bytes32) -> Optional[CBInfo]:
         """Returns CBInfo with specified coin id."""
+        clause, params = self.fingerprint_clause()
         async with self.db_wrapper.reader_no_transaction() as conn:
-            rows = list(await conn.execute_fetchall("SELECT * from cb_record WHERE coin_name=?", (coin_name.hex(),)))
+            rows = list(
+                await conn.execute_fetchall(
+                    f"SELECT * from cb_record WHERE coin_name=?{clause}", (coin_name.hex(),) + params
+                )
+            )
 
         if len(rows) == 0:
             return None
@@ -126,13 +455,14 @@ class CBStore:
         end_height: uint32 = uint32((2 ** 32) - 1),
     ) -> List[Optional[CBInfo]]:
         """Returns CBInfo with specified coin id."""
+        clause, params = self.fingerprint_clause()
         async with self.db_wrapper.reader_no_transaction() as conn:
             rows = list(
                 await conn.execute_fetchall(
                     f"SELECT * from cb_record WHERE coin_name in ({','.join('?'*len(coin_names))}) "
                     f"AND confirmed_height>=? AND confirmed_height<? "
-                    f"{'' if include_spent_coins else 'AND spent=0'}",
-                    tuple([c.hex() for c in coin_names]) + (start_height, end_height),
+                    f"{'' if include_spent_coins else 'AND spent=0'}{clause}",
+                    tuple([c.hex() for c in coin_names]) + (start_height, end_height) + params,
                 )
             )
 
@@ -146,6 +476,384 @@ class CBStore:
 
     async def get_all_unspent_coins(self) -> Set[CBInfo]:
         """Returns set of cb coins that have not been spent yet."""
+        clause, params = self.fingerprint_clause()
         async with self.db_wrapper.reader_no_transaction() as conn:
-            rows = await conn.execute_fetchall("SELECT * FROM cb_record WHERE spent_height=0")
+            rows = await conn.execute_fetchall(f"SELECT * FROM cb_record WHERE spent_height=0{clause}", params)
         return set(self.cb_info_from_row(row) for row in rows)
+
+    async def get_all_unspent_compact_coins(self) -> List[CompactCBInfo]:
+        """Returns the cb coins that have not been spent yet without decoding their hashes."""
+        clause, params = self.fingerprint_clause()
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            rows = await conn.execute_fetchall(f"SELECT * FROM cb_record WHERE spent_height=0{clause}", params)
+        return [self.compact_cb_info_from_row(row) for row in rows]
+
+    async def get_unspent_columns(self) -> CBColumns:
+        """Returns the amounts and timelocks of the cb coins that have not been spent yet as parallel arrays."""
+        clause, params = self.fingerprint_clause()
+        columns = CBColumns.create()
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            rows = await conn.execute_fetchall(
+                "SELECT coin_name, amount_high, amount_low, confirmed_height, timestamp, timelock, timelock_unit"
+                f" FROM cb_record WHERE spent_height=0{clause}",
+                params,
+            )
+        for row in rows:
+            columns.append(row[0], join_amount(row[1], row[2]), row[3], row[4], row[5], row[6])
+        return columns
+
+    async def get_coins_maturing(
+        self, start: uint64, end: uint64, start_height: uint32, end_height: uint32
+    ) -> List[Tuple[int, CBInfo]]:
+        """
+        Returns the unspent cb coins whose timelock expires between start and end, or for height
+        locked coins between start_height and end_height, with the fingerprint of the wallet
+        each belongs to, soonest first.
+        """
+        clause, params = self.fingerprint_clause()
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            rows = await conn.execute_fetchall(
+                "SELECT * FROM cb_record WHERE spent_height=0 AND confirmed_height>0 AND ("
+                "(timelock_unit='seconds' AND (timestamp + timelock)>=? AND (timestamp + timelock)<?) OR "
+                "(timelock_unit='height' AND (confirmed_height + timelock)>=? AND (confirmed_height + timelock)<?)"
+                f"){clause}",
+                (int(start), int(end), int(start_height), int(end_height)) + params,
+            )
+        maturing = [(row[11], self.cb_info_from_row(row)) for row in rows]
+        return sorted(maturing, key=lambda item: item[1].estimated_maturity(int(start), int(start_height)))
+
+    async def get_coin_record_batches(
+        self, since_height: uint32 = uint32(0), batch_size: int = 1000
+    ) -> AsyncIterator[List[Tuple[int, CBInfo, Optional[str]]]]:
+        """
+        Yields the stored coins in batches, with the wallet each belongs to and how it was spent.
+        With since_height only coins confirmed or spent at or after that height are included.
+        Each batch is a separate query that picks up after the last coin name of the one before,
+        so memory use doesn't grow with the store.
+        """
+        clause, params = self.fingerprint_clause()
+        last_name = ""
+        while True:
+            async with self.db_wrapper.reader_no_transaction() as conn:
+                rows = list(
+                    await conn.execute_fetchall(
+                        "SELECT * FROM cb_record WHERE coin_name>? AND (confirmed_height>=? OR spent_height>=?)"
+                        f"{clause} ORDER BY coin_name LIMIT ?",
+                        (last_name, int(since_height), int(since_height)) + params + (batch_size,),
+                    )
+                )
+            if len(rows) == 0:
+                return
+            yield [(row[11], self.cb_info_from_row(row), row[15]) for row in rows]
+            if len(rows) < batch_size:
+                return
+            last_name = rows[-1][0]
+
+    async def get_fingerprints(self) -> List[int]:
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            rows = await conn.execute_fetchall("SELECT DISTINCT fingerprint FROM cb_record ORDER BY fingerprint")
+        return [row[0] for row in rows]
+
+    async def get_value_locked(self, limit: Optional[int] = None) -> List[Tuple[bytes32, int, int]]:
+        """
+        Returns the number of unspent cb coins and the mojos locked in them for each recipient,
+        most value first.
+        """
+        clause, params = self.fingerprint_clause()
+        if self.summaries:
+            query = (
+                "SELECT recipient_ph, SUM(coins), SUM(amount_high), SUM(amount_low) FROM cb_summary"
+                f" WHERE outcome=?{clause} GROUP BY recipient_ph HAVING SUM(coins)>0"
+            )
+            params = (UNSPENT,) + params
+        else:
+            query = (
+                "SELECT recipient_ph, COUNT(*), SUM(amount_high), SUM(amount_low) FROM cb_record"
+                f" WHERE spent_height=0{clause} GROUP BY recipient_ph"
+            )
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            rows = await conn.execute_fetchall(query, params)
+        locked = sorted(
+            [(bytes32.fromhex(row[0]), row[1], join_amount(row[2], row[3])) for row in rows],
+            key=lambda item: (-item[2], item[0]),
+        )
+        return locked if limit is None else locked[:limit]
+
+    async def get_spend_outcomes(self) -> Dict[str, Tuple[int, int]]:
+        """
+        Returns the number of cb coins and their total value by outcome: unspent, clawed back by
+        the sender, claimed by the recipient, or spent by a path that hasn't been looked up.
+        """
+        clause, params = self.fingerprint_clause()
+        if self.summaries:
+            query = (
+                "SELECT outcome, SUM(coins), SUM(amount_high), SUM(amount_low) FROM cb_summary"
+                f" WHERE 1{clause} GROUP BY outcome"
+            )
+        else:
+            query = (
+                f"SELECT {SUMMARY_OUTCOME.format(row='cb_record')}, COUNT(*), SUM(amount_high), SUM(amount_low)"
+                f" FROM cb_record WHERE 1{clause} GROUP BY 1"
+            )
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            rows = await conn.execute_fetchall(query, params)
+        return {row[0]: (row[1], join_amount(row[2], row[3])) for row in rows if row[1] > 0}
+
+    async def get_value_maturing_by_day(
+        self, now: uint64, peak_height: uint32, days: int
+    ) -> List[Tuple[uint64, int, int]]:
+        """
+        Returns the number of unspent cb coins and the mojos in them that become claimable on
+        each UTC day from now on, for the given number of days. Height locked coins are placed
+        on the day their height is expected to be reached.
+        """
+        clause, params = self.fingerprint_clause()
+        end = int(now) + days * ONE_DAY
+        # Blocks past the peak are turned into an estimated time, mirroring CBInfo.estimated_maturity
+        estimate = f"CAST(? + MAX((confirmed_height + timelock) - (? + 1), 0) * {SECONDS_PER_BLOCK} AS INTEGER)"
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            rows = list(
+                await conn.execute_fetchall(
+                    f"SELECT (timestamp + timelock) / {ONE_DAY}, COUNT(*), SUM(amount_high), SUM(amount_low)"
+                    " FROM cb_record WHERE spent_height=0 AND timelock_unit=? AND (timestamp + timelock)>=?"
+                    f" AND (timestamp + timelock)<? AND confirmed_height>0{clause} GROUP BY 1",
+                    (SECONDS, int(now), end) + params,
+                )
+            )
+            rows += await conn.execute_fetchall(
+                f"SELECT {estimate} / {ONE_DAY} AS day, COUNT(*), SUM(amount_high), SUM(amount_low)"
+                " FROM cb_record WHERE spent_height=0 AND timelock_unit=? AND (confirmed_height + timelock)>?"
+                f" AND confirmed_height>0{clause} GROUP BY 1 HAVING day<?",
+                (int(now), int(peak_height), HEIGHT, int(peak_height)) + params + (end // ONE_DAY,),
+            )
+        by_day: Dict[int, Tuple[int, int]] = {}
+        for row in rows:
+            coins, amount = by_day.get(row[0], (0, 0))
+            by_day[row[0]] = (coins + row[1], amount + join_amount(row[2], row[3]))
+        return [(uint64(day * ONE_DAY), coins, amount) for day, (coins, amount) in sorted(by_day.items())]
+
+    async def add_fee_coin_record(self, record: CoinRecord) -> None:
+        async with self.db_wrapper.writer_maybe_transaction() as conn:
+            await conn.execute_insert(
+                "INSERT OR REPLACE INTO fee_coin VALUES(?, ?, ?, ?, ?, ?)",
+                (
+                    record.name.hex(),
+                    record.confirmed_block_index,
+                    record.spent_block_index,
+                    str(record.coin.puzzle_hash.hex()),
+                    str(record.coin.parent_coin_info.hex()),
+                    int(record.coin.amount),
+                ),
+            )
+
+    async def delete_fee_coins(self, coin_names: List[bytes32]) -> None:
+        async with self.db_wrapper.writer_maybe_transaction() as conn:
+            await conn.executemany("DELETE FROM fee_coin WHERE coin_name=?", [(name.hex(),) for name in coin_names])
+
+    def fee_coin_record_from_row(self, row: sqlite3.Row) -> CoinRecord:
+        coin = Coin(bytes32.fromhex(row[4]), bytes32.fromhex(row[3]), uint64(row[5]))
+        return CoinRecord(coin, uint32(row[1]), uint32(row[2]), False, uint64(0))
+
+    async def get_fee_coin_records(self) -> List[CoinRecord]:
+        """Returns the unspent coins in the fee coin pool, smallest first."""
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            rows = await conn.execute_fetchall("SELECT * FROM fee_coin WHERE spent_height=0 ORDER BY amount")
+        return [self.fee_coin_record_from_row(row) for row in rows]
+
+    async def reserve_fee_coin(
+        self, min_amount: uint64, reserved_for: bytes32, now: uint64, expires_at: uint64
+    ) -> Optional[Coin]:
+        """Reserves the smallest confirmed, unreserved fee coin worth at least min_amount."""
+        async with self.db_wrapper.writer() as conn:
+            await conn.execute("DELETE FROM coin_reservation WHERE expires_at<=?", (now,))
+            rows = list(
+                await conn.execute_fetchall(
+                    "SELECT * FROM fee_coin WHERE spent_height=0 AND confirmed_height>0 AND amount>=? "
+                    "AND coin_name NOT IN (SELECT coin_name FROM coin_reservation) ORDER BY amount LIMIT 1",
+                    (int(min_amount),),
+                )
+            )
+            if len(rows) == 0:
+                return None
+            coin = self.fee_coin_record_from_row(rows[0]).coin
+            await self.reserve_coins([coin], reserved_for, now, expires_at)
+        return coin
+
+    async def reserve_coins(self, coins: List[Coin], reserved_for: bytes32, now: uint64, expires_at: uint64) -> bool:
+        """
+        Reserves all of the coins for reserved_for until expires_at. Returns False and reserves
+        nothing if any of them is already reserved by someone else.
+        """
+        async with self.db_wrapper.writer() as conn:
+            await conn.execute("DELETE FROM coin_reservation WHERE expires_at<=?", (now,))
+            names = [coin.name().hex() for coin in coins]
+            rows = list(
+                await conn.execute_fetchall(
+                    f"SELECT coin_name FROM coin_reservation WHERE coin_name in ({','.join('?'*len(names))}) "
+                    "AND reserved_for!=?",
+                    tuple(names) + (reserved_for.hex(),),
+                )
+            )
+            if len(rows) > 0:
+                return False
+            await conn.executemany(
+                "INSERT OR REPLACE INTO coin_reservation VALUES(?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        coin.name().hex(),
+                        str(coin.puzzle_hash.hex()),
+                        str(coin.parent_coin_info.hex()),
+                        bytes(uint64(coin.amount)),
+                        reserved_for.hex(),
+                        int(expires_at),
+                    )
+                    for coin in coins
+                ],
+            )
+        return True
+
+    async def release_reservation(self, reserved_for: bytes32) -> None:
+        async with self.db_wrapper.writer_maybe_transaction() as conn:
+            await (
+                await conn.execute("DELETE FROM coin_reservation WHERE reserved_for=?", (reserved_for.hex(),))
+            ).close()
+
+    async def reassign_reservation(self, reserved_for: bytes32, new_reserved_for: bytes32) -> None:
+        async with self.db_wrapper.writer_maybe_transaction() as conn:
+            await conn.execute_insert(
+                "UPDATE coin_reservation SET reserved_for=? WHERE reserved_for=?",
+                (new_reserved_for.hex(), reserved_for.hex()),
+            )
+
+    async def release_coins(self, coin_names: List[bytes32]) -> None:
+        async with self.db_wrapper.writer_maybe_transaction() as conn:
+            await conn.executemany(
+                "DELETE FROM coin_reservation WHERE coin_name=?", [(name.hex(),) for name in coin_names]
+            )
+
+    async def get_reserved_coins(self, now: uint64) -> List[Coin]:
+        """Returns the coins with a reservation that has not expired yet."""
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            rows = await conn.execute_fetchall(
+                "SELECT coin_parent, puzzle_hash, amount FROM coin_reservation WHERE expires_at>?", (now,)
+            )
+        return [Coin(bytes32.fromhex(row[0]), bytes32.fromhex(row[1]), uint64.from_bytes(row[2])) for row in rows]
+
+    async def get_reservations(self, now: uint64) -> Dict[bytes32, List[bytes32]]:
+        """Returns the unexpired reservations as a map of reserved_for to the reserved coin names."""
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            rows = await conn.execute_fetchall(
+                "SELECT reserved_for, coin_name FROM coin_reservation WHERE expires_at>?", (now,)
+            )
+        reservations: Dict[bytes32, List[bytes32]] = {}
+        for row in rows:
+            reservations.setdefault(bytes32.fromhex(row[0]), []).append(bytes32.fromhex(row[1]))
+        return reservations
+
+    async def add_pending_spend(self, record: PendingSpend) -> None:
+        async with self.db_wrapper.writer_maybe_transaction() as conn:
+            await conn.execute_insert(
+                "INSERT OR REPLACE INTO pending_spend VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    record.name().hex(),
+                    bytes(record.spend_bundle),
+                    record.operation,
+                    int(record.fee),
+                    int(record.submitted_at),
+                    int(record.last_broadcast_at),
+                    int(record.broadcast_count),
+                    record.status,
+                    int(record.confirmed_height),
+                    int(record.confirmed_at),
+                ),
+            )
+
+    def pending_spend_from_row(self, row: sqlite3.Row) -> PendingSpend:
+        return PendingSpend(
+            SpendBundle.from_bytes(row[1]),
+            row[2],
+            uint64(row[3]),
+            uint64(row[4]),
+            uint64(row[5]),
+            uint32(row[6]),
+            row[7],
+            uint32(row[8]),
+            uint64(row[9]),
+        )
+
+    async def get_pending_spend(self, bundle_name: bytes32) -> Optional[PendingSpend]:
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            rows = list(
+                await conn.execute_fetchall("SELECT * FROM pending_spend WHERE bundle_name=?", (bundle_name.hex(),))
+            )
+        if len(rows) == 0:
+            return None
+        return self.pending_spend_from_row(rows[0])
+
+    async def get_pending_spends(self, status: str = PENDING) -> List[PendingSpend]:
+        """Returns the tracked spends in the given state, oldest first."""
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            rows = await conn.execute_fetchall(
+                "SELECT * FROM pending_spend WHERE status=? ORDER BY submitted_at", (status,)
+            )
+        return [self.pending_spend_from_row(row) for row in rows]
+
+    async def set_pending_spend_status(
+        self,
+        bundle_name: bytes32,
+        status: str,
+        confirmed_height: uint32 = uint32(0),
+        confirmed_at: uint64 = uint64(0),
+    ) -> None:
+        async with self.db_wrapper.writer_maybe_transaction() as conn:
+            await conn.execute_insert(
+                "UPDATE pending_spend SET status=?,confirmed_height=?,confirmed_at=? WHERE bundle_name=?",
+                (status, int(confirmed_height), int(confirmed_at), bundle_name.hex()),
+            )
+
+    async def record_broadcast(self, bundle_name: bytes32, broadcast_at: uint64) -> None:
+        async with self.db_wrapper.writer_maybe_transaction() as conn:
+            await conn.execute_insert(
+                "UPDATE pending_spend SET last_broadcast_at=?,broadcast_count=broadcast_count+1 WHERE bundle_name=?",
+                (int(broadcast_at), bundle_name.hex()),
+            )
+
+    async def add_spend_base(self, bundle_name: bytes32, base_spend: SpendBundle, deadline: uint64) -> None:
+        """
+        Stores the signed spend a tracked bundle was built from, without its fee spend, so its
+        fee can be bumped without signing it again. A deadline of 0 means the spend has none.
+        """
+        async with self.db_wrapper.writer_maybe_transaction() as conn:
+            await conn.execute_insert(
+                "INSERT OR REPLACE INTO spend_base VALUES(?, ?, ?)",
+                (bundle_name.hex(), bytes(base_spend), int(deadline)),
+            )
+
+    async def get_spend_base(self, bundle_name: bytes32) -> Optional[Tuple[SpendBundle, uint64]]:
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            rows = list(
+                await conn.execute_fetchall(
+                    "SELECT base_spend, deadline FROM spend_base WHERE bundle_name=?", (bundle_name.hex(),)
+                )
+            )
+        if len(rows) == 0:
+            return None
+        return SpendBundle.from_bytes(rows[0][0]), uint64(rows[0][1])
+
+    async def get_pending_spends_due(self, deadline: uint64) -> List[PendingSpend]:
+        """Returns the pending spends that must confirm before the given time, soonest first."""
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            rows = await conn.execute_fetchall(
+                "SELECT pending_spend.* FROM pending_spend JOIN spend_base USING(bundle_name) "
+                "WHERE status=? AND deadline>0 AND deadline<=? ORDER BY deadline",
+                (PENDING, int(deadline)),
+            )
+        return [self.pending_spend_from_row(row) for row in rows]
+
+    async def get_confirmation_latencies(self) -> List[uint64]:
+        """Returns the seconds from submission to confirmation of every confirmed spend."""
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            rows = await conn.execute_fetchall(
+                "SELECT MAX(confirmed_at - submitted_at, 0) FROM pending_spend WHERE status=?", (CONFIRMED,)
+            )
+        return [uint64(row[0]) for row in rows]
@@ -0,0 +1,162 @@
+import logging
+import time
+from typing import Dict, List, Optional, Set
+
+from chia.rpc.full_node_rpc_client import FullNodeRpcClient
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_record import CoinRecord
+from chia.types.spend_bundle import SpendBundle
+from chia.util.ints import uint32, uint64
+
+from src.drivers.cb_pending_spend import CONFIRMED, FAILED, PENDING, REPLACED, PendingSpend
+from src.drivers.cb_reservations import CoinReservations
+from src.drivers.cb_store import CBStore
+
+log = logging.getLogger(__name__)
+
+# Minimum seconds between rebroadcasts of a spend that has dropped out of the mempool
+REBROADCAST_INTERVAL = 60
+
+
+def percentile(values: List[uint64], fraction: float) -> uint64:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class PendingSpendTracker:
+    """
+    Keeps the signed spend bundles we've submitted until the chain confirms them, so a spend
+    that drops out of the mempool can be rebroadcast as-is instead of rebuilt and re-signed.
+    """
+
+    node_client: FullNodeRpcClient
+    cb_store: CBStore
+    reservations: CoinReservations
+
+    @classmethod
+    async def create(cls, node_client: FullNodeRpcClient, cb_store: CBStore, reservations: CoinReservations):
+        self = cls()
+        self.node_client = node_client
+        self.cb_store = cb_store
+        self.reservations = reservations
+        return self
+
+    async def add(
+        self,
+        spend_bundle: SpendBundle,
+        operation: str,
+        fee: uint64 = uint64(0),
+        base_spend: Optional[SpendBundle] = None,
+        deadline: uint64 = uint64(0),
+    ) -> PendingSpend:
+        """
+        Starts tracking a submitted spend. Passing the signed spend it was built from, before
+        its fee spend was attached, lets the fee be bumped later.
+        """
+        now = uint64(int(time.time()))
+        pending = PendingSpend(spend_bundle, operation, fee, now, now, uint32(1), PENDING, uint32(0), uint64(0))
+        async with self.cb_store.db_wrapper.writer():
+            await self.cb_store.add_pending_spend(pending)
+            if base_spend is not None:
+                await self.cb_store.add_spend_base(pending.name(), base_spend, deadline)
+        return pending
+
+    async def replace(
+        self, pending: PendingSpend, spend_bundle: SpendBundle, fee: uint64, base_spend: SpendBundle, deadline: uint64
+    ) -> PendingSpend:
+        """
+        Tracks a fee bumped spend in place of the pending spend it replaces in the mempool. The
+        replacement keeps the original submission time and takes over its coin reservations.
+        """
+        now = uint64(int(time.time()))
+        replacement = PendingSpend(
+            spend_bundle, pending.operation, fee, pending.submitted_at, now, uint32(1), PENDING, uint32(0), uint64(0)
+        )
+        async with self.cb_store.db_wrapper.writer():
+            await self.cb_store.set_pending_spend_status(pending.name(), REPLACED)
+            await self.cb_store.add_pending_spend(replacement)
+            await self.cb_store.add_spend_base(replacement.name(), base_spend, deadline)
+            await self.reservations.reassign(pending.name(), replacement.name())
+        return replacement
+
+    async def check(self, rebroadcast: bool = True) -> List[PendingSpend]:
+        """
+        Looks up the coins of every pending spend in one call. Spends whose own additions are on
+        chain are confirmed, spends whose coins were spent by something else have failed, and
+        the rest are rebroadcast if they've dropped out of the mempool. Returns the spends
+        that are still pending.
+        """
+        pending_spends = await self.cb_store.get_pending_spends(PENDING)
+        if len(pending_spends) == 0:
+            return []
+        names: Set[bytes32] = set(name for pending in pending_spends for name in pending.coin_ids())
+        names.update(addition_id for addition_id in map(PendingSpend.addition_id, pending_spends) if addition_id)
+        coin_records = await self.node_client.get_coin_records_by_names(list(names), include_spent_coins=True)
+        records_by_name: Dict[bytes32, CoinRecord] = {record.name: record for record in coin_records}
+
+        confirmed: Dict[bytes32, uint32] = {}
+        failed: List[bytes32] = []
+        still_pending: List[PendingSpend] = []
+        for pending in pending_spends:
+            coin_ids = pending.coin_ids()
+            spent = [
+                records_by_name[name] for name in coin_ids if name in records_by_name and records_by_name[name].spent
+            ]
+            addition_id = pending.addition_id()
+            if addition_id is not None and addition_id in records_by_name:
+                confirmed[pending.name()] = records_by_name[addition_id].confirmed_block_index
+            elif addition_id is None and len(spent) == len(coin_ids):
+                confirmed[pending.name()] = max(record.spent_block_index for record in spent)
+            elif len(spent) > 0:
+                log.warning(f"Spend {pending.name().hex()} lost its coins to a conflicting spend")
+                failed.append(pending.name())
+            else:
+                still_pending.append(pending)
+
+        timestamps: Dict[uint32, uint64] = {}
+        for height in set(confirmed.values()):
+            timestamps[height] = await self.get_timestamp(height)
+        async with self.cb_store.db_wrapper.writer():
+            for name, height in confirmed.items():
+                await self.cb_store.set_pending_spend_status(name, CONFIRMED, height, timestamps[height])
+                await self.reservations.release(name)
+            for name in failed:
+                await self.cb_store.set_pending_spend_status(name, FAILED)
+                await self.reservations.release(name)
+
+        if rebroadcast and len(still_pending) > 0:
+            in_mempool = set(await self.node_client.get_all_mempool_tx_ids())
+            now = uint64(int(time.time()))
+            for pending in still_pending:
+                if pending.name() in in_mempool or now - pending.last_broadcast_at < REBROADCAST_INTERVAL:
+                    continue
+                await self.rebroadcast(pending)
+        return still_pending
+
+    async def get_timestamp(self, height: uint32) -> uint64:
+        block = await self.node_client.get_block_record_by_height(height)
+        if block is None or block.timestamp is None:
+            return uint64(int(time.time()))
+        return uint64(block.timestamp)
+
+    async def rebroadcast(self, pending: PendingSpend) -> bool:
+        """Resubmits the stored, already signed, spend bundle."""
+        try:
+            await self.node_client.push_tx(pending.spend_bundle)
+        except ValueError as e:
+            log.warning(f"Failed to rebroadcast {pending.name().hex()}: {e}")
+            return False
+        await self.cb_store.record_broadcast(pending.name(), uint64(int(time.time())))
+        return True
+
+    async def get_latency_summary(self) -> Dict[str, int]:
+        """Summarises the seconds from submission to confirmation across confirmed spends."""
+        latencies = await self.cb_store.get_confirmation_latencies()
+        if len(latencies) == 0:
+            return {"confirmed": 0}
+        return {
+            "confirmed": len(latencies),
+            "p50": percentile(latencies, 0.5),
+            "p90": percentile(latencies, 0.9),
+            "max": max(latencies),
+        }
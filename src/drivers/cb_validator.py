@@ -0,0 +1,176 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from blspy import AugSchemeMPL, G1Element
+from chia.consensus.block_record import BlockRecord
+from chia.full_node.bundle_tools import simple_solution_generator
+from chia.full_node.mempool_check_conditions import get_name_puzzle_conditions, mempool_check_time_locks
+from chia.rpc.full_node_rpc_client import FullNodeRpcClient
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_record import CoinRecord
+from chia.types.spend_bundle import SpendBundle
+from chia.util.condition_tools import pkm_pairs
+from chia.util.errors import ConsensusError, Err
+from chia.util.ints import uint32, uint64
+
+from src.drivers.cb_costs import MAX_BLOCK_COST, MAX_SPEND_BUNDLE_COST
+from src.drivers.cb_signing import get_additional_data
+
+# Batches of at least this many bundles are validated across worker processes
+MIN_POOL_BUNDLES = 8
+
+
+@dataclass(frozen=True)
+class ValidationResult:
+    name: bytes32
+    cost: uint64
+    # The name of the Err the node would reject the bundle with, None if it would accept it
+    error: Optional[str]
+
+
+def _validate(
+    bundle_bytes: bytes,
+    record_bytes: List[bytes],
+    peak_height: int,
+    height: int,
+    timestamp: int,
+    additional_data: bytes,
+) -> Tuple[int, Optional[str]]:
+    # Runs in a worker process for large batches, so it takes and returns plain values
+    spend_bundle = SpendBundle.from_bytes(bundle_bytes)
+    # The conditions allowed depend on the soft forks active at the peak, as in the mempool
+    npc_result = get_name_puzzle_conditions(
+        simple_solution_generator(spend_bundle),
+        MAX_BLOCK_COST,
+        mempool_mode=True,
+        height=uint32(peak_height),
+    )
+    if npc_result.error is not None:
+        return npc_result.cost, Err(npc_result.error).name
+    conds = npc_result.conds
+    assert conds is not None
+    if npc_result.cost > MAX_SPEND_BUNDLE_COST:
+        return npc_result.cost, Err.BLOCK_COST_EXCEEDS_MAX.name
+    if conds.removal_amount < conds.addition_amount:
+        return npc_result.cost, Err.MINTING_COIN.name
+    if conds.reserve_fee > conds.removal_amount - conds.addition_amount:
+        return npc_result.cost, Err.RESERVE_FEE_CONDITION_FAILED.name
+
+    records = {record.name: record for record in map(CoinRecord.from_bytes, record_bytes)}
+    # Coins created and spent in the same bundle count as confirmed in the next block
+    additions = {coin.name(): coin for coin in spend_bundle.additions()}
+    for coin in spend_bundle.removals():
+        if coin.name() in additions:
+            records[coin.name()] = CoinRecord(coin, uint32(height + 1), uint32(0), False, uint64(timestamp))
+        elif coin.name() not in records:
+            return npc_result.cost, Err.UNKNOWN_UNSPENT.name
+        elif records[coin.name()].spent:
+            return npc_result.cost, Err.DOUBLE_SPEND.name
+    error = mempool_check_time_locks(records, conds, uint32(height), uint64(timestamp))
+    if error is not None:
+        return npc_result.cost, error.name
+
+    try:
+        public_keys, messages = pkm_pairs(conds, additional_data, soft_fork=True)
+    except ConsensusError as e:
+        return npc_result.cost, e.code.name
+    if not AugSchemeMPL.aggregate_verify(
+        [G1Element.from_bytes(public_key) for public_key in public_keys], messages, spend_bundle.aggregated_signature
+    ):
+        return npc_result.cost, Err.BAD_AGGREGATE_SIGNATURE.name
+    return npc_result.cost, None
+
+
+class BundleValidator:
+    """
+    Checks spend bundles the way the mempool would before they're pushed, so a bundle that is
+    bound to fail costs no round trip to the node. Each bundle's puzzles are run, its cost and
+    amounts checked, its coins and timelocks checked against the last transaction block and
+    its aggregate signature verified. The node_client should not cache, coin records and the
+    peak have to be current for the checks to mean anything.
+    """
+
+    node_client: FullNodeRpcClient
+    additional_data: Optional[bytes]
+    workers: Optional[int]
+    # Started on the first large batch and kept until close
+    executor: Optional[ProcessPoolExecutor]
+
+    @classmethod
+    async def create(cls, node_client: FullNodeRpcClient, workers: Optional[int] = None):
+        self = cls()
+        self.node_client = node_client
+        # Read from the config on first use, only spends that are validated need it
+        self.additional_data = None
+        self.workers = workers
+        self.executor = None
+        return self
+
+    async def get_chain_state(self) -> Tuple[uint32, uint32, uint64]:
+        """
+        Returns the peak height, which decides the conditions allowed, and the height and
+        timestamp of the last transaction block, which timelocks are checked against.
+        """
+        block: Optional[BlockRecord] = (await self.node_client.get_blockchain_state())["peak"]
+        if block is None:
+            return uint32(0), uint32(0), uint64(0)
+        peak_height = block.height
+        while not block.is_transaction_block:
+            block = await self.node_client.get_block_record(block.prev_hash)
+            assert block is not None
+        assert block.timestamp is not None
+        return peak_height, block.height, block.timestamp
+
+    async def validate(self, spend_bundles: List[SpendBundle]) -> List[ValidationResult]:
+        """
+        Validates the bundles, across worker processes once there are MIN_POOL_BUNDLES or more.
+        The coins they spend are looked up in one batch.
+        """
+        if len(spend_bundles) == 0:
+            return []
+        if self.additional_data is None:
+            self.additional_data = get_additional_data()
+        names = list({coin.name() for spend_bundle in spend_bundles for coin in spend_bundle.removals()})
+        (peak_height, height, timestamp), coin_records = await asyncio.gather(
+            self.get_chain_state(),
+            self.node_client.get_coin_records_by_names(names, include_spent_coins=True),
+        )
+        by_name = {coin_record.name: coin_record for coin_record in coin_records}
+        arguments = [
+            (
+                bytes(spend_bundle),
+                [bytes(by_name[coin.name()]) for coin in spend_bundle.removals() if coin.name() in by_name],
+                peak_height,
+                height,
+                timestamp,
+                self.additional_data,
+            )
+            for spend_bundle in spend_bundles
+        ]
+        if len(spend_bundles) < MIN_POOL_BUNDLES:
+            results = [_validate(*args) for args in arguments]
+        else:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            loop = asyncio.get_running_loop()
+            executor: Executor = self.executor
+            results = await asyncio.gather(*(loop.run_in_executor(executor, _validate, *args) for args in arguments))
+        return [
+            ValidationResult(spend_bundle.name(), uint64(cost), error)
+            for spend_bundle, (cost, error) in zip(spend_bundles, results)
+        ]
+
+    async def check(self, spend_bundle: SpendBundle) -> uint64:
+        """Returns the bundle's cost, or raises ValueError naming the error the node would reject it with."""
+        result = (await self.validate([spend_bundle]))[0]
+        if result.error is not None:
+            raise ValueError(f"Spend bundle {result.name.hex()} failed validation: {result.error}")
+        return result.cost
+
+    def close(self) -> None:
+        """Stops the worker processes, if a batch was large enough to start them."""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
@@ -0,0 +1,183 @@
+import asyncio
+import dataclasses
+import logging
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from chia.consensus.block_record import BlockRecord
+from chia.rpc.full_node_rpc_client import FullNodeRpcClient
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_record import CoinRecord
+from chia.util.ints import uint32
+
+from src.drivers.cb_info import CBInfo
+from src.drivers.cb_manager import MAX_CONCURRENT_LOOKUPS, CBManager
+from src.drivers.cb_puzzles import SECONDS
+
+log = logging.getLogger(__name__)
+
+# Seconds between checks for a new peak
+WATCH_INTERVAL = 10
+
+# Falling further behind than this refreshes every unspent coin instead of walking the blocks
+MAX_CATCH_UP_BLOCKS = 100
+
+# After a reorg, coins confirmed or spent this close to the old peak are refreshed as well
+REORG_DEPTH = 32
+
+
+class CBWatcher:
+    """
+    Keeps the store in step with the chain one peak at a time. The additions and removals of
+    each new transaction block are matched against the coins the store tracks, so the node is
+    asked about new blocks and the coins that changed instead of every unspent coin on each pass.
+    Coins the store doesn't hold yet aren't in the match. With discover, the coins hinted to the
+    manager's wallets since the last peak are looked up and added as well, which costs a lookup
+    per wallet puzzle hash on each new peak.
+    """
+
+    # Uncached, every peak check has to reach the node
+    node_client: FullNodeRpcClient
+    manager: CBManager
+    discover: bool
+    # The last block whose changes were applied, None until the first full refresh
+    peak: Optional[BlockRecord]
+
+    @classmethod
+    async def create(cls, node_client: FullNodeRpcClient, manager: CBManager, discover: bool = False):
+        self = cls()
+        self.node_client = node_client
+        self.manager = manager
+        self.discover = discover
+        self.peak = None
+        return self
+
+    async def get_peak(self) -> Optional[BlockRecord]:
+        return (await self.node_client.get_blockchain_state())["peak"]
+
+    async def sync(self, peak: BlockRecord, since_height: Optional[uint32] = None) -> List[CBInfo]:
+        """
+        Refreshes every unspent coin, and with since_height every coin confirmed or spent from
+        that height on, then follows the chain from the given peak. Returns the coins that changed.
+        """
+        records = {record.name(): record for record in await self.manager.cb_store.get_all_unspent_coins()}
+        if since_height is not None:
+            async for batch in self.manager.cb_store.get_coin_record_batches(since_height):
+                records.update((record.name(), record) for _, record, _ in batch)
+        changed: List[CBInfo] = []
+        async for batch in self.manager.refresh_records(list(records.values())):
+            changed.extend(record for record in batch if record != records[record.name()])
+        if self.discover:
+            # Catching up looks from the last peak on, the first sync over the whole chain as discover does
+            start_height = since_height
+            if start_height is None and self.peak is not None:
+                start_height = uint32(self.peak.height + 1)
+            changed.extend(await self.discover_coins(start_height))
+        self.peak = peak
+        return changed
+
+    async def discover_coins(self, start_height: Optional[uint32]) -> List[CBInfo]:
+        """Adds the coins hinted to the manager's wallets from start_height on that the store doesn't hold."""
+        discovered = await self.manager.discover_cb_coins(include_spent_coins=True, start_height=start_height)
+        return [record for _, record in discovered]
+
+    async def process_new_peak(self) -> List[CBInfo]:
+        """Applies the blocks added since the last peak to the store and returns the coins that changed."""
+        peak = await self.get_peak()
+        if peak is None or (self.peak is not None and peak.header_hash == self.peak.header_hash):
+            return []
+        if self.peak is None or peak.height - self.peak.height > MAX_CATCH_UP_BLOCKS:
+            return await self.sync(peak)
+        blocks = await self.get_blocks(uint32(self.peak.height + 1), peak.height)
+        # The new blocks have to extend the last one processed, anything else is a reorg
+        prev_hash = self.peak.header_hash
+        for block in blocks:
+            if block is None or block.prev_hash != prev_hash:
+                log.info(f"Chain reorganized below height {peak.height}, refreshing recent coins")
+                return await self.sync(peak, uint32(max(0, min(self.peak.height, peak.height) - REORG_DEPTH)))
+            prev_hash = block.header_hash
+        if len(blocks) == 0:
+            # A peak at or below the last one processed with a different hash
+            return await self.sync(peak, uint32(max(0, peak.height - REORG_DEPTH)))
+        changed = await self.apply_blocks([block for block in blocks if block is not None])
+        if self.discover:
+            changed.extend(await self.discover_coins(uint32(self.peak.height + 1)))
+        self.peak = blocks[-1]
+        return changed
+
+    async def get_blocks(self, start: uint32, end: uint32) -> List[Optional[BlockRecord]]:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_LOOKUPS)
+
+        async def get_block(height: int) -> Optional[BlockRecord]:
+            async with semaphore:
+                return await self.node_client.get_block_record_by_height(height)
+
+        return list(await asyncio.gather(*(get_block(height) for height in range(start, end + 1))))
+
+    async def apply_blocks(self, blocks: List[BlockRecord]) -> List[CBInfo]:
+        """
+        Fetches the additions and removals of the transaction blocks and updates the tracked coins
+        they touch. Only coins spent in these blocks cost a further lookup, to tell claws from claims.
+        """
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_LOOKUPS)
+
+        async def get_changes(block: BlockRecord) -> Tuple[List[CoinRecord], List[CoinRecord]]:
+            async with semaphore:
+                return await self.node_client.get_additions_and_removals(block.header_hash)
+
+        async def get_outcome(record: CBInfo) -> str:
+            async with semaphore:
+                return await self.manager.get_spend_outcome(record)
+
+        changes = await asyncio.gather(*(get_changes(block) for block in blocks if block.is_transaction_block))
+        # Most tracked coins aren't touched, so only the ones that are get decoded
+        tracked = {record.name(): record for record in await self.manager.cb_store.get_all_unspent_compact_coins()}
+        updated: Dict[bytes32, CBInfo] = {}
+
+        def get_record(name: bytes32) -> Optional[CBInfo]:
+            if name in updated:
+                return updated[name]
+            compact = tracked.get(name)
+            return None if compact is None else compact.to_cb_info()
+
+        for additions, removals in changes:
+            for coin_record in additions:
+                record = get_record(coin_record.name)
+                if record is None:
+                    continue
+                # Height based coins mature at a height, only seconds based ones need the block's timestamp
+                timestamp = coin_record.timestamp if record.timelock_unit == SECONDS else record.timestamp
+                updated[coin_record.name] = dataclasses.replace(
+                    record, confirmed_block_height=coin_record.confirmed_block_index, timestamp=timestamp
+                )
+            for coin_record in removals:
+                record = get_record(coin_record.name)
+                if record is None:
+                    continue
+                updated[coin_record.name] = dataclasses.replace(
+                    record, spent_block_height=coin_record.spent_block_index, spent=True
+                )
+        if len(updated) == 0:
+            return []
+        await self.manager.cb_store.update_coin_states(list(updated.values()))
+        newly_spent = [record for record in updated.values() if record.spent]
+        if len(newly_spent) > 0:
+            outcomes = await asyncio.gather(*(get_outcome(record) for record in newly_spent))
+            await self.manager.cb_store.set_spend_outcomes(
+                dict(zip([record.name() for record in newly_spent], outcomes))
+            )
+        return list(updated.values())
+
+    async def watch(self, interval: float = WATCH_INTERVAL) -> AsyncIterator[List[CBInfo]]:
+        """
+        Starts with a full refresh, then checks for a new peak every interval seconds and yields
+        the coins each check changed, which is often none, so callers can run periodic work
+        between checks. Failed checks are logged and retried on the next interval.
+        """
+        while True:
+            try:
+                changed = await self.process_new_peak()
+            except Exception as e:
+                log.warning(f"Failed to process the new peak: {e}")
+                changed = []
+            yield changed
+            await asyncio.sleep(interval)
@@ -0,0 +1,165 @@
+import cProfile
+import functools
+import json
+import pstats
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import aiosqlite
+from chia.rpc.rpc_client import RpcClient
+
+# Functions listed in the report, by cumulative time
+TOP_FUNCTIONS = 20
+# SQL is cut to this many characters in the trace
+SQL_PREVIEW = 80
+
+# Trace kinds
+RPC = "rpc"
+SQL = "sql"
+
+# Areas whose own CPU time is summed in the report, matched against each profiled function's
+# file and name. blspy's calls don't show up in the profile, their time is the own time of the
+# functions calling them. SQLite runs on aiosqlite's thread, outside the profile, so its time
+# comes from the SQL trace instead.
+HOT_SPOT_AREAS = {
+    "key derivation": ["derive_keys.py", "derive_keys", "get_keys_for_puzzle_hash", "synthetic_secret_key"],
+    "clvm": ["/clvm/", "blockchain_format/program.py", "condition_tools.py", "run_chia_program", "tree_hash"],
+    "signing": ["cb_signing.py", "sign_coin_spends", "AugSchemeMPL"],
+}
+
+
+@dataclass(frozen=True)
+class TraceEntry:
+    kind: str
+    name: str
+    # Seconds from the start of the command
+    start: float
+    duration: float
+    error: Optional[str]
+
+
+def sql_name(args: Tuple[Any, ...]) -> str:
+    """Names an aiosqlite call by its SQL, or by the sqlite3 method it runs when it has none."""
+    if len(args) > 1 and isinstance(args[1], str):
+        return " ".join(args[1].split())[:SQL_PREVIEW]
+    return getattr(args[0], "__name__", repr(args[0]))
+
+
+class CommandProfiler:
+    """
+    Profiles one CLI command. The command's thread is profiled with cProfile, and every RPC to
+    the node or wallet and every SQLite call is traced with how long it was awaited. The profile
+    is written in pstats format, and a JSON report of the hot spots and the trace is written
+    next to it.
+    """
+
+    path: str
+    command: List[str]
+    profile: cProfile.Profile
+    trace: List[TraceEntry]
+    patched: List[Tuple[type, str, Any]]
+    started: float
+
+    def __init__(self, path: str, command: List[str]) -> None:
+        self.path = path
+        self.command = command
+        self.profile = cProfile.Profile()
+        self.trace = []
+        self.patched = []
+        self.started = 0.0
+
+    def patch(self, cls: type, attribute: str, kind: str, name_of: Callable[[Tuple[Any, ...]], str]) -> None:
+        original = getattr(cls, attribute)
+
+        @functools.wraps(original)
+        async def traced(obj, *args, **kwargs):
+            start = time.perf_counter()
+            error = None
+            try:
+                return await original(obj, *args, **kwargs)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                duration = time.perf_counter() - start
+                self.trace.append(TraceEntry(kind, name_of(args), start - self.started, duration, error))
+
+        setattr(cls, attribute, traced)
+        self.patched.append((cls, attribute, original))
+
+    def start(self) -> None:
+        self.started = time.perf_counter()
+        self.patch(RpcClient, "fetch", RPC, lambda args: args[0])
+        self.patch(aiosqlite.Connection, "_execute", SQL, sql_name)
+        self.profile.enable()
+
+    def stop(self) -> Dict[str, Any]:
+        """Stops profiling, writes the profile and the report and returns the report."""
+        self.profile.disable()
+        wall_time = time.perf_counter() - self.started
+        for cls, attribute, original in reversed(self.patched):
+            setattr(cls, attribute, original)
+        self.patched = []
+        self.profile.dump_stats(self.path)
+        report = self.report(wall_time)
+        with open(f"{self.path}.json", "w") as file:
+            json.dump(report, file, indent=2)
+        return report
+
+    def report(self, wall_time: float) -> Dict[str, Any]:
+        stats = pstats.Stats(self.profile)
+        functions: List[Dict[str, Any]] = []
+        areas = {area: 0.0 for area in HOT_SPOT_AREAS}
+        for (filename, line, name), (_, calls, own_time, cumulative_time, _) in stats.stats.items():  # type: ignore
+            label = f"{filename}:{line}({name})"
+            functions.append(
+                {"function": label, "calls": calls, "own_seconds": own_time, "cumulative_seconds": cumulative_time}
+            )
+            for area, patterns in HOT_SPOT_AREAS.items():
+                if any(pattern in label for pattern in patterns):
+                    areas[area] += own_time
+        functions.sort(key=lambda function: function["cumulative_seconds"], reverse=True)
+        calls: Dict[str, Dict[str, Any]] = {}
+        for entry in self.trace:
+            summary = calls.setdefault(
+                f"{entry.kind} {entry.name}", {"calls": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+            )
+            summary["calls"] += 1
+            summary["errors"] += entry.error is not None
+            summary["total_seconds"] += entry.duration
+            summary["max_seconds"] = max(summary["max_seconds"], entry.duration)
+        areas["sqlite"] = sum((entry.duration for entry in self.trace if entry.kind == SQL), 0.0)
+        areas["rpc"] = sum((entry.duration for entry in self.trace if entry.kind == RPC), 0.0)
+        return {
+            "command": self.command,
+            "profile": self.path,
+            "wall_seconds": wall_time,
+            "areas": areas,
+            "top_functions": functions[:TOP_FUNCTIONS],
+            "calls": dict(sorted(calls.items(), key=lambda item: item[1]["total_seconds"], reverse=True)),
+            "trace": [asdict(entry) for entry in self.trace],
+        }
+
+
+def format_summary(report: Dict[str, Any], rows: int = 10) -> str:
+    """Formats a report's time by area and its slowest calls and functions as a table."""
+    lines = [f"Profiled {' '.join(report['command'])} in {report['wall_seconds']:.3f}s"]
+    lines.append("Time by area (RPC and SQLite time is time awaited):")
+    for area, seconds in sorted(report["areas"].items(), key=lambda item: item[1], reverse=True):
+        lines.append(f"  {seconds:9.3f}s  {area}")
+    lines.append("Slowest calls:")
+    lines.append(f"  {'total':>9}  {'max':>9}  {'calls':>6}  call")
+    for name, summary in list(report["calls"].items())[:rows]:
+        lines.append(
+            f"  {summary['total_seconds']:8.3f}s  {summary['max_seconds']:8.3f}s  {summary['calls']:6}  {name}"
+        )
+    lines.append("Hottest functions:")
+    lines.append(f"  {'cumulative':>10}  {'own':>9}  {'calls':>7}  function")
+    for function in report["top_functions"][:rows]:
+        lines.append(
+            f"  {function['cumulative_seconds']:9.3f}s  {function['own_seconds']:8.3f}s  {function['calls']:7}"
+            f"  {function['function']}"
+        )
+    lines.append(f"Profile written to {report['profile']}, report to {report['profile']}.json")
+    return "\n".join(lines)
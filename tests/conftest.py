@@ -0,0 +1,23 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import AsyncIterator
+
+import pytest
+import pytest_asyncio
+from chia.util.db_wrapper import DBWrapper2
+
+from src.drivers.cb_store import CBStore
+from tests.fakes import FakeNodeClient
+
+
+@pytest.fixture
+def node_client() -> FakeNodeClient:
+    return FakeNodeClient()
+
+
+@pytest_asyncio.fixture
+async def cb_store(tmp_path: Path) -> AsyncIterator[CBStore]:
+    store = await CBStore.create(await DBWrapper2.create(database=tmp_path / "clawback.db"))
+    yield store
+    await store.close()
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_record import CoinRecord
+from chia.types.coin_spend import CoinSpend, compute_additions
+from chia.util.hash import std_hash
+from chia.util.ints import uint32, uint64
+
+from src.drivers.cb_info import CBInfo
+
+
+def make_cb_info(seed: int, timestamp: int, timelock: int = 100, amount: Optional[int] = None) -> CBInfo:
+    coin = Coin(bytes32(bytes([seed]) * 32), bytes32(b"\x01" * 32), uint64(1000 + seed if amount is None else amount))
+    return CBInfo(
+        coin,
+        bytes32(b"\x02" * 32),
+        bytes32(b"\x03" * 32),
+        uint64(timelock),
+        uint32(10),
+        uint32(0),
+        False,
+        uint64(timestamp),
+    )
+
+
+def make_coin_record(
+    coin: Coin, confirmed_height: int = 90, spent_height: int = 0, timestamp: int = 9000
+) -> CoinRecord:
+    return CoinRecord(coin, uint32(confirmed_height), uint32(spent_height), False, uint64(timestamp))
+
+
+@dataclass(frozen=True)
+class FakeBlock:
+    height: uint32
+    header_hash: bytes32
+    prev_hash: bytes32
+    is_transaction_block: bool
+    timestamp: Optional[uint64]
+
+
+class FakeNodeClient:
+    """
+    A full node holding a chain of blocks in memory, with the coins each block adds and removes
+    and the spends behind them. Every RPC made is logged in calls.
+    """
+
+    def __init__(self) -> None:
+        self.chain: List[FakeBlock] = []
+        self.records: Dict[bytes32, CoinRecord] = {}
+        self.changes: Dict[bytes32, Tuple[List[CoinRecord], List[CoinRecord]]] = {}
+        self.spends: Dict[bytes32, List[CoinSpend]] = {}
+        # Blocks whose spends the node won't serve in one call
+        self.unavailable: List[bytes32] = []
+        self.calls: List[str] = []
+
+    def add_block(
+        self,
+        additions: Sequence[Coin] = (),
+        removals: Sequence[Coin] = (),
+        spends: Sequence[CoinSpend] = (),
+        transaction: bool = True,
+        spends_available: bool = True,
+        fork: bytes = b"",
+    ) -> FakeBlock:
+        """Adds a block on top of the chain, transaction blocks are 100 seconds apart."""
+        height = uint32(len(self.chain))
+        prev_hash = self.chain[-1].header_hash if self.chain else bytes32(b"\x00" * 32)
+        timestamp = uint64(100 * height) if transaction else None
+        block = FakeBlock(height, std_hash(prev_hash + fork), prev_hash, transaction, timestamp)
+        self.chain.append(block)
+        removals = list(removals) + [spend.coin for spend in spends]
+        additions = list(additions) + [coin for spend in spends for coin in compute_additions(spend)]
+        added = [make_coin_record(coin, height, 0, timestamp or 0) for coin in additions]
+        self.records.update((record.name, record) for record in added)
+        removed: List[CoinRecord] = []
+        for coin in removals:
+            record = self.records.get(coin.name(), make_coin_record(coin, 0))
+            removed.append(make_coin_record(coin, record.confirmed_block_index, height, record.timestamp))
+        self.records.update((record.name, record) for record in removed)
+        self.changes[block.header_hash] = (added, removed)
+        self.spends[block.header_hash] = list(spends)
+        if not spends_available:
+            self.unavailable.append(block.header_hash)
+        return block
+
+    def advance_to(self, height: int) -> None:
+        """Adds empty blocks until the next one added is at the height."""
+        while len(self.chain) < height:
+            self.add_block()
+
+    async def get_blockchain_state(self):
+        self.calls.append("get_blockchain_state")
+        return {"peak": self.chain[-1] if self.chain else None}
+
+    async def get_block_record_by_height(self, height):
+        self.calls.append("get_block_record_by_height")
+        return self.chain[height] if height < len(self.chain) else None
+
+    async def get_block_record(self, header_hash):
+        self.calls.append("get_block_record")
+        return next((block for block in self.chain if block.header_hash == header_hash), None)
+
+    async def get_additions_and_removals(self, header_hash):
+        self.calls.append("get_additions_and_removals")
+        return self.changes[header_hash]
+
+    async def get_block_spends(self, header_hash):
+        self.calls.append("get_block_spends")
+        return None if header_hash in self.unavailable else self.spends[header_hash]
+
+    async def get_puzzle_and_solution(self, coin_id, height):
+        self.calls.append("get_puzzle_and_solution")
+        return next(spend for spend in self.spends[self.chain[height].header_hash] if spend.coin.name() == coin_id)
+
+    async def get_coin_records_by_names(self, names, include_spent_coins=False):
+        self.calls.append("get_coin_records_by_names")
+        return [
+            self.records[name]
+            for name in names
+            if name in self.records and (include_spent_coins or self.records[name].spent_block_index == 0)
+        ]
+
+    async def get_all_mempool_tx_ids(self):
+        self.calls.append("get_all_mempool_tx_ids")
+        return []
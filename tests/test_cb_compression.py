@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+from blspy import AugSchemeMPL, G2Element
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_spend import CoinSpend
+from chia.types.condition_opcodes import ConditionOpcode
+from chia.types.spend_bundle import SpendBundle
+from chia.util.ints import uint64
+from chia.wallet.puzzles.p2_delegated_puzzle_or_hidden_puzzle import puzzle_for_pk, solution_for_conditions
+
+from src.drivers.cb_compression import compress_spend_bundle, generator_coin_spends, generator_cost
+from src.drivers.cb_costs import compute_spend_cost
+from src.drivers.cb_puzzles import create_clawback_puzzle, create_clawback_solution
+
+
+def make_claw_bundle(count: int) -> SpendBundle:
+    inner_puzzle = puzzle_for_pk(AugSchemeMPL.key_gen(bytes([7] * 32)).get_g1())
+    sender_ph = inner_puzzle.get_tree_hash()
+    recipient_ph = bytes32(b"\x02" * 32)
+    timelock = uint64(100)
+    coin_spends = []
+    for i in range(count):
+        puzzle = create_clawback_puzzle(timelock, sender_ph, recipient_ph)
+        coin = Coin(bytes32(i.to_bytes(32, "big")), puzzle.get_tree_hash(), uint64(1000 + i))
+        inner_solution = solution_for_conditions([[ConditionOpcode.CREATE_COIN, sender_ph, coin.amount]])
+        solution = create_clawback_solution(timelock, sender_ph, recipient_ph, inner_puzzle, inner_solution)
+        coin_spends.append(CoinSpend(coin, puzzle, solution))
+    return SpendBundle(coin_spends, G2Element())
+
+
+def test_compression() -> None:
+    spend_bundle = make_claw_bundle(20)
+    generator, report = compress_spend_bundle(spend_bundle)
+    assert generator_coin_spends(generator) == spend_bundle.coin_spends
+    assert report.original_cost == compute_spend_cost(spend_bundle)
+    assert report.compressed_cost == generator_cost(generator)
+    # The shared mods and curried puzzles are only stored once
+    assert report.shared_subtrees > 0
+    assert report.compressed_size * 3 < report.original_size
+    assert report.compressed_cost < report.original_cost
+
+    # A single spend has too little to share, so it's left as it is
+    generator, report = compress_spend_bundle(make_claw_bundle(1))
+    assert report.shared_subtrees == 0
+    assert report.compressed_size == report.original_size
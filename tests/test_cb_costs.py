@@ -0,0 +1,96 @@
+from typing import List
+
+import pytest
+from blspy import G2Element
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.program import Program
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_spend import CoinSpend
+from chia.types.spend_bundle import SpendBundle
+from chia.util.ints import uint64
+
+from src.drivers.cb_costs import (
+    CLAIM,
+    CLAIM_WITH_FEE,
+    CLAW,
+    CLAW_WITH_FEE,
+    CREATE,
+    CREATE_EXTRA_INPUT,
+    MAX_SPEND_BUNDLE_COST,
+    FeePlanner,
+    compute_spend_cost,
+    max_merged_spends,
+    min_replacement_fee,
+    pack_by_cost,
+    standard_spend_costs,
+)
+
+ACS = Program.to(1)
+ACS_PH = ACS.get_tree_hash()
+
+
+def acs_spend(parent: bytes) -> SpendBundle:
+    coin = Coin(bytes32(parent * 32), ACS_PH, 1000)
+    return SpendBundle([CoinSpend(coin, ACS, Program.to([[51, ACS_PH, 1000]]))], G2Element())
+
+
+def test_standard_spend_costs():
+    costs = standard_spend_costs()
+    assert costs[CLAW_WITH_FEE] > costs[CLAW] > 0
+    assert costs[CLAIM_WITH_FEE] > costs[CLAIM] > 0
+    # The claim path reveals the augmented condition puzzle so costs a little more than a claw
+    assert costs[CLAIM] > costs[CLAW]
+    assert costs[CREATE] > costs[CREATE_EXTRA_INPUT] > 0
+
+
+def test_pack_by_cost():
+    bundles = [acs_spend(bytes([i])) for i in range(5)]
+    cost = compute_spend_cost(bundles[0])
+    packed = pack_by_cost(bundles, max_cost=cost * 2)
+    assert len(packed) == 3
+    assert sum(len(bundle.coin_spends) for bundle in packed) == 5
+    assert all(compute_spend_cost(bundle) <= cost * 2 for bundle in packed)
+
+
+def test_max_merged_spends():
+    # Merged claws and claims stay well clear of the per bundle limit
+    assert max_merged_spends(CLAW) * standard_spend_costs()[CLAW] < MAX_SPEND_BUNDLE_COST
+    assert 100 < max_merged_spends(CLAIM) <= max_merged_spends(CLAW)
+
+
+class FakeFeeNodeClient:
+    async def get_fee_estimate(self, target_times, cost):
+        # A mojo per unit of cost
+        return {"estimates": [cost]}
+
+
+@pytest.mark.asyncio
+async def test_fee_planner_rebuild():
+    planner = await FeePlanner.create(FakeFeeNodeClient())  # type: ignore[arg-type]
+    built: List[SpendBundle] = []
+    discarded: List[SpendBundle] = []
+
+    async def build(fee: uint64) -> SpendBundle:
+        built.append(acs_spend(bytes([len(built) + 1])))
+        return built[-1]
+
+    async def discard(spend_bundle: SpendBundle) -> None:
+        discarded.append(spend_bundle)
+
+    # A bundle costing more than estimated is thrown away, and its coins released, before it's rebuilt
+    cost = compute_spend_cost(acs_spend(b"\x01"))
+    spend_bundle, fee = await planner.build_with_fee(build, cost - 1, discard=discard)
+    assert fee == cost
+    assert discarded == built[:1] and spend_bundle == built[1]
+
+    # One priced right is kept
+    built, discarded = [], []
+    spend_bundle, fee = await planner.build_with_fee(build, cost, discard=discard)
+    assert fee == cost and spend_bundle == built[0] and discarded == []
+
+
+def test_min_replacement_fee():
+    # An added fee coin raises the cost, so a large fee needs more than the minimum increase to stay ahead per cost
+    assert min_replacement_fee(100, 1000, 1000) == 101
+    assert min_replacement_fee(10 ** 9, 30 * 10 ** 6, 36 * 10 ** 6) == 12 * 10 ** 8 + 1
+    assert min_replacement_fee(99, 100, 100) * 100 > 99 * 100
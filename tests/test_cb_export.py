@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import dataclasses
+import io
+from pathlib import Path
+
+import pytest
+from chia.util.db_wrapper import DBWrapper2
+from chia.util.ints import uint32
+
+from src.drivers.cb_export import BINARY, BINARY_MAGIC, NDJSON, export_records, import_records
+from src.drivers.cb_info import CLAIMED
+from src.drivers.cb_puzzles import HEIGHT
+from src.drivers.cb_store import CBStore
+from tests.fakes import make_cb_info
+
+
+@pytest.mark.asyncio
+async def test_export_import(tmp_path: Path) -> None:
+    source = await CBStore.create(await DBWrapper2.create(database=tmp_path / "source.db"))
+    target = await CBStore.create(await DBWrapper2.create(database=tmp_path / "target.db"))
+    try:
+        records = [
+            dataclasses.replace(make_cb_info(seed, 1000), confirmed_block_height=uint32(seed)) for seed in range(5)
+        ]
+        records[4] = dataclasses.replace(records[4], timelock_unit=HEIGHT, timestamp=0)
+        for record in records[:3]:
+            await source.scoped(1111).add_coin_record(record)
+        for record in records[3:]:
+            await source.scoped(2222).add_coin_record(record)
+        claimed = dataclasses.replace(records[1], spent_block_height=uint32(7), spent=True)
+        await source.update_coin_states([claimed])
+        await source.set_spend_outcomes({claimed.name(): CLAIMED})
+
+        # Batches pick up where the last one stopped
+        batches = [batch async for batch in source.get_coin_record_batches(batch_size=2)]
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+
+        for export_format in [NDJSON, BINARY]:
+            output = io.BytesIO()
+            assert await export_records(source, output, export_format) == (5, uint32(7))
+            assert output.getvalue().startswith(BINARY_MAGIC) == (export_format == BINARY)
+            # Importing twice doesn't add the coins twice
+            assert await import_records(target, io.BytesIO(output.getvalue())) == (
+                5,
+                5 if export_format == NDJSON else 0,
+            )
+
+        assert await target.scoped(2222).get_coin_records([record.name() for record in records[3:]]) == records[3:]
+        assert await target.scoped(1111).get_coin_record(claimed.name()) == claimed
+        assert await target.get_spend_outcomes() == await source.get_spend_outcomes()
+
+        # An incremental export only holds the coins that changed from that height on
+        output = io.BytesIO()
+        assert await export_records(source, output, NDJSON, uint32(4)) == (2, uint32(7))
+        assert len(output.getvalue().splitlines()) == 2
+    finally:
+        await source.close()
+        await target.close()
@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import dataclasses
+
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.util.ints import uint32, uint64
+
+from src.drivers.cb_info import CLAIMABLE, LOCKED, PENDING, SPENT, CBInfo
+from src.drivers.cb_puzzles import HEIGHT
+
+
+def test_coin_state() -> None:
+    coin = Coin(bytes32(b"\x01" * 32), bytes32(b"\x02" * 32), uint64(1000))
+    pending = CBInfo(
+        coin, bytes32(b"\x03" * 32), bytes32(b"\x04" * 32), uint64(100), uint32(0), uint32(0), False, uint64(0)
+    )
+    assert pending.matures_at() is None
+    assert pending.state(5000, 0) == PENDING
+    assert pending.to_json_dict(5000, 0)["time_left"] is None
+
+    confirmed = dataclasses.replace(pending, confirmed_block_height=uint32(10), timestamp=uint64(1000))
+    assert confirmed.matures_at() == 1100
+    assert confirmed.state(1050, 0) == LOCKED
+    assert confirmed.to_json_dict(1050, 0)["time_left"] == 50
+    assert confirmed.state(1100, 0) == CLAIMABLE
+    assert confirmed.to_json_dict(2000, 0)["time_left"] == 0
+
+    spent = dataclasses.replace(confirmed, spent_block_height=uint32(20), spent=True)
+    details = spent.to_json_dict(2000, 0)
+    assert details["state"] == SPENT
+    assert details["coin_id"] == coin.name().hex()
+
+
+def test_height_coin_state() -> None:
+    coin = Coin(bytes32(b"\x01" * 32), bytes32(b"\x02" * 32), uint64(1000))
+    record = CBInfo(
+        coin, bytes32(b"\x03" * 32), bytes32(b"\x04" * 32), uint64(32), uint32(100), uint32(0), False, uint64(0), HEIGHT
+    )
+    # Maturity only depends on the peak, the timestamp isn't needed
+    assert record.matures_at() == 132
+    assert record.remaining(0, 120) == 11
+    assert record.state(0, 120) == LOCKED
+    assert record.state(0, 131) == CLAIMABLE
+    details = record.to_json_dict(0, 120)
+    assert details["blocks_left"] == 11 and details["time_left"] is None
+    assert details["timelock_unit"] == HEIGHT
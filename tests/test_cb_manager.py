@@ -1,11 +1,15 @@
 from __future__ import annotations
 
+import asyncio
+import dataclasses
+import time
 from pathlib import Path
 from secrets import token_bytes
 from typing import AsyncGenerator, Tuple
 
 import pytest
 import pytest_asyncio
+from chia.full_node.mempool_manager import MEMPOOL_MIN_FEE_INCREASE
 from chia.rpc.full_node_rpc_api import FullNodeRpcApi
 from chia.rpc.full_node_rpc_client import FullNodeRpcClient
 from chia.rpc.rpc_server import start_rpc_server
@@ -16,11 +20,18 @@ from chia.simulator.setup_nodes import setup_simulators_and_wallets
 from chia.simulator.simulator_protocol import FarmNewBlockProtocol
 from chia.types.blockchain_format.sized_bytes import bytes32
 from chia.types.peer_info import PeerInfo
+from chia.types.spend_bundle import SpendBundle
 from chia.util.db_wrapper import DBWrapper2
-from chia.util.ints import uint16, uint64
+from chia.util.ints import uint16, uint32, uint64
 from chia.wallet.wallet import Wallet
 
-from src.drivers.cb_manager import TWO_WEEKS, CBManager
+from src.drivers.cb_consolidation import ConsolidationPolicy, WalletConsolidator
+from src.drivers.cb_costs import CLAW, CREATE, compute_spend_cost
+from src.drivers.cb_info import CLAIMABLE, CLAIMED, CLAWED_BACK, LOCKED
+from src.drivers.cb_manager import TWO_WEEKS, CBManager, CBPayment
+from src.drivers.cb_pending_spend import CONFIRMED, PENDING, REPLACED, PendingSpend
+from src.drivers.cb_puzzles import HEIGHT
+from src.drivers.cb_signing import SigningRequest, sign_request
 from src.drivers.cb_store import CBStore
 
 
@@ -173,9 +184,20 @@ async def test_clawback(
         cb_coin = [coin for coin in spend_to_claw.additions() if coin.amount == amount][0]
         await full_node_api.farm_new_transaction_block(FarmNewBlockProtocol(ph_token))
         await manager.add_new_coin(cb_coin, ph_taker, ph_maker, timelock)
+        await manager.update_records()
         records = await manager.get_cb_coins()
         assert len(records) == 1
         assert list(records)[0].coin == cb_coin
+        assert list(records)[0].confirmed_block_height > 0 and list(records)[0].timestamp > 0
+        refreshed = [record async for batch in manager.refresh_records(records) for record in batch]
+        assert refreshed == records
+        assert refreshed[0].state(int(time.time()), 0) == LOCKED
+
+        # The recipient finds the coin through its hint and checks it against the parent's REMARK
+        discovered = await claim_manager.discover_cb_coins()
+        assert [(record.coin, record.sender_ph) for _, record in discovered] == [(cb_coin, ph_maker)]
+        assert discovered[0][1].timestamp > 0
+        assert await claim_manager.discover_cb_coins() == []
 
         # Try to claim before timelock
         early_claim = await claim_manager.create_claim_spend(cb_coin, ph_taker, fee)
@@ -186,7 +208,11 @@ async def test_clawback(
         # Claw it back
         cb_record = records.copy().pop()
         cb_spend = await manager.create_clawback_spend(cb_record, ph_maker, fee)
+        # The keys derived while signing are remembered for the next spend
+        assert ph_maker in manager.key_cache
         await node_client.push_tx(cb_spend)
+        mempool_item = await node_client.get_mempool_item_by_tx_id(cb_spend.name())
+        assert mempool_item["cost"] == compute_spend_cost(cb_spend)
         cb_coin = [coin for coin in cb_spend.additions() if coin.amount == amount][0]
         await full_node_api.farm_new_transaction_block(FarmNewBlockProtocol(ph_token))
         new_coin = await node_client.get_coin_record_by_name(cb_coin.name())
@@ -194,10 +220,15 @@ async def test_clawback(
 
         # Make another clawback coin
         short_timelock = 100
-        spend_to_claim = await manager.create_cb_coin(amount, ph_taker, ph_maker, short_timelock, fee=fee)
+        spend_to_claim = await manager.create_cb_coin(
+            amount, ph_taker, ph_maker, short_timelock, fee=fee, hint_sender=True
+        )
         claim_coin = [coin for coin in spend_to_claim.additions() if coin.amount == amount][0]
         await node_client.push_tx(spend_to_claim)
         await full_node_api.farm_new_transaction_block(FarmNewBlockProtocol(ph_token))
+        # Only the first memo, the recipient, is indexed as the hint
+        assert claim_coin in [record.coin for record in await node_client.get_coin_records_by_hint(ph_taker)]
+        assert await node_client.get_coin_records_by_hint(ph_maker) == []
 
         # Skip time 1
         full_node_api.use_current_time = False
@@ -212,6 +243,78 @@ async def test_clawback(
         end_balance = await wallet_taker.get_confirmed_balance()
         assert start_balance + amount - fee == end_balance
 
+        # Refreshing the store tells the claw and the claim apart
+        await manager.add_new_coin(claim_coin, ph_taker, ph_maker, short_timelock)
+        await manager.update_records()
+        outcomes = await cb_store.get_spend_outcomes()
+        assert outcomes[CLAWED_BACK] == (1, amount) and outcomes[CLAIMED] == (1, amount)
+
+        # A height locked coin matures after a number of blocks, with no timestamps involved
+        height_lock = 3
+        spend_to_claim = await manager.create_cb_coin(
+            amount, ph_taker, ph_maker, height_lock, fee=fee, timelock_unit=HEIGHT
+        )
+        height_coin = [coin for coin in spend_to_claim.additions() if coin.amount == amount][0]
+        await node_client.push_tx(spend_to_claim)
+        await full_node_api.farm_new_transaction_block(FarmNewBlockProtocol(ph_token))
+        height_info = await claim_manager.get_cb_info_by_id(height_coin.name())
+        assert height_info.timelock_unit == HEIGHT and height_info.timestamp == 0
+        peak_height = await claim_manager.node_client.get_peak_height()
+        assert height_info.state(0, peak_height) == LOCKED
+        # The node holds an early claim back until the height is reached
+        res = await node_client.push_tx(await claim_manager.create_claim_spend(height_coin, ph_taker))
+        assert res["status"] == "PENDING"
+        for _ in range(height_lock):
+            await full_node_api.farm_new_transaction_block(FarmNewBlockProtocol(ph_token))
+        assert height_info.state(0, peak_height + height_lock) == CLAIMABLE
+        # The held back claim enters the mempool once the height is reached and confirms in the block after
+        for _ in range(2):
+            await full_node_api.farm_new_transaction_block(FarmNewBlockProtocol(ph_token))
+        assert (await node_client.get_coin_record_by_name(height_coin.name())).spent
+
+        # Several coins are created in one spend, each read back from its own REMARK
+        merge_amounts = [uint64(1000), uint64(2000), uint64(3000)]
+        payments = [
+            CBPayment(merge_amount, ph_taker, ph_maker, uint64(timelock + i))
+            for i, merge_amount in enumerate(merge_amounts)
+        ]
+        with pytest.raises(ValueError, match="same coin"):
+            await manager.create_cb_coins(payments + payments[:1])
+        spend = await manager.create_cb_coins(payments)
+        await node_client.push_tx(spend)
+        await full_node_api.farm_new_transaction_block(FarmNewBlockProtocol(ph_token))
+        merge_coins = [[coin for coin in spend.additions() if coin.amount == amount][0] for amount in merge_amounts]
+        assert len({coin.parent_coin_info for coin in merge_coins}) == 1
+        merge_infos = [await manager.get_cb_info_by_id(coin.name()) for coin in merge_coins]
+        assert [info.timelock for info in merge_infos] == [timelock, timelock + 1, timelock + 2]
+        resolved = await manager.resolver.resolve(merge_coins)
+        assert [resolved[coin.name()][2] for coin in merge_coins] == [timelock, timelock + 1, timelock + 2]
+
+        # Several coins are clawed back in one bundle into a single coin holding their total
+        merged = await manager.create_merged_clawback_spend(merge_infos, ph_maker, fee)
+        assert await manager.validator.check(merged) > 0
+        # Dropping a coin breaks the announcement the others assert
+        partial = SpendBundle(merged.coin_spends[1:], merged.aggregated_signature)
+        with pytest.raises(ValueError, match="ASSERT_ANNOUNCE_CONSUMED_FAILED"):
+            await manager.validator.check(partial)
+        await node_client.push_tx(merged)
+        await full_node_api.farm_new_transaction_block(FarmNewBlockProtocol(ph_token))
+        outputs = [coin for coin in merged.additions() if coin.puzzle_hash == ph_maker]
+        assert [coin.amount for coin in outputs] == [sum(merge_amounts)]
+        assert (await node_client.get_coin_record_by_name(outputs[0].name())) is not None
+
+        # The maker's wallet is merged down to the policy's limit
+        await full_node_api.wait_for_wallet_synced(wallet_node=wallet_maker.wallet_state_manager.wallet_node)
+        consolidator = await WalletConsolidator.create(manager, ConsolidationPolicy(max_coins=2))
+        before = len(await consolidator.get_spendable_coins())
+        assert before > 2
+        txs = await consolidator.consolidate()
+        assert sum(len(tx.removals) - 1 for tx in txs) == before - 2
+        await full_node_api.process_transaction_records(records=txs)
+        await full_node_api.wait_for_wallet_synced(wallet_node=wallet_maker.wallet_state_manager.wallet_node)
+        assert len(await consolidator.get_spendable_coins()) == 2
+        assert await consolidator.consolidate() == []
+
         # Create a clawback with multiple xch coins
         spendable_balance = await wallet_maker.get_confirmed_balance()
         coins = await wallet_maker.select_coins(uint64(spendable_balance))
@@ -219,7 +322,115 @@ async def test_clawback(
         cb = await manager.create_cb_coin(spendable_balance, ph_taker, ph_maker, timelock, fee=0)
         res = await node_client.push_tx(cb)
         assert res["success"]
+        await full_node_api.farm_new_transaction_block(FarmNewBlockProtocol(ph_token))
+
+        # Claw it back with a spend prepared from the public key and signed offline
+        cb_coin = [coin for coin in cb.additions() if coin.amount == spendable_balance][0]
+        cb_info = await manager.get_cb_info_by_id(cb_coin.name())
+        private_key = await manager.get_private_key()
+        unsigned = await manager.prepare_clawback_spend(cb_info, ph_maker, private_key.get_g1())
+        request = SigningRequest([unsigned])
+        response = sign_request(private_key, request, workers=1)
+        pushed = await manager.submit_signed_spends(request, response)
+        assert len(pushed) == 1
+        await full_node_api.farm_new_transaction_block(FarmNewBlockProtocol(ph_token))
+        coin_record = await node_client.get_coin_record_by_name(cb_coin.name())
+        assert coin_record.spent
 
     finally:
         await cb_store.close()
         await claim_cb_store.close()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_spends(
+    tmp_path: Path,
+    maker_taker_rpc: Tuple[Wallet, WalletRpcClient, Wallet, WalletRpcClient, FullNodeSimulator, FullNodeRpcClient],
+) -> None:
+    wallet_maker, client_maker, wallet_taker, client_taker, full_node_api, node_client = maker_taker_rpc
+    amount = uint64(100000000)
+    ph_maker = await wallet_maker.get_new_puzzlehash()
+    ph_taker = await wallet_taker.get_new_puzzlehash()
+    fee = uint64(10)
+
+    wrapper = await DBWrapper2.create(database=tmp_path / "clawback.db")
+    cb_store = await CBStore.create(wrapper)
+    manager = await CBManager.create(node_client, client_maker, cb_store)
+
+    try:
+        split_tx = await manager.fee_pool.split(3, uint64(1000))
+        await full_node_api.process_transaction_records([split_tx])
+        await manager.fee_pool.refresh()
+        pool = await cb_store.get_fee_coin_records()
+        assert len(pool) == 3
+        assert all(record.confirmed_block_index > 0 for record in pool)
+        pool_coins = set(record.coin for record in pool)
+
+        # Concurrent creations must not select the same input coins
+        creations = await asyncio.gather(
+            *[manager.create_cb_coin(amount, ph_taker, ph_maker, TWO_WEEKS) for _ in range(2)]
+        )
+        assert set(creations[0].removals()).isdisjoint(set(creations[1].removals()))
+        assert not any(coin in pool_coins for spend in creations for coin in spend.removals())
+
+        # Only push one creation and let the tracker rebroadcast the other
+        await node_client.push_tx(creations[0])
+        await manager.tracker.add(creations[0], CREATE)
+        dropped = PendingSpend(
+            creations[1], CREATE, uint64(0), uint64(0), uint64(0), uint32(1), PENDING, uint32(0), uint64(0)
+        )
+        await cb_store.add_pending_spend(dropped)
+        assert len(await manager.tracker.check()) == 2
+        assert (await cb_store.get_pending_spend(creations[1].name())).broadcast_count == 2
+        await full_node_api.process_spend_bundles(creations)
+        assert len(await manager.tracker.check()) == 0
+        assert (await cb_store.get_pending_spend(creations[0].name())).status == CONFIRMED
+        assert (await manager.tracker.get_latency_summary())["confirmed"] == 2
+        await manager.reconcile_reservations()
+        assert len(await cb_store.get_reserved_coins(uint64(0))) == 0
+
+        cb_infos = []
+        for spend in creations:
+            cb_coin = [coin for coin in spend.additions() if coin.amount == amount][0]
+            cb_info = await manager.get_cb_info_by_id(cb_coin.name())
+            assert cb_info is not None
+            cb_infos.append(cb_info)
+
+        # Both claws are built at once and must not pick the same fee coin
+        claws = await asyncio.gather(*[manager.create_clawback_spend(info, ph_maker, fee) for info in cb_infos])
+        fee_coins = [
+            [coin for coin in claw.removals() if coin.name() != info.name()][0] for claw, info in zip(claws, cb_infos)
+        ]
+        assert fee_coins[0] != fee_coins[1]
+        assert set(fee_coins).issubset(pool_coins)
+        for claw in claws:
+            await node_client.push_tx(claw)
+        pending = [await manager.track(claw, CLAW, fee) for claw in claws]
+
+        # Bumping reuses the signed claw and fee coin and replaces the original in the mempool
+        bumped = await manager.bump_fee(pending[0], uint64(fee + 1))
+        assert bumped.fees() == fee + MEMPOOL_MIN_FEE_INCREASE
+        assert claws[0].coin_spends[0] in bumped.coin_spends
+        assert set(claws[0].removals()).issubset(set(bumped.removals()))
+        mempool_ids = await node_client.get_all_mempool_tx_ids()
+        assert bumped.name() in mempool_ids
+        assert claws[0].name() not in mempool_ids
+
+        # A claw whose deadline is near is bumped automatically
+        assert await manager.bump_due_spends() == []
+        await cb_store.add_pending_spend(dataclasses.replace(pending[1], last_broadcast_at=uint64(0)))
+        auto_bumped = await manager.bump_due_spends(margin=TWO_WEEKS * 2)
+        assert len(auto_bumped) == 1
+        assert claws[1].coin_spends[0] in auto_bumped[0].coin_spends
+        assert (await cb_store.get_pending_spend(claws[1].name())).status == REPLACED
+
+        await full_node_api.process_spend_bundles([bumped, auto_bumped[0]])
+        assert len(await manager.tracker.check()) == 0
+
+        # The spent fee coins leave the pool
+        await manager.reconcile_reservations()
+        pool = await cb_store.get_fee_coin_records()
+        assert set(fee_coins).isdisjoint(set(record.coin for record in pool))
+        assert len(await cb_store.get_reserved_coins(uint64(0))) == 0
+    finally:
+        await cb_store.close()
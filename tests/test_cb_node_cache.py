@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Dict, List
+
+import pytest
+from chia.rpc.full_node_rpc_client import FullNodeRpcClient
+from chia.util.ints import uint16
+
+from src.drivers.cb_node_cache import FINALITY_DEPTH, CachingNodeClient
+
+
+class FakeNodeClient(FullNodeRpcClient):
+    def __init__(self, peak_height: int):
+        self.hostname = "localhost"
+        self.port = uint16(8555)
+        self.url = "https://localhost:8555/"
+        self.session = None
+        self.ssl_context = None
+        self.closing_task = None
+        self.peak_height = peak_height
+        self.peak_hash = "00" * 32
+        self.calls: List[str] = []
+
+    async def fetch(self, path, request_json) -> Dict[str, Any]:
+        self.calls.append(path)
+        await asyncio.sleep(0.01)
+        if path == "get_blockchain_state":
+            peak = {"height": self.peak_height, "header_hash": self.peak_hash}
+            return {"success": True, "blockchain_state": {"peak": peak}}
+        return {"success": True, "path": path, "request": request_json}
+
+
+@pytest.mark.asyncio
+async def test_caching() -> None:
+    node = FakeNodeClient(peak_height=100)
+    cache = await CachingNodeClient.from_client(node, coin_record_ttl=60)
+
+    # Concurrent identical lookups share one call, and later ones hit the cache
+    responses = await asyncio.gather(*[cache.fetch("get_coin_record_by_name", {"name": "aa"}) for _ in range(5)])
+    assert all(response == responses[0] for response in responses)
+    await cache.fetch("get_coin_record_by_name", {"name": "aa"})
+    assert node.calls.count("get_coin_record_by_name") == 1
+    assert cache.get_hit_ratios()["get_coin_record_by_name"] == 5 / 6
+
+    # Expired entries are fetched again
+    cache.coin_record_ttl = 0
+    await cache.fetch("get_coin_record_by_name", {"name": "bb"})
+    await cache.fetch("get_coin_record_by_name", {"name": "bb"})
+    assert node.calls.count("get_coin_record_by_name") == 3
+
+    # Uncached calls always go to the node
+    await cache.fetch("push_tx", {})
+    await cache.fetch("push_tx", {})
+    assert node.calls.count("push_tx") == 2
+
+    # Only blocks below the finality depth are kept past the TTL
+    await cache.fetch("get_block_record_by_height", {"height": 100 - FINALITY_DEPTH})
+    await cache.fetch("get_block_record_by_height", {"height": 100})
+    await cache.fetch("get_block_record_by_height", {"height": 100 - FINALITY_DEPTH})
+    await cache.fetch("get_block_record_by_height", {"height": 100})
+    assert node.calls.count("get_block_record_by_height") == 3
+
+    # The peak height is always the node's current one
+    node.peak_height = 101
+    assert await cache.get_peak_height() == 101
+
+    # A reorg clears the immutable entries
+    await cache.fetch("get_puzzle_and_solution", {"coin_id": "aa", "height": 50})
+    await cache.fetch("get_puzzle_and_solution", {"coin_id": "aa", "height": 50})
+    assert node.calls.count("get_puzzle_and_solution") == 1
+    node.peak_height = 90
+    await cache.fetch("get_blockchain_state", {})
+    await cache.fetch("get_puzzle_and_solution", {"coin_id": "aa", "height": 50})
+    assert node.calls.count("get_puzzle_and_solution") == 2
+
+    # Callers can't corrupt the cached response
+    response = await cache.fetch("get_puzzle_and_solution", {"coin_id": "aa", "height": 50})
+    del response["request"]
+    assert "request" in await cache.fetch("get_puzzle_and_solution", {"coin_id": "aa", "height": 50})
+
+
+@pytest.mark.asyncio
+async def test_cache_bounds() -> None:
+    node = FakeNodeClient(peak_height=100)
+    cache = await CachingNodeClient.from_client(node, coin_record_ttl=0, max_immutable=3)
+
+    # Expired entries are dropped as new ones are stored, not only when they're asked for again
+    for name in ["aa", "bb", "cc"]:
+        await cache.fetch("get_coin_record_by_name", {"name": name})
+    assert len(cache.cache) == 1
+
+    # The least recently used immutable entries are evicted and reported
+    for coin_id in ["01", "02", "03"]:
+        await cache.fetch("get_puzzle_and_solution", {"coin_id": coin_id, "height": 50})
+    await cache.fetch("get_puzzle_and_solution", {"coin_id": "01", "height": 50})
+    await cache.fetch("get_puzzle_and_solution", {"coin_id": "04", "height": 50})
+    assert len(cache.immutable) == 3
+    assert cache.get_evictions() == {"get_puzzle_and_solution": 1}
+    await cache.fetch("get_puzzle_and_solution", {"coin_id": "01", "height": 50})
+    assert node.calls.count("get_puzzle_and_solution") == 4
+    await cache.fetch("get_puzzle_and_solution", {"coin_id": "02", "height": 50})
+    assert node.calls.count("get_puzzle_and_solution") == 5
@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any, List, Optional, Tuple
+
+import aiohttp
+import pytest
+from blspy import G2Element
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.program import Program
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_spend import CoinSpend
+from chia.types.condition_opcodes import ConditionOpcode
+from chia.types.spend_bundle import SpendBundle
+from chia.util.hash import std_hash
+from chia.util.ints import uint64
+from clvm.casts import int_to_bytes
+
+from src.drivers.cb_manager import CBPayment
+from src.drivers.cb_payout_queue import PayoutQueue
+
+ACS = Program.to(1)
+ACS_PH = ACS.get_tree_hash()
+SENDER_PH = bytes32(b"\x01" * 32)
+ESTIMATED_FEE = uint64(7)
+
+
+class FakeValidator:
+    def __init__(self) -> None:
+        self.reject = False
+
+    async def check(self, spend_bundle: SpendBundle) -> uint64:
+        if self.reject:
+            raise ValueError("Spend bundle failed validation: MINTING_COIN")
+        return uint64(0)
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeNodeClient:
+    def __init__(self) -> None:
+        self.pushed: List[SpendBundle] = []
+        self.error: Optional[Exception] = None
+
+    async def push_tx(self, spend_bundle: SpendBundle) -> None:
+        if self.error is not None:
+            raise self.error
+        self.pushed.append(spend_bundle)
+
+
+class FakeManager:
+    def __init__(self) -> None:
+        self.validator = FakeValidator()
+        self.node_client = FakeNodeClient()
+        self.discarded: List[SpendBundle] = []
+        self.batches: List[Tuple[List[CBPayment], uint64]] = []
+        self.stored: List[Coin] = []
+        self.tracked: List[Tuple[SpendBundle, str, uint64]] = []
+        self.store_error: Optional[Exception] = None
+
+    def get_cb_puzzle_hash(self, timelock: uint64, recipient_ph: bytes32, sender_ph: bytes32, timelock_unit: str):
+        return std_hash(recipient_ph + sender_ph + int_to_bytes(timelock) + timelock_unit.encode())
+
+    async def build_with_fee(self, build, fee: Optional[uint64], shape: str, target_blocks: int, spends: int = 1):
+        fee = fee if fee is not None else uint64(ESTIMATED_FEE * spends)
+        return await build(fee), fee
+
+    async def create_cb_coins(self, payments: List[CBPayment], fee: uint64, wallet_id: int) -> SpendBundle:
+        self.batches.append((payments, fee))
+        origin = Coin(std_hash(int_to_bytes(len(self.batches))), ACS_PH, uint64(10 ** 9))
+        conditions = [
+            [
+                ConditionOpcode.CREATE_COIN,
+                self.get_cb_puzzle_hash(p.timelock, p.recipient_ph, p.sender_ph, p.timelock_unit),
+                p.amount,
+            ]
+            for p in payments
+        ]
+        return SpendBundle([CoinSpend(origin, ACS, Program.to(conditions))], G2Element())
+
+    async def discard(self, spend: SpendBundle) -> None:
+        self.discarded.append(spend)
+
+    async def add_new_coin(self, coin: Coin, *args: Any) -> None:
+        if self.store_error is not None:
+            raise self.store_error
+        self.stored.append(coin)
+
+    async def track(self, spend: SpendBundle, operation: str, fee: uint64) -> None:
+        self.tracked.append((spend, operation, fee))
+
+
+async def settle() -> None:
+    # Lets the collector take what's queued and start waiting for more, without any time passing
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def payment(index: int, amount: int = 1000) -> CBPayment:
+    return CBPayment(uint64(amount), bytes32(index.to_bytes(32, "big")), SENDER_PH, uint64(100))
+
+
+@pytest.mark.asyncio
+async def test_payout_queue() -> None:
+    manager = FakeManager()
+    clock = FakeClock()
+    queue = await PayoutQueue.create(
+        manager, window=0.05, max_batch_size=3, max_latency=10, clock=clock  # type: ignore[arg-type]
+    )
+
+    # Payments arriving together are created in batches of at most max_batch_size
+    coins = await asyncio.gather(*(queue.submit(payment(i), uint64(2)) for i in range(5)))
+    assert [len(payments) for payments, _ in manager.batches] == [3, 2]
+    assert [fee for _, fee in manager.batches] == [6, 4]
+    assert [coin.amount for coin in coins] == [1000] * 5
+    assert len(set(coins)) == 5
+    assert coins[0].parent_coin_info == coins[2].parent_coin_info != coins[3].parent_coin_info
+    assert manager.stored == coins
+    assert len(manager.node_client.pushed) == len(manager.tracked) == 2
+
+    # A payment that would create the same coin as another goes in the next batch
+    manager.batches = []
+    first, second, other = await asyncio.gather(
+        queue.submit(payment(1)), queue.submit(payment(1)), queue.submit(payment(2), None)
+    )
+    assert [len(payments) for payments, _ in manager.batches] == [2, 1]
+    assert first != second
+    # One payment left the fee to the estimate, so the whole batch does
+    assert manager.batches[0][1] == ESTIMATED_FEE * 2
+
+    # A batch is flushed once its oldest payment has waited for max_latency, even while payments keep arriving
+    manager.batches = []
+    queue.window = 60
+    queue.max_batch_size = 100
+    tasks = [asyncio.ensure_future(queue.submit(payment(10 + i))) for i in range(2)]
+    await settle()
+    clock.now += queue.max_latency
+    tasks.append(asyncio.ensure_future(queue.submit(payment(12))))
+    await asyncio.wait_for(asyncio.gather(*tasks), 5)
+    assert [len(payments) for payments, _ in manager.batches] == [3]
+    queue.window = 0.05
+
+    # A rejected batch fails every payment in it and releases its coins
+    manager.validator.reject = True
+    with pytest.raises(ValueError, match="MINTING_COIN"):
+        await queue.submit(payment(30))
+    assert len(manager.discarded) == 1
+    manager.validator.reject = False
+
+    # A push the node turned down releases the coins too
+    manager.node_client.error = ValueError({"success": False, "error": "DOUBLE_SPEND"})
+    with pytest.raises(ValueError, match="DOUBLE_SPEND"):
+        await queue.submit(payment(32))
+    assert len(manager.discarded) == 2
+
+    # A push that may have reached the node keeps its coins reserved and is tracked for rebroadcast
+    manager.node_client.error = aiohttp.ServerDisconnectedError()
+    coin = await queue.submit(payment(33))
+    assert len(manager.discarded) == 2
+    assert manager.stored[-1] == coin and manager.tracked[-1][0].additions()[0] == coin
+    manager.node_client.error = None
+
+    # The payment still gets its coin if recording it fails after the push
+    manager.store_error = ValueError("database is locked")
+    assert (await queue.submit(payment(34))).amount == 1000
+    manager.store_error = None
+
+    # Closing flushes what's still queued
+    pending = asyncio.ensure_future(queue.submit(payment(31)))
+    await asyncio.sleep(0)
+    await queue.close()
+    assert pending.done() and pending.result().amount == 1000
@@ -1,8 +1,9 @@
 from blspy import G1Element
 from chia.types.blockchain_format.program import Program
+from chia.types.condition_opcodes import ConditionOpcode
 from chia.wallet.puzzles.p2_delegated_puzzle_or_hidden_puzzle import puzzle_for_pk, solution_for_conditions
 
-from src.drivers.cb_puzzles import create_clawback_puzzle, create_clawback_solution
+from src.drivers.cb_puzzles import HEIGHT, create_clawback_puzzle, create_clawback_solution, spent_by_sender
 
 ACS = Program.to(1)
 ACS_PH = ACS.get_tree_hash()
@@ -29,8 +30,26 @@ def test_clawback_puzzles():
 
     conds = clawback_puz.run(cb_sender_sol)
     assert conds
+    assert spent_by_sender(cb_sender_sol, sender_ph)
 
     recipient_sol = Program.to([[51, recipient_ph, amount]])
     cb_recipient_sol = create_clawback_solution(timelock, sender_ph, recipient_ph, recipient_puz, recipient_sol)
     conds = clawback_puz.run(cb_recipient_sol)
     assert conds
+    assert not spent_by_sender(cb_recipient_sol, sender_ph)
+
+
+def test_height_clawback_puzzles():
+    timelock = 32
+    amount = 1000
+    sender_ph = puzzle_for_pk(G1Element()).get_tree_hash()
+
+    clawback_puz = create_clawback_puzzle(timelock, sender_ph, ACS_PH, HEIGHT)
+    assert clawback_puz != create_clawback_puzzle(timelock, sender_ph, ACS_PH)
+
+    recipient_sol = Program.to([[51, ACS_PH, amount]])
+    cb_recipient_sol = create_clawback_solution(timelock, sender_ph, ACS_PH, ACS, recipient_sol, HEIGHT)
+    conds = clawback_puz.run(cb_recipient_sol)
+    assert [ConditionOpcode.ASSERT_HEIGHT_RELATIVE, timelock] in [
+        [bytes(c.first().atom), c.rest().first().as_int()] for c in conds.as_iter()
+    ]
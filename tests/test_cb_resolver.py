@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import pytest
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.program import Program
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_spend import CoinSpend, compute_additions
+from chia.types.condition_opcodes import ConditionOpcode
+from chia.util.ints import uint64
+from clvm.casts import int_to_bytes
+
+from src.drivers.cb_puzzles import HEIGHT, SECONDS
+from src.drivers.cb_resolver import CBDetailsResolver, cb_details_list_from_parent_spend
+from tests.fakes import FakeNodeClient
+
+ACS = Program.to(1)
+ACS_PH = ACS.get_tree_hash()
+SENDER_PH = bytes32(b"\x01" * 32)
+RECIPIENT_PH = bytes32(b"\x02" * 32)
+
+
+def parent_spend(index: int, timelock: int, timelock_unit: str = SECONDS, children: int = 1) -> CoinSpend:
+    parent = Coin(bytes32(index.to_bytes(32, "big")), ACS_PH, uint64(1000))
+    remark = [ConditionOpcode.REMARK, SENDER_PH + RECIPIENT_PH + int_to_bytes(timelock)]
+    if timelock_unit != SECONDS:
+        remark.append(timelock_unit.encode())
+    conditions = [remark] + [[ConditionOpcode.CREATE_COIN, ACS_PH, amount] for amount in range(1, children + 1)]
+    return CoinSpend(parent, ACS, Program.to(conditions))
+
+
+@pytest.mark.asyncio
+async def test_resolve(node_client: FakeNodeClient) -> None:
+    # A payout block with many parents, one with two children and one without a REMARK
+    payouts = [parent_spend(i, 100 + i) for i in range(10)] + [parent_spend(10, 50, HEIGHT, children=2)]
+    no_remark = CoinSpend(Coin(bytes32(b"\xff" * 32), ACS_PH, uint64(1)), ACS, Program.to([[51, ACS_PH, 1]]))
+    node_client.advance_to(20)
+    node_client.add_block(spends=payouts + [no_remark, parent_spend(99, 7)])
+    node_client.advance_to(30)
+    later = node_client.add_block(spends=[parent_spend(11, 300)])
+    coins = [coin for spend in payouts + [no_remark] for coin in compute_additions(spend)]
+    coins.append(Coin(bytes32(b"\xee" * 32), ACS_PH, uint64(1)))
+    coins += compute_additions(node_client.spends[later.header_hash][0])
+
+    resolver = await CBDetailsResolver.create(node_client, batch_size=5, max_concurrent=2)  # type: ignore[arg-type]
+    node_client.calls = []
+    resolved = await resolver.resolve(coins)
+    assert len(resolved) == 13
+    assert resolved[coins[0].name()] == (SENDER_PH, RECIPIENT_PH, 100, SECONDS)
+    assert resolved[coins[10].name()] == resolved[coins[11].name()] == (SENDER_PH, RECIPIENT_PH, 50, HEIGHT)
+    assert resolved[coins[-1].name()] == (SENDER_PH, RECIPIENT_PH, 300, SECONDS)
+    # Parents are looked up in batches and each block's spends are fetched once
+    assert node_client.calls.count("get_coin_records_by_names") == 3
+    assert node_client.calls.count("get_block_spends") == 2
+    assert "get_puzzle_and_solution" not in node_client.calls
+
+    # Blocks whose spends can't be fetched fall back to a lookup per parent
+    node_client.advance_to(40)
+    unavailable = node_client.add_block(spends=[parent_spend(12, 400), parent_spend(13, 500)], spends_available=False)
+    node_client.calls = []
+    late = [coin for spend in node_client.spends[unavailable.header_hash] for coin in compute_additions(spend)]
+    resolved = await resolver.resolve(late)
+    assert [resolved[coin.name()][2] for coin in late] == [400, 500]
+    assert node_client.calls.count("get_puzzle_and_solution") == 2
+
+
+def test_invalid_timelock_unit() -> None:
+    parent = Coin(bytes32(b"\x01" * 32), ACS_PH, uint64(1000))
+    remark = [ConditionOpcode.REMARK, SENDER_PH + RECIPIENT_PH + int_to_bytes(100), b"\xff\xfe"]
+    spend = CoinSpend(parent, ACS, Program.to([remark, [ConditionOpcode.CREATE_COIN, ACS_PH, 1]]))
+    # A unit that isn't even text is rejected like any other unknown unit
+    with pytest.raises(ValueError, match="unknown timelock unit"):
+        cb_details_list_from_parent_spend(spend)
@@ -0,0 +1,65 @@
+import dataclasses
+
+import pytest
+from blspy import AugSchemeMPL, G2Element
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_spend import CoinSpend
+from chia.types.condition_opcodes import ConditionOpcode
+from chia.util.ints import uint32, uint64
+from chia.wallet.puzzles.p2_delegated_puzzle_or_hidden_puzzle import puzzle_for_pk, solution_for_conditions
+
+from src.drivers.cb_costs import CLAW
+from src.drivers.cb_puzzles import create_clawback_puzzle, create_clawback_solution
+from src.drivers.cb_signing import (
+    SigningRequest,
+    SigningResponse,
+    create_unsigned_spend,
+    find_unhardened_key,
+    master_pk_to_wallet_pk_unhardened,
+    merge_signatures,
+    sign_request,
+)
+
+ADDITIONAL_DATA = bytes32(b"\x01" * 32)
+
+
+def test_offline_signing():
+    master_sk = AugSchemeMPL.key_gen(bytes([7] * 32))
+    master_pk = master_sk.get_g1()
+    recipient_ph = bytes32(b"\x02" * 32)
+    timelock = uint64(100)
+
+    spends = []
+    for index in range(3):
+        pk = master_pk_to_wallet_pk_unhardened(master_pk, uint32(index))
+        inner_puzzle = puzzle_for_pk(pk)
+        sender_ph = inner_puzzle.get_tree_hash()
+        assert find_unhardened_key(master_pk, sender_ph, uint32(10)) == (index, pk)
+        puzzle = create_clawback_puzzle(timelock, sender_ph, recipient_ph)
+        coin = Coin(bytes32(bytes([index]) * 32), puzzle.get_tree_hash(), uint64(1000))
+        inner_solution = solution_for_conditions([[ConditionOpcode.CREATE_COIN, sender_ph, coin.amount]])
+        solution = create_clawback_solution(timelock, sender_ph, recipient_ph, inner_puzzle, inner_solution)
+        spends.append(
+            create_unsigned_spend(CoinSpend(coin, puzzle, solution), CLAW, uint32(index), uint64(0), ADDITIONAL_DATA)
+        )
+
+    # The request and response survive the trip through a file
+    request = SigningRequest.from_bytes(bytes(SigningRequest(spends)))
+    response = SigningResponse.from_bytes(bytes(sign_request(master_sk, request, workers=2)))
+    bundles = merge_signatures(request, response)
+    assert len(bundles) == 3
+    for spend, bundle in zip(request.spends, bundles):
+        public_keys = [target.public_key for target in spend.targets]
+        messages = [target.message for target in spend.targets]
+        assert AugSchemeMPL.aggregate_verify(public_keys, messages, bundle.aggregated_signature)
+
+    swapped = SigningResponse([response.signatures[1], response.signatures[0], response.signatures[2]])
+    with pytest.raises(ValueError):
+        merge_signatures(request, swapped)
+    with pytest.raises(ValueError):
+        merge_signatures(request, dataclasses.replace(response, signatures=[G2Element()] * 3))
+
+    # The wrong key can't sign
+    with pytest.raises(ValueError):
+        sign_request(AugSchemeMPL.key_gen(bytes([8] * 32)), request, workers=1)
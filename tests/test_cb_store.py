@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import gc
+import tracemalloc
+from pathlib import Path
+from typing import Callable, List
+
+import aiosqlite
+import pytest
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.util.db_wrapper import DBWrapper2
+from chia.util.ints import uint32, uint64
+
+from src.drivers.cb_info import CLAWED_BACK, SPENT, CBColumns
+from src.drivers.cb_puzzles import HEIGHT
+from src.drivers.cb_store import ONE_DAY, UNSPENT, CBStore, DBSettings, create_db_wrapper
+from tests.fakes import make_cb_info
+
+
+@pytest.mark.asyncio
+async def test_shared_store(tmp_path: Path) -> None:
+    db_path = tmp_path / "clawback.db"
+    # A database from before the fingerprint column was added
+    async with aiosqlite.connect(db_path) as conn:
+        await conn.execute(
+            "CREATE TABLE cb_record(coin_name text PRIMARY KEY, confirmed_height bigint, spent_height bigint,"
+            " spent int, puzzle_hash text, coin_parent text, amount blob, recipient_ph text, sender_ph text,"
+            " timelock bigint, timestamp bigint)"
+        )
+        await conn.commit()
+
+    wrapper = await DBWrapper2.create(database=db_path)
+    cb_store = await CBStore.create(wrapper)
+    try:
+        first = cb_store.scoped(1111)
+        second = cb_store.scoped(2222)
+        await first.add_coin_record(make_cb_info(1, timestamp=1000))
+        await first.add_coin_record(make_cb_info(2, timestamp=5000))
+        await second.add_coin_record(make_cb_info(3, timestamp=1500))
+
+        # Each wallet only sees its own coins, the unscoped store sees all of them
+        assert len(await first.get_all_unspent_coins()) == 2
+        assert await second.get_coin_record(make_cb_info(1, 0).name()) is None
+        assert len(await cb_store.get_all_unspent_coins()) == 3
+        assert await cb_store.get_fingerprints() == [1111, 2222]
+
+        maturing = await cb_store.get_coins_maturing(uint64(1000), uint64(2000), uint32(0), uint32(0))
+        assert [(fingerprint, record.coin.amount) for fingerprint, record in maturing] == [(1111, 1001), (2222, 1003)]
+        assert len(await second.get_coins_maturing(uint64(1000), uint64(2000), uint32(0), uint32(0))) == 1
+
+        # Updating the chain state keeps the coin with its wallet
+        spent = dataclasses.replace(make_cb_info(3, timestamp=1500), spent_block_height=uint32(20), spent=True)
+        await cb_store.update_coin_states([spent])
+        assert (await second.get_coin_record(spent.name())).spent
+        assert len(await second.get_all_unspent_coins()) == 0
+        assert len(await cb_store.get_coins_maturing(uint64(1000), uint64(2000), uint32(0), uint32(0))) == 1
+
+        # Height locked coins mature at a height instead of a time
+        height_locked = dataclasses.replace(make_cb_info(4, timestamp=0, timelock=32), timelock_unit=HEIGHT)
+        await first.add_coin_record(height_locked)
+        assert (await first.get_coin_record(height_locked.name())).timelock_unit == HEIGHT
+        maturing = await cb_store.get_coins_maturing(uint64(1000), uint64(2000), uint32(40), uint32(50))
+        assert [record.name() for _, record in maturing] == [height_locked.name(), make_cb_info(1, 0).name()]
+    finally:
+        await cb_store.close()
+
+
+@pytest.mark.asyncio
+async def test_analytics(tmp_path: Path) -> None:
+    db_path = tmp_path / "clawback.db"
+    # A coin stored before amounts were kept as numbers
+    async with aiosqlite.connect(db_path) as conn:
+        await conn.execute(
+            "CREATE TABLE cb_record(coin_name text PRIMARY KEY, confirmed_height bigint, spent_height bigint,"
+            " spent int, puzzle_hash text, coin_parent text, amount blob, recipient_ph text, sender_ph text,"
+            " timelock bigint, timestamp bigint, fingerprint bigint DEFAULT 0, timelock_unit text DEFAULT 'seconds')"
+        )
+        legacy = make_cb_info(9, timestamp=ONE_DAY * 3)
+        await conn.execute(
+            "INSERT INTO cb_record VALUES(?, 10, 0, 0, ?, ?, ?, ?, ?, 100, ?, 0, 'seconds')",
+            (
+                legacy.name().hex(),
+                legacy.coin.puzzle_hash.hex(),
+                legacy.coin.parent_coin_info.hex(),
+                bytes(uint64(legacy.coin.amount)),
+                legacy.recipient_ph.hex(),
+                legacy.sender_ph.hex(),
+                legacy.timestamp,
+            ),
+        )
+        await conn.commit()
+
+    wrapper = await DBWrapper2.create(database=db_path)
+    cb_store = await CBStore.create(wrapper)
+    try:
+        large = dataclasses.replace(
+            make_cb_info(4, ONE_DAY * 2, amount=2 ** 64 - 1), recipient_ph=bytes32(b"\x04" * 32)
+        )
+        for record in [make_cb_info(1, timestamp=ONE_DAY), make_cb_info(2, timestamp=ONE_DAY * 2), large, large]:
+            await cb_store.add_coin_record(record)
+        clawed = dataclasses.replace(make_cb_info(1, ONE_DAY), spent_block_height=uint32(20), spent=True)
+        spent = dataclasses.replace(make_cb_info(2, ONE_DAY * 2), spent_block_height=uint32(20), spent=True)
+        await cb_store.update_coin_states([clawed, spent])
+        await cb_store.set_spend_outcomes({clawed.name(): CLAWED_BACK})
+
+        async def report():
+            return (
+                await cb_store.get_value_locked(),
+                await cb_store.get_spend_outcomes(),
+                await cb_store.get_value_maturing_by_day(uint64(ONE_DAY), uint32(0), 7),
+            )
+
+        locked, outcomes, maturing = await report()
+        # Amounts sum exactly even past what a 64 bit integer holds
+        assert locked == [(large.recipient_ph, 1, 2 ** 64 - 1), (legacy.recipient_ph, 1, 1009)]
+        assert outcomes == {UNSPENT: (2, 2 ** 64 - 1 + 1009), CLAWED_BACK: (1, 1001), SPENT: (1, 1002)}
+        assert maturing == [(uint64(ONE_DAY * 2), 1, 2 ** 64 - 1), (uint64(ONE_DAY * 3), 1, 1009)]
+
+        # Grouping the records directly gives the same answers as the summary table, and turning
+        # the summaries back on rebuilds it
+        for summaries in [False, True]:
+            cb_store = await CBStore.create(wrapper, summaries=summaries)
+            assert await report() == (locked, outcomes, maturing)
+
+        await cb_store.delete_coin_record(large.name())
+        assert await cb_store.get_value_locked() == [(legacy.recipient_ph, 1, 1009)]
+        assert await cb_store.scoped(1111).get_value_locked() == []
+    finally:
+        await cb_store.close()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_reads(tmp_path: Path) -> None:
+    wrapper = await create_db_wrapper(tmp_path / "clawback.db", DBSettings(reader_count=2, mmap_size=1024 * 1024))
+    cb_store = await CBStore.create(wrapper)
+    try:
+        async with wrapper.reader_no_transaction() as conn:
+            assert list(await conn.execute_fetchall("pragma journal_mode"))[0][0] == "wal"
+            assert list(await conn.execute_fetchall("pragma mmap_size"))[0][0] == 1024 * 1024
+            # NORMAL
+            assert list(await conn.execute_fetchall("pragma synchronous"))[0][0] == 1
+
+        await cb_store.add_coin_record(make_cb_info(1, 1000))
+        # Reads carry on while a write is in progress and see what was last committed
+        async with wrapper.writer():
+            await cb_store.add_coin_record(make_cb_info(2, 1000))
+            unspent = await asyncio.wait_for(asyncio.ensure_future(cb_store.get_all_unspent_coins()), 5)
+            assert len(unspent) == 1
+        assert len(await cb_store.get_all_unspent_coins()) == 2
+    finally:
+        await cb_store.close()
+
+
+@pytest.mark.asyncio
+async def test_compact_records(tmp_path: Path) -> None:
+    cb_store = await CBStore.create(await DBWrapper2.create(database=tmp_path / "clawback.db"))
+    try:
+        pending = dataclasses.replace(make_cb_info(1, timestamp=0), confirmed_block_height=uint32(0))
+        height_locked = dataclasses.replace(make_cb_info(2, timestamp=0, timelock=5), timelock_unit=HEIGHT)
+        records = [pending, height_locked, make_cb_info(3, timestamp=1000), make_cb_info(4, timestamp=2000)]
+        for record in records + [dataclasses.replace(make_cb_info(5, 1000), spent_block_height=uint32(20), spent=True)]:
+            await cb_store.add_coin_record(record)
+
+        compact = sorted(await cb_store.get_all_unspent_compact_coins(), key=lambda record: record.amount)
+        assert [record.to_cb_info() for record in compact] == records
+        assert [record.name() for record in compact] == [record.name() for record in records]
+        assert [record.state(1050, 14) for record in compact] == [record.state(1050, 14) for record in records]
+        assert compact[2].to_json_dict(1050, 14) == records[2].to_json_dict(1050, 14)
+        assert not hasattr(compact[0], "__dict__")
+
+        columns = await cb_store.get_unspent_columns()
+        order = sorted(range(len(columns)), key=lambda i: columns.amounts[i])
+        assert [columns.names[i] for i in order] == [record.name().hex() for record in records]
+        assert [columns.matures_at()[i] for i in order] == [-1, 15, 1100, 2100]
+        assert [columns.remaining(1050, 12)[i] for i in order] == [-1, 2, 50, 1050]
+        # The height locked coin can go in the block after the peak, and the first seconds based coin has matured
+        assert columns.claimable(1100, 14) == (2, records[1].coin.amount + records[2].coin.amount)
+        assert CBColumns.from_records(compact).matures_at() == CBColumns.from_records(records).matures_at()
+    finally:
+        await cb_store.close()
+
+
+def retained_per_record(rows: List, build: Callable) -> float:
+    """Bytes per record still allocated once the records are built and the rows dropped."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        records = [build(row) for row in rows]
+        rows.clear()
+        gc.collect()
+        retained, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(records) > 0
+    return retained / len(records)
+
+
+@pytest.mark.asyncio
+async def test_compact_memory(tmp_path: Path) -> None:
+    cb_store = await CBStore.create(await DBWrapper2.create(database=tmp_path / "clawback.db"))
+    count = 2000
+    try:
+        for i in range(count):
+            record = make_cb_info(0, timestamp=1000 + i)
+            coin = Coin(bytes32(i.to_bytes(32, "big")), record.coin.puzzle_hash, uint64(1000000 + i))
+            await cb_store.add_coin_record(dataclasses.replace(record, coin=coin))
+
+        async def get_rows() -> List:
+            async with cb_store.db_wrapper.reader_no_transaction() as conn:
+                return list(await conn.execute_fetchall("SELECT * FROM cb_record"))
+
+        compact = retained_per_record(await get_rows(), cb_store.compact_cb_info_from_row)
+        eager = retained_per_record(await get_rows(), cb_store.cb_info_from_row)
+        # One packed bytes object and a three slot object, nothing kept from the row
+        assert compact < 320
+        assert compact * 2 < eager
+    finally:
+        await cb_store.close()
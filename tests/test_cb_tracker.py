@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import pytest
+from blspy import G2Element
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.program import Program
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_spend import CoinSpend
+from chia.types.spend_bundle import SpendBundle
+from chia.util.ints import uint64
+
+from src.drivers.cb_costs import CLAW
+from src.drivers.cb_pending_spend import CONFIRMED, FAILED, PENDING
+from src.drivers.cb_reservations import CoinReservations
+from src.drivers.cb_store import CBStore
+from src.drivers.cb_tracker import PendingSpendTracker
+from tests.fakes import FakeNodeClient
+
+ACS = Program.to(1)
+ACS_PH = ACS.get_tree_hash()
+
+
+def acs_spend(index: int, to_puzzle_hash: bytes32 = ACS_PH) -> SpendBundle:
+    coin = Coin(bytes32(bytes([index]) * 32), ACS_PH, uint64(1000))
+    return SpendBundle([CoinSpend(coin, ACS, Program.to([[51, to_puzzle_hash, 1000]]))], G2Element())
+
+
+@pytest.mark.asyncio
+async def test_check(cb_store: CBStore, node_client: FakeNodeClient) -> None:
+    reservations = await CoinReservations.create(node_client, cb_store)  # type: ignore[arg-type]
+    tracker = await PendingSpendTracker.create(node_client, cb_store, reservations)  # type: ignore[arg-type]
+    confirmed, beaten, waiting = acs_spend(1), acs_spend(2), acs_spend(3)
+    for spend in (confirmed, beaten, waiting):
+        await tracker.add(spend, CLAW)
+
+    # The tracked spend's own output is on chain
+    node_client.advance_to(10)
+    node_client.add_block(additions=confirmed.additions(), removals=confirmed.removals())
+    # Another spend, like the recipient's claim, took the coin first
+    conflicting = acs_spend(2, bytes32(b"\x05" * 32))
+    node_client.add_block(additions=conflicting.additions(), removals=conflicting.removals())
+
+    still_pending = await tracker.check(rebroadcast=False)
+    assert [pending.name() for pending in still_pending] == [waiting.name()]
+    confirmed_spend = await cb_store.get_pending_spend(confirmed.name())
+    assert confirmed_spend.status == CONFIRMED and confirmed_spend.confirmed_height == 10
+    assert (await cb_store.get_pending_spend(beaten.name())).status == FAILED
+    assert (await cb_store.get_pending_spend(waiting.name())).status == PENDING
+    assert (await tracker.get_latency_summary())["confirmed"] == 1
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+from typing import List
+
+import pytest
+from blspy import AugSchemeMPL, G2Element, PrivateKey
+from chia.consensus.default_constants import DEFAULT_CONSTANTS
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.program import Program
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_spend import CoinSpend
+from chia.types.condition_opcodes import ConditionOpcode
+from chia.types.spend_bundle import SpendBundle
+from chia.util.ints import uint64
+
+from src.drivers import cb_validator
+from src.drivers.cb_validator import BundleValidator
+from tests.fakes import FakeNodeClient, make_coin_record
+
+ACS = Program.to(1)
+ACS_PH = ACS.get_tree_hash()
+ADDITIONAL_DATA = DEFAULT_CONSTANTS.AGG_SIG_ME_ADDITIONAL_DATA
+SECRET_KEY = PrivateKey.from_bytes(bytes([1] * 32))
+MESSAGE = b"clawback"
+
+
+def make_coin(index: int, amount: int = 1000) -> Coin:
+    return Coin(bytes32(bytes([index]) * 32), ACS_PH, uint64(amount))
+
+
+def signed_spend(coin: Coin, conditions: List[List], signed: bool = True) -> SpendBundle:
+    public_key = SECRET_KEY.get_g1()
+    conditions = [[ConditionOpcode.AGG_SIG_ME, bytes(public_key), MESSAGE]] + conditions
+    signature = AugSchemeMPL.sign(SECRET_KEY, MESSAGE + coin.name() + ADDITIONAL_DATA) if signed else G2Element()
+    return SpendBundle([CoinSpend(coin, ACS, Program.to(conditions))], signature)
+
+
+@pytest.mark.asyncio
+async def test_validate(monkeypatch: pytest.MonkeyPatch, node_client: FakeNodeClient) -> None:
+    coins = [make_coin(i) for i in range(7)]
+    records = [
+        make_coin_record(coins[0]),
+        make_coin_record(coins[1]),
+        make_coin_record(coins[2], spent_height=95),
+        make_coin_record(coins[4]),
+        make_coin_record(coins[5], timestamp=9950),
+        make_coin_record(coins[6]),
+    ]
+    node_client.records.update((record.name, record) for record in records)
+    # The peak isn't a transaction block, timelocks are checked against the one before it at 10000 seconds
+    node_client.advance_to(101)
+    node_client.add_block(transaction=False)
+    validator = await BundleValidator.create(node_client)  # type: ignore[arg-type]
+    validator.additional_data = ADDITIONAL_DATA
+    bundles = [
+        signed_spend(coins[0], [[ConditionOpcode.CREATE_COIN, ACS_PH, 900]]),
+        signed_spend(coins[1], [], signed=False),
+        signed_spend(coins[2], []),
+        signed_spend(coins[3], []),
+        signed_spend(coins[4], [[ConditionOpcode.CREATE_COIN, ACS_PH, 2000]]),
+        signed_spend(coins[5], [[ConditionOpcode.ASSERT_SECONDS_RELATIVE, 100]]),
+        signed_spend(coins[6], [[ConditionOpcode.RESERVE_FEE, 100], [ConditionOpcode.CREATE_COIN, ACS_PH, 1000]]),
+    ]
+    expected = [
+        None,
+        "BAD_AGGREGATE_SIGNATURE",
+        "DOUBLE_SPEND",
+        "UNKNOWN_UNSPENT",
+        "MINTING_COIN",
+        "ASSERT_SECONDS_RELATIVE_FAILED",
+        "RESERVE_FEE_CONDITION_FAILED",
+    ]
+    results = await validator.validate(bundles)
+    assert [result.error for result in results] == expected
+    assert [result.name for result in results] == [bundle.name() for bundle in bundles]
+    assert results[0].cost > 0
+
+    # Large batches are validated across worker processes with the same results
+    monkeypatch.setattr(cb_validator, "MIN_POOL_BUNDLES", 2)
+    validator.workers = 2
+    try:
+        assert [result.error for result in await validator.validate(bundles)] == expected
+        # The worker processes are kept for the next batch
+        executor = validator.executor
+        assert [result.error for result in await validator.validate(bundles)] == expected
+        assert validator.executor is executor
+    finally:
+        validator.close()
+    assert validator.executor is None
+
+    # A coin created in the bundle can be spent in it
+    child = Coin(coins[0].name(), ACS_PH, uint64(900))
+    chained = SpendBundle.aggregate([bundles[0], signed_spend(child, [[ConditionOpcode.CREATE_COIN, ACS_PH, 900]])])
+    assert await validator.check(chained) > results[0].cost
+
+    with pytest.raises(ValueError, match="DOUBLE_SPEND"):
+        await validator.check(bundles[2])
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import dataclasses
+from typing import AsyncIterator, List, Optional, Tuple
+
+import pytest
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.util.ints import uint32
+
+from src.drivers.cb_info import CLAWED_BACK, CBInfo
+from src.drivers.cb_store import CBStore
+from src.drivers.cb_watcher import CBWatcher
+from tests.fakes import FakeNodeClient, make_cb_info
+
+
+class FakeManager:
+    def __init__(self, cb_store: CBStore) -> None:
+        self.cb_store = cb_store
+        self.refreshed: List[bytes32] = []
+        # Coins hinted to the wallet by the height they were created at
+        self.hinted: List[Tuple[int, CBInfo]] = []
+        self.discovered_from: List[Optional[uint32]] = []
+
+    async def refresh_records(self, records: List[CBInfo]) -> AsyncIterator[List[CBInfo]]:
+        self.refreshed.extend(record.name() for record in records)
+        yield records
+
+    async def get_spend_outcome(self, cb_info: CBInfo) -> str:
+        return CLAWED_BACK
+
+    async def discover_cb_coins(self, include_spent_coins: bool = False, start_height: Optional[uint32] = None):
+        self.discovered_from.append(start_height)
+        found = [record for height, record in self.hinted if start_height is None or height >= start_height]
+        await self.cb_store.add_coin_records([(None, record, None) for record in found])
+        return [(1111, record) for record in found]
+
+
+@pytest.mark.asyncio
+async def test_watcher(cb_store: CBStore, node_client: FakeNodeClient) -> None:
+    pending = dataclasses.replace(make_cb_info(1, timestamp=0), confirmed_block_height=uint32(0))
+    confirmed = make_cb_info(2, timestamp=1000)
+    untracked = make_cb_info(3, timestamp=1000)
+    await cb_store.add_coin_record(pending)
+    await cb_store.add_coin_record(confirmed)
+    node_client.advance_to(3)
+    manager = FakeManager(cb_store)
+    watcher = await CBWatcher.create(node_client, manager)  # type: ignore[arg-type]
+
+    # The first peak refreshes every unspent coin
+    assert await watcher.process_new_peak() == []
+    assert sorted(manager.refreshed) == sorted([pending.name(), confirmed.name()])
+
+    # Later peaks only look at the new blocks, and only transaction blocks have changes to fetch
+    block = node_client.add_block(additions=[pending.coin, untracked.coin], removals=[confirmed.coin])
+    node_client.add_block(transaction=False)
+    node_client.calls = []
+    changed = await watcher.process_new_peak()
+    assert node_client.calls.count("get_block_record_by_height") == 2
+    assert node_client.calls.count("get_additions_and_removals") == 1
+    assert sorted(changed, key=lambda record: record.coin.amount) == [
+        dataclasses.replace(pending, confirmed_block_height=uint32(3), timestamp=block.timestamp),
+        dataclasses.replace(confirmed, spent_block_height=uint32(3), spent=True),
+    ]
+    assert await cb_store.get_coin_record(untracked.name()) is None
+    assert (await cb_store.get_coin_record(pending.name())).confirmed_block_height == 3
+    assert (await cb_store.get_spend_outcomes())[CLAWED_BACK] == (1, confirmed.coin.amount)
+
+    # Nothing is fetched but the peak while it stays the same
+    node_client.calls = []
+    assert await watcher.process_new_peak() == []
+    assert node_client.calls == ["get_blockchain_state"]
+
+    # A reorg refreshes the coins that changed near the old peak along with the unspent ones
+    node_client.chain.pop()
+    node_client.add_block(fork=b"\x01")
+    node_client.add_block()
+    manager.refreshed = []
+    await watcher.process_new_peak()
+    assert sorted(manager.refreshed) == sorted([pending.name(), confirmed.name()])
+    assert watcher.peak == node_client.chain[-1]
+
+
+@pytest.mark.asyncio
+async def test_watcher_discover(cb_store: CBStore, node_client: FakeNodeClient) -> None:
+    node_client.advance_to(3)
+    manager = FakeManager(cb_store)
+    watcher = await CBWatcher.create(node_client, manager, discover=True)  # type: ignore[arg-type]
+
+    # The first peak looks over the whole chain
+    early = make_cb_info(1, timestamp=1000)
+    manager.hinted = [(1, early)]
+    assert await watcher.process_new_peak() == [early]
+    assert manager.discovered_from == [None]
+
+    # Later peaks only look from the first new block on, and add what they find
+    late = make_cb_info(2, timestamp=1000)
+    manager.hinted = [(3, late)]
+    node_client.add_block(additions=[late.coin])
+    assert await watcher.process_new_peak() == [late]
+    assert manager.discovered_from == [None, 3]
+    assert await cb_store.get_coin_record(late.name()) == late
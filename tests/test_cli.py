@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import asyncio
+import io
+import json
+from typing import Any, Dict, List, Optional
+
+import pytest
+from blspy import G2Element
+from chia.types.spend_bundle import SpendBundle
+from chia.util.ints import uint64
+from click.testing import CliRunner
+
+from src.cli.main import build_groups, cli, push_groups, run_batch, split_fee
+from src.drivers.cb_costs import CLAW, CLAW_WITH_FEE
+
+
+class FakeValidator:
+    async def check(self, spend_bundle: SpendBundle) -> uint64:
+        if spend_bundle.aggregated_signature != G2Element():
+            raise ValueError("Spend bundle failed validation: BAD_AGGREGATE_SIGNATURE")
+        return uint64(0)
+
+
+class FakeManager:
+    def __init__(self) -> None:
+        self.validator = FakeValidator()
+        self.fees: List[Optional[uint64]] = []
+        self.discarded: List[SpendBundle] = []
+        self.tracked: List[SpendBundle] = []
+
+    async def build_with_fee(self, build, fee: Optional[uint64], shape: str, target_blocks: int, spends: int = 1):
+        self.fees.append(fee)
+        return await build(fee), fee
+
+    async def discard(self, spend: SpendBundle) -> None:
+        self.discarded.append(spend)
+
+    async def track(self, spend: SpendBundle, operation: str, fee: uint64) -> None:
+        self.tracked.append(spend)
+
+
+@pytest.mark.asyncio
+async def test_run_batch() -> None:
+    running = 0
+    most_running = 0
+
+    async def run(operation: Dict[str, Any]) -> Dict[str, Any]:
+        nonlocal running, most_running
+        running += 1
+        most_running = max(most_running, running)
+        # Later lines finish first
+        await asyncio.sleep(0.05 / operation["n"])
+        running -= 1
+        if operation["op"] == "fail":
+            raise ValueError("failed on purpose")
+        return {"n": operation["n"]}
+
+    lines = [json.dumps({"op": "show", "n": n, "id": f"op-{n}"}) for n in range(1, 5)]
+    lines += ["", "not json", json.dumps({"op": "fail", "n": 5}), "[1, 2]"]
+    output = io.StringIO()
+    assert await run_batch(io.StringIO("\n".join(lines) + "\n"), output, run, concurrency=2) == (7, 3)
+    assert most_running == 2
+
+    results = {result["line"]: result for result in map(json.loads, output.getvalue().splitlines())}
+    assert sorted(results) == [1, 2, 3, 4, 6, 7, 8]
+    assert results[3] == {"line": 3, "id": "op-3", "op": "show", "n": 3, "success": True}
+    assert results[7] == {"line": 7, "op": "fail", "success": False, "error": "failed on purpose"}
+    assert not results[6]["success"]
+    assert results[8]["error"] == "Each line must hold a JSON object"
+
+
+def test_watch_rejects_auto_consolidation_fee() -> None:
+    # Consolidations have no standard size to estimate a fee for, and must not silently pay nothing
+    result = CliRunner().invoke(cli, ["watch", "--max-coins", "10", "--consolidation-fee", "auto"])
+    assert result.exit_code == 2
+    assert "consolidation fee must be an amount of XCH" in result.output
+
+
+def test_split_fee() -> None:
+    assert split_fee(uint64(100), [3, 3, 1]) == [44, 42, 14]
+    assert split_fee(None, [3, 1]) == [None, None]
+
+
+@pytest.mark.asyncio
+async def test_groups() -> None:
+    manager = FakeManager()
+    invalid = G2Element.generator()
+
+    async def build(group: List[int], fee: uint64) -> SpendBundle:
+        # The group holding coin 0 gets a spend the validator turns down
+        return SpendBundle([], invalid if 0 in group else G2Element())
+
+    # Every group is checked before any is pushed, a bad one releases the spends built before it
+    with pytest.raises(ValueError, match="BAD_AGGREGATE_SIGNATURE"):
+        await build_groups(manager, [[1, 2], [0]], build, uint64(30), CLAW_WITH_FEE, 1)  # type: ignore[arg-type]
+    assert manager.fees == [20, 10]
+    assert len(manager.discarded) == 2
+
+    # A push turned down after others went out says what was submitted
+    manager.discarded = []
+    built = [(SpendBundle([], G2Element()), uint64(5)) for _ in range(3)]
+    pushed: List[int] = []
+
+    async def push(index: int, spend: SpendBundle, fee: uint64) -> None:
+        if index == 1:
+            raise ValueError("wallet rejected the spend")
+        pushed.append(index)
+
+    with pytest.raises(ValueError, match="Submitted 1 of 3 spends"):
+        await push_groups(manager, built, push, CLAW)  # type: ignore[arg-type]
+    assert pushed == [0] and len(manager.tracked) == 1 and len(manager.discarded) == 2
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Dict, List
+
+import aiohttp
+import pytest
+from chia.rpc.full_node_rpc_client import FullNodeRpcClient
+from chia.util.ints import uint16
+
+import src.clients
+from src.clients import FullNodeClientPool, NodeClient, SharedSession, WalletClient, parse_node_url
+
+
+class FakeNodeClient(FullNodeRpcClient):
+    def __init__(self, port: int, failures: int = 0, error: Exception = aiohttp.ServerDisconnectedError()):
+        self.hostname = "localhost"
+        self.port = uint16(port)
+        self.url = f"https://localhost:{port}/"
+        self.session = None
+        self.ssl_context = None
+        self.closing_task = None
+        self.failures = failures
+        self.error = error
+        self.calls: List[str] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def fetch(self, path, request_json) -> Dict[str, Any]:
+        self.calls.append(path)
+        if self.failures > 0:
+            self.failures -= 1
+            raise self.error
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        return {"success": True, "port": self.port}
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(src.clients, "BACKOFF_BASE", 0)
+
+
+@pytest.mark.asyncio
+async def test_failover() -> None:
+    down = FakeNodeClient(1, failures=1)
+    up = FakeNodeClient(2)
+    pool = await FullNodeClientPool.from_clients([down, up])
+    assert (await pool.fetch("get_blockchain_state", {}))["port"] == 2
+    assert pool.endpoints[0].failures == 1
+    # The failed node is skipped until its backoff is over
+    pool.endpoints[0].retry_at = float("inf")
+    assert pool.ranked_endpoints()[0].client is up
+    await pool.fetch("get_blockchain_state", {})
+    assert down.calls == ["get_blockchain_state"]
+
+
+@pytest.mark.asyncio
+async def test_retry() -> None:
+    flaky = FakeNodeClient(1, failures=2)
+    pool = await FullNodeClientPool.from_clients([flaky])
+    assert (await pool.fetch("get_coin_record_by_name", {}))["port"] == 1
+    assert len(flaky.calls) == 3
+    assert pool.endpoints[0].failures == 0
+
+    # A push that may have reached the node is never sent again
+    flaky.failures = 1
+    with pytest.raises(aiohttp.ServerDisconnectedError):
+        await pool.fetch("push_tx", {})
+    assert flaky.calls[-1] == "push_tx" and len(flaky.calls) == 4
+
+    down = FakeNodeClient(1, failures=5)
+    pool = await FullNodeClientPool.from_clients([down])
+    with pytest.raises(ConnectionError):
+        await pool.fetch("get_coin_record_by_name", {})
+
+
+@pytest.mark.asyncio
+async def test_routing() -> None:
+    slow = FakeNodeClient(1)
+    fast = FakeNodeClient(2)
+    pool = await FullNodeClientPool.from_clients([slow, fast], max_in_flight=2)
+    pool.endpoints[0].latency = 1.0
+    pool.endpoints[1].latency = 0.1
+    await asyncio.gather(*[pool.fetch("get_coin_record_by_name", {}) for _ in range(6)])
+    assert len(slow.calls) == 0
+    assert fast.max_in_flight == 2
+
+
+@pytest.mark.asyncio
+async def test_shared_session() -> None:
+    clients = [NodeClient(), NodeClient(), WalletClient()]
+    for port, client in enumerate(clients):
+        client.hostname = "localhost"
+        client.port = uint16(port)
+        client.url = f"https://localhost:{port}/"
+        client.ssl_context = None
+        client.session = SharedSession.acquire()
+        client.closing_task = None
+    pool = await FullNodeClientPool.from_clients(clients[:2])
+    session = pool.session
+    assert all(client.session is session for client in clients)
+
+    # Closing the pool releases each of its clients once and leaves the session to the wallet
+    pool.close()
+    pool.close()
+    await pool.await_closed()
+    assert not session.closed
+    clients[2].close()
+    await clients[2].await_closed()
+    assert session.closed
+
+    # The next client gets a new session
+    next_session = SharedSession.acquire()
+    assert next_session is not session
+    await SharedSession.release(next_session)
+    assert next_session.closed
+
+
+def test_parse_node_url() -> None:
+    assert parse_node_url("node.example.com:8555") == ("node.example.com", 8555)
+    with pytest.raises(ValueError):
+        parse_node_url("8555")
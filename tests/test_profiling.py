@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import json
+import pstats
+from pathlib import Path
+
+import aiosqlite
+import pytest
+from chia.rpc.rpc_client import RpcClient
+from chia.types.blockchain_format.program import Program
+
+from src.profiling import RPC, SQL, CommandProfiler, format_summary
+
+
+class OfflineSession:
+    def post(self, *args, **kwargs):
+        raise ConnectionError("node is offline")
+
+
+@pytest.mark.asyncio
+async def test_command_profiler(tmp_path: Path) -> None:
+    path = str(tmp_path / "claw.prof")
+    original_fetch = RpcClient.fetch
+    profiler = CommandProfiler(path, ["claw", "-c", "aa"])
+    profiler.start()
+    async with aiosqlite.connect(tmp_path / "clawback.db") as conn:
+        await conn.execute("CREATE TABLE t(x int)")
+        await conn.execute_fetchall("SELECT   *\n  FROM t")
+    client = RpcClient()
+    client.url = "https://localhost:8555/"
+    client.session = OfflineSession()  # type: ignore[assignment]
+    client.ssl_context = None
+    with pytest.raises(ConnectionError):
+        await client.fetch("get_coin_record_by_name", {})
+    Program.to([1, 2]).get_tree_hash()
+    report = profiler.stop()
+
+    # The patched calls are put back once profiling stops
+    assert RpcClient.fetch is original_fetch
+    assert len(pstats.Stats(path).stats) > 0  # type: ignore[attr-defined]
+    with open(f"{path}.json") as file:
+        assert json.load(file) == json.loads(json.dumps(report))
+
+    traced = [(entry["kind"], entry["name"], entry["error"]) for entry in report["trace"]]
+    assert (SQL, "SELECT * FROM t", None) in traced
+    assert (RPC, "get_coin_record_by_name", "ConnectionError: node is offline") in traced
+    assert report["calls"]["rpc get_coin_record_by_name"]["errors"] == 1
+    assert report["areas"]["sqlite"] > 0 and report["areas"]["rpc"] > 0
+    assert report["top_functions"][0]["cumulative_seconds"] >= report["top_functions"][-1]["cumulative_seconds"]
+    summary = format_summary(report)
+    assert "Profiled claw -c aa" in summary and "sql SELECT * FROM t" in summary